@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks del procesador de CFDIs
+
+Uso:
+    python benchmark_cfdi.py extraccion --n 3000
+    python benchmark_cfdi.py extraccion --dir ./recibidas
+    python benchmark_cfdi.py fusion --n 1000 5000
+    python benchmark_cfdi.py tabla --filas 500000
+    python benchmark_cfdi.py excel --filas 200000
+
+Sin --dir se genera un corpus sintético de CFDI 4.0 en un directorio temporal.
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid as uuid_lib
+
+from satcfdi import render
+from satcfdi.cfdi import CFDI
+
+from cfdi_excel import escribir_excel, hojas_resumen
+from cfdi_extractor import COLUMNAS, TablaConceptos, procesar_xml
+from cfdi_pdf import fusionar_pdfs
+
+_PLANTILLA_CFDI = """<?xml version="1.0" encoding="UTF-8"?>
+<cfdi:Comprobante xmlns:cfdi="http://www.sat.gob.mx/cfd/4" xmlns:tfd="http://www.sat.gob.mx/TimbreFiscalDigital" Version="4.0" Serie="A" Folio="{folio}" Fecha="2025-{mes:02d}-{dia:02d}T10:00:00" Sello="x" NoCertificado="30001000000400002434" Certificado="x" SubTotal="{subtotal:.2f}" Moneda="MXN" Total="{total:.2f}" TipoDeComprobante="{tipo}" Exportacion="01" MetodoPago="PUE" FormaPago="03" LugarExpedicion="01000">
+<cfdi:Emisor Rfc="{emisor}" Nombre="EMISOR {emisor}" RegimenFiscal="601"/>
+<cfdi:Receptor Rfc="{receptor}" Nombre="RECEPTOR {receptor}" DomicilioFiscalReceptor="01000" RegimenFiscalReceptor="601" UsoCFDI="G03"/>
+<cfdi:Conceptos>
+{conceptos}
+</cfdi:Conceptos>
+<cfdi:Impuestos TotalImpuestosTrasladados="{iva:.2f}">
+<cfdi:Traslados><cfdi:Traslado Base="{subtotal:.2f}" Impuesto="002" TipoFactor="Tasa" TasaOCuota="0.160000" Importe="{iva:.2f}"/></cfdi:Traslados>
+</cfdi:Impuestos>
+<cfdi:Complemento><tfd:TimbreFiscalDigital Version="1.1" UUID="{uuid}" FechaTimbrado="2025-{mes:02d}-{dia:02d}T10:00:01" RfcProvCertif="SAT970701NN3" SelloCFD="x" NoCertificadoSAT="30001000000400002495" SelloSAT="x"/></cfdi:Complemento>
+</cfdi:Comprobante>
+"""
+
+_PLANTILLA_CONCEPTO = """<cfdi:Concepto ClaveProdServ="{clave}" Cantidad="1" ClaveUnidad="E48" Unidad="Servicio" Descripcion="Servicio {i}" ValorUnitario="{importe:.2f}" Importe="{importe:.2f}" ObjetoImp="02">
+<cfdi:Impuestos><cfdi:Traslados><cfdi:Traslado Base="{importe:.2f}" Impuesto="002" TipoFactor="Tasa" TasaOCuota="0.160000" Importe="{iva:.2f}"/></cfdi:Traslados>
+<cfdi:Retenciones><cfdi:Retencion Base="{importe:.2f}" Impuesto="001" TipoFactor="Tasa" TasaOCuota="0.100000" Importe="{isr:.2f}"/></cfdi:Retenciones></cfdi:Impuestos>
+</cfdi:Concepto>"""
+
+_CLAVES = ["80111600", "43211500", "81112100", "84111506", "78101800"]
+_RFCS = ["AAA010101AAA", "BBB010101BBB", "CCC010101CCC", "XAXX010101000"]
+
+
+def generar_corpus(directorio, n, semilla=2025):
+    """Escribe n XMLs sintéticos (1 a 5 conceptos cada uno) en directorio"""
+    rnd = random.Random(semilla)
+    os.makedirs(directorio, exist_ok=True)
+    for k in range(n):
+        importes = [rnd.uniform(100, 5000) for _ in range(rnd.randint(1, 5))]
+        conceptos = "\n".join(
+            _PLANTILLA_CONCEPTO.format(
+                clave=rnd.choice(_CLAVES),
+                i=i,
+                importe=importe,
+                iva=importe * 0.16,
+                isr=importe * 0.10,
+            )
+            for i, importe in enumerate(importes)
+        )
+        subtotal = sum(importes)
+        xml = _PLANTILLA_CFDI.format(
+            folio=k,
+            mes=rnd.randint(1, 12),
+            dia=rnd.randint(1, 28),
+            subtotal=subtotal,
+            total=subtotal * 1.16,
+            iva=subtotal * 0.16,
+            tipo=rnd.choice("IIIE"),
+            emisor=rnd.choice(_RFCS),
+            receptor=rnd.choice(_RFCS),
+            conceptos=conceptos,
+            uuid=str(uuid_lib.UUID(int=rnd.getrandbits(128))).upper(),
+        )
+        with open(os.path.join(directorio, f"cfdi_{k:06d}.xml"), "w") as f:
+            f.write(xml)
+    return directorio
+
+
+def _extraer_legacy_json(xml_content, archivo, categoria):
+    """Ruta anterior: CFDI -> render.json_str -> json.loads -> filas"""
+    cfdi = CFDI.from_string(xml_content)
+    json_data = json.loads(render.json_str(cfdi))
+    tipo = json_data.get("TipoDeComprobante", "")
+    uuid = (
+        json_data.get("Complemento", {}).get("TimbreFiscalDigital", {}).get("UUID", "")
+    )
+    filas = []
+    for concepto in json_data.get("Conceptos", []):
+        fila = {
+            "Archivo_XML": archivo,
+            "UUID": uuid,
+            "Monto": float(concepto.get("Importe", 0)),
+            "Categoria": categoria,
+        }
+        impuestos = concepto.get("Impuestos", {})
+        if tipo.startswith("I") or tipo.startswith("E"):
+            iva = 0
+            for key, traslado in impuestos.get("Traslados", {}).items():
+                if "002" in key:
+                    iva += float(traslado.get("Importe", 0))
+            fila["IVA"] = iva
+        filas.append(fila)
+    return filas
+
+
+def _leer_corpus(directorio):
+    archivos = sorted(glob.glob(os.path.join(directorio, "*.xml")))
+    contenidos = []
+    for archivo in archivos:
+        with open(archivo, "rb") as f:
+            contenidos.append((os.path.basename(archivo), f.read()))
+    return contenidos
+
+
+def _medir(nombre, funcion, contenidos):
+    inicio = time.perf_counter()
+    conceptos = 0
+    for archivo, xml_content in contenidos:
+        conceptos += len(funcion(xml_content, archivo, "Bench"))
+    transcurrido = time.perf_counter() - inicio
+    por_archivo_ms = transcurrido / len(contenidos) * 1000
+    print(
+        f"{nombre:<28} {transcurrido:8.2f} s   {por_archivo_ms:7.3f} ms/archivo   "
+        f"{conceptos} conceptos"
+    )
+    return por_archivo_ms
+
+
+def bench_extraccion(args):
+    """Compara la ruta JSON anterior con el motor compartido"""
+    with tempfile.TemporaryDirectory() as tmp:
+        directorio = args.dir or generar_corpus(tmp, args.n)
+        contenidos = _leer_corpus(directorio)
+        if not contenidos:
+            print(f"No se encontraron XMLs en {directorio}")
+            return 1
+
+        print(f"Corpus: {len(contenidos)} XMLs")
+        antes = _medir("Antes (json_str round trip)", _extraer_legacy_json, contenidos)
+        despues = _medir(
+            "Después (cfdi_extractor)",
+            lambda x, a, c: procesar_xml(x, a, c)[1],
+            contenidos,
+        )
+        print(f"Mejora por archivo: {antes / despues:.2f}x")
+    return 0
+
+
+def generar_pdfs_sinteticos(directorio, n, semilla=2025):
+    """Escribe n PDFs de 1 a 3 páginas con reportlab y regresa sus rutas"""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    rnd = random.Random(semilla)
+    rutas = []
+    for k in range(n):
+        ruta = os.path.join(directorio, f"cfdi_{k:06d}.pdf")
+        c = canvas.Canvas(ruta, pagesize=letter)
+        for pagina in range(rnd.randint(1, 3)):
+            c.setFont("Helvetica-Bold", 14)
+            c.drawString(72, 720, f"CFDI {k:06d} - Página {pagina + 1}")
+            c.setFont("Helvetica", 9)
+            for linea in range(40):
+                c.drawString(72, 690 - linea * 15, f"Concepto {linea} " + "x" * 60)
+            c.showPage()
+        c.save()
+        rutas.append(ruta)
+    return rutas
+
+
+def _fusion_legacy(rutas, destino):
+    """Ruta anterior: BytesIO por PDF -> PdfMerger -> BytesIO de salida"""
+    from PyPDF2 import PdfMerger
+
+    contenidos = []
+    for ruta in rutas:
+        with open(ruta, "rb") as f:
+            contenidos.append(f.read())
+
+    merger = PdfMerger()
+    for contenido in contenidos:
+        merger.append(io.BytesIO(contenido))
+    output_buffer = io.BytesIO()
+    merger.write(output_buffer)
+    merger.close()
+    datos = output_buffer.getvalue()
+    with open(destino, "wb") as f:
+        f.write(datos)
+
+
+def _medir_memoria(nombre, funcion, *args):
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    funcion(*args)
+    transcurrido = time.perf_counter() - inicio
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{nombre:<28} {transcurrido:8.2f} s   pico {pico / 2**20:9.1f} MiB")
+
+
+def bench_fusion(args):
+    """Compara memoria pico de PdfMerger en memoria contra la fusión en streaming"""
+    for n in args.n:
+        with tempfile.TemporaryDirectory() as tmp:
+            rutas = generar_pdfs_sinteticos(tmp, n)
+            print(f"Fusión de {n} PDFs")
+            destino = os.path.join(tmp, "consolidado.pdf")
+            _medir_memoria(
+                "Antes (PdfMerger + BytesIO)", _fusion_legacy, rutas, destino
+            )
+            tamano = os.path.getsize(destino)
+            _medir_memoria("Después (fusionar_pdfs)", fusionar_pdfs, rutas, destino)
+            print(
+                f"Salida: {tamano / 2**20:.1f} MiB (antes) / "
+                f"{os.path.getsize(destino) / 2**20:.1f} MiB (después)"
+            )
+    return 0
+
+
+def _tabla_legacy(filas_por_xml):
+    """Ruta anterior: un dict por concepto y pd.DataFrame(list_of_dicts)"""
+    import pandas as pd
+
+    all_data = []
+    for filas in filas_por_xml:
+        for fila in filas:
+            all_data.append(dict(zip(COLUMNAS, fila)))
+    return pd.DataFrame(all_data)
+
+
+def _tabla_columnar(filas_por_xml):
+    tabla = TablaConceptos()
+    for filas in filas_por_xml:
+        tabla.agregar(filas)
+    return tabla.construir()
+
+
+def bench_tabla(args):
+    """Compara list-of-dicts contra el constructor columnar tipado"""
+    with tempfile.TemporaryDirectory() as tmp:
+        contenidos = _leer_corpus(generar_corpus(tmp, 1000))
+    base = [procesar_xml(x, a, "Bench")[1] for a, x in contenidos]
+    conceptos_base = sum(len(f) for f in base)
+    repeticiones = max(1, args.filas // conceptos_base)
+    filas_por_xml = base * repeticiones
+    print(f"Tabla de {conceptos_base * repeticiones} conceptos")
+
+    for nombre, funcion in [
+        ("Antes (list-of-dicts)", _tabla_legacy),
+        ("Después (TablaConceptos)", _tabla_columnar),
+    ]:
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        df = funcion(filas_por_xml)
+        transcurrido = time.perf_counter() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        memoria_df = df.memory_usage(deep=True).sum()
+        print(
+            f"{nombre:<28} {transcurrido:8.2f} s   pico {pico / 2**20:9.1f} MiB   "
+            f"DataFrame {memoria_df / 2**20:8.1f} MiB"
+        )
+        del df
+    return 0
+
+
+def _excel_legacy(df, destino):
+    """Ruta anterior: openpyxl y ancho de columnas recorriendo cada celda"""
+    import pandas as pd
+
+    with pd.ExcelWriter(destino, engine="openpyxl") as writer:
+        for nombre, hoja_df in hojas_resumen(df, "Bench").items():
+            hoja_df.to_excel(writer, sheet_name=nombre, index=False)
+
+        for sheet_name_ws in writer.sheets:
+            worksheet = writer.sheets[sheet_name_ws]
+            for column in worksheet.columns:
+                max_length = 0
+                column_letter = column[0].column_letter
+                for cell in column:
+                    try:
+                        if len(str(cell.value)) > max_length:
+                            max_length = len(str(cell.value))
+                    except:
+                        pass
+                adjusted_width = min(max_length + 2, 50)
+                worksheet.column_dimensions[column_letter].width = adjusted_width
+
+
+def _excel_rapido(df, destino):
+    escribir_excel(hojas_resumen(df, "Bench"), destino)
+
+
+def bench_excel(args):
+    """Compara el Excel con openpyxl contra xlsxwriter en memoria constante"""
+    import pandas as pd
+
+    with tempfile.TemporaryDirectory() as tmp:
+        contenidos = _leer_corpus(generar_corpus(tmp, 1000))
+        base = [procesar_xml(x, a, "Bench")[1] for a, x in contenidos]
+        conceptos_base = sum(len(f) for f in base)
+        df = _tabla_columnar(base * max(1, args.filas // conceptos_base))
+        print(f"Excel de {len(df)} conceptos")
+
+        destinos = {}
+        for nombre, funcion in [
+            ("Antes (openpyxl + anchos)", _excel_legacy),
+            ("Después (escribir_excel)", _excel_rapido),
+        ]:
+            destino = os.path.join(tmp, f"{funcion.__name__}.xlsx")
+            _medir_memoria(nombre, funcion, df, destino)
+            destinos[nombre] = destino
+
+        if args.verificar:
+            # Mismas hojas, dimensiones y valores en ambas salidas
+            antes, despues = (
+                pd.read_excel(d, sheet_name=None) for d in destinos.values()
+            )
+            iguales = list(antes) == list(despues) and all(
+                antes[hoja].equals(despues[hoja]) for hoja in antes
+            )
+            print(f"Hojas: {list(despues)}   contenido igual: {iguales}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    p_ext = subparsers.add_parser("extraccion", help="Costo por archivo del parser")
+    p_ext.add_argument("--dir", help="Directorio con XMLs reales")
+    p_ext.add_argument("--n", type=int, default=3000, help="XMLs sintéticos a generar")
+    p_ext.set_defaults(funcion=bench_extraccion)
+
+    p_fus = subparsers.add_parser("fusion", help="Memoria pico del PDF consolidado")
+    p_fus.add_argument(
+        "--n", type=int, nargs="+", default=[1000, 5000], help="PDFs a fusionar"
+    )
+    p_fus.set_defaults(funcion=bench_fusion)
+
+    p_tab = subparsers.add_parser("tabla", help="Construcción del DataFrame")
+    p_tab.add_argument("--filas", type=int, default=500000, help="Conceptos a cargar")
+    p_tab.set_defaults(funcion=bench_tabla)
+
+    p_xls = subparsers.add_parser("excel", help="Exportación a Excel")
+    p_xls.add_argument("--filas", type=int, default=200000, help="Conceptos a exportar")
+    p_xls.add_argument(
+        "--verificar", action="store_true", help="Releer ambas salidas y compararlas"
+    )
+    p_xls.set_defaults(funcion=bench_excel)
+
+    args = parser.parse_args(argv)
+    return args.funcion(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
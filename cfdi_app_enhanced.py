@@ -1,16 +1,59 @@
 import streamlit as st
 import pandas as pd
+import hashlib
 import json
 import glob
 import os
 from datetime import datetime, date
-import zipfile
 import tempfile
 import io
 import time
-from PyPDF2 import PdfMerger
-from satcfdi.cfdi import CFDI
-from satcfdi import render
+import uuid
+from cfdi_cache import VERSION_CACHE, cache_por_defecto
+from cfdi_cubo import CuboConceptos
+from cfdi_deducibilidad import (
+    ReglasDeducibilidad,
+    columna_contribuyente,
+    etiquetar,
+    reglas_por_defecto,
+)
+from cfdi_diot import (
+    ETIQUETAS_OPERACION,
+    ETIQUETAS_TERCERO,
+    agregar_proveedores,
+    escribir_txt_diot,
+    tabla_de_proveedores,
+)
+from cfdi_excel import escribir_excel, hojas_resumen
+from cfdi_extractor import (
+    aplicar_tipos,
+    claves_unicas,
+    formatear_fechas_excel,
+    reporte_duplicados,
+    uuids_cargados,
+    workers_por_defecto,
+)
+from cfdi_filtros import IndiceFiltros
+from cfdi_ingesta import IngestaContinua
+from cfdi_memoria import memoria_por_defecto, tamano_de
+from cfdi_parquet import cargar_tabla, guardar_tabla
+from cfdi_perfil import (
+    ETAPAS,
+    Perfil,
+    etapa_dominante,
+    ruta_jsonl_por_defecto,
+    tabla_rendimiento,
+)
+from cfdi_store import almacen_por_defecto
+from cfdi_trabajos import (
+    DIRECTORIO_ENTRADA,
+    FINALES,
+    TERMINADO,
+    escribir_xmls,
+    leer_xmls,
+    trabajos_por_defecto,
+)
+from cfdi_pdf import directorio_spool, liberar_pdfs, pdfs_disponibles
 
 # Importar DIOT desde satcfdi oficial
 try:
@@ -50,244 +93,885 @@ st.set_page_config(
 )
 
 
-def process_xml_files_enhanced(uploaded_files, file_type):
+# Fecha se guarda como datetime64; el formato sólo se aplica al mostrar/exportar
+FORMATO_FECHA = "%d/%m/%Y"
+# Filas mínimas que la ingesta continua junta antes de sumarlas a la tabla
+TRAMO_INGESTA = 5000
+
+
+def config_columnas():
+    """Formato de visualización de las columnas de fecha en st.dataframe"""
+    return {
+        "Fecha": st.column_config.DatetimeColumn("Fecha", format="DD/MM/YYYY")
+    }
+
+
+def get_cache():
+    """Caché de XMLs en disco, o None si el usuario la desactivó"""
+    if not st.session_state.get("usar_cache", True):
+        return None
+    try:
+        return cache_por_defecto()
+    except Exception as e:
+        st.warning(f"No se pudo abrir la caché de XMLs: {e}")
+        return None
+
+
+def get_store():
+    """Almacén persistente de conceptos, o None si el usuario lo desactivó"""
+    if not st.session_state.get("usar_almacen", True):
+        return None
+    try:
+        return almacen_por_defecto()
+    except Exception as e:
+        st.warning(f"No se pudo abrir el almacén local: {e}")
+        return None
+
+
+def get_shared_memory():
+    """Caché en memoria compartida por todas las sesiones del proceso"""
+    return memoria_por_defecto()
+
+
+def get_deducibility_rules():
+    """Reglas de deducibilidad guardadas, o None si no se pudieron leer"""
+    try:
+        return reglas_por_defecto()
+    except Exception as e:
+        st.warning(f"No se pudieron leer las reglas de deducibilidad: {e}")
+        return None
+
+
+def apply_saved_rules(df):
+    """Marca Deducible en df con las reglas guardadas de cada contribuyente"""
+    reglas = get_deducibility_rules()
+    if reglas is None or df is None:
+        return df
+    # Las sesiones que cargan la misma tabla comparten también la etiquetada
+    guardadas = {rfc: r.a_dict() for rfc, r in reglas.reglas.items()}
+    huella = hashlib.sha1(json.dumps(guardadas, sort_keys=True).encode()).hexdigest()
+    return get_shared_derived(f"deducible_{huella}", df, reglas.etiquetar)
+
+
+def save_to_store(df, solo_deducible=False):
     """
-    Procesa archivos XML subidos y retorna DataFrame con todas las características
-    OPTIMIZADO: Acceso directo sin conversión JSON
+    Guarda (upsert por UUID) los conceptos de df en el almacén, si está activo
+    Con solo_deducible sólo se actualiza la columna Deducible de los conceptos
+    ya guardados, tras un cambio de reglas
     """
-    all_data = []
-    all_pdfs = []
-    unique_claves_prodserv = set()  # Para recopilar claves únicas
+    store = get_store()
+    if store is None or df is None or df.empty:
+        return
+    try:
+        if solo_deducible:
+            store.actualizar_deducible(df)
+        else:
+            store.upsert(df)
+    except Exception as e:
+        st.warning(f"No se pudo guardar en el almacén local: {e}")
 
-    if not uploaded_files:
-        return None, [], []
 
-    progress_bar = st.progress(0)
-    status_text = st.empty()
+def store_processing_result(categoria, result, agregar=False):
+    """
+    Guarda en la sesión el resultado (df, xmls, claves, duplicados) de una ingesta
+    Con agregar, los CFDIs nuevos se suman a los ya cargados en lugar de
+    reemplazarlos (los duplicados ya se omitieron al procesar)
+    """
+    df, xmls, claves, _ = result
+    # Los CFDIs nuevos llegan ya etiquetados con las reglas guardadas
+    df = apply_saved_rules(df)
+    if agregar:
+        previo = st.session_state[f"df_{categoria}"]
+        if df is None:
+            df = previo
+        elif previo is not None:
+            # Cubo nuevo con las celdas de la tabla anterior y las del lote;
+            # el de previo puede estar compartido y no se modifica
+            cubo = get_cube(previo).agregar(df)
+            # aplicar_tipos vuelve a unificar las categóricas tras concatenar
+            df = aplicar_tipos(pd.concat([previo, df], ignore_index=True))
+            register_cube(df, cubo)
+        xmls = st.session_state[f"xmls_{categoria}"] + xmls
+        claves = claves_unicas(df) if df is not None else []
+
+    st.session_state[f"df_{categoria}"] = df
+    st.session_state[f"xmls_{categoria}"] = xmls
+    st.session_state[f"claves_{categoria}"] = claves
+    # Los PDFs anteriores (o en generación) ya no corresponden a estos XMLs
+    cancel_job(f"trabajo_pdfs_{categoria}")
+    liberar_pdfs(st.session_state[f"pdfs_{categoria}"])
+    st.session_state[f"pdfs_{categoria}"] = []
+
+
+def stop_ingestion(categoria):
+    """Cancela la ingesta continua de la categoría, si hay una en curso"""
+    ingesta = st.session_state.pop(f"ingesta_{categoria}", None)
+    st.session_state.pop(f"ingesta_enviados_{categoria}", None)
+    if ingesta is not None:
+        ingesta.cancelar()
+    # Lo ya parseado se conserva en la tabla de la sesión
+    merge_ingestion_parts(categoria, final=True)
+
+
+def session_alive_check():
+    """
+    Función sin argumentos que dice si la sesión actual sigue abierta
+    La usan los hilos de fondo para no seguir trabajando para una pestaña
+    que ya se cerró
+    """
+    from streamlit import runtime
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
 
-    for i, uploaded_file in enumerate(uploaded_files):
-        try:
-            status_text.text(
-                f"Procesando {i + 1}/{len(uploaded_files)}: {uploaded_file.name}"
+    ctx = get_script_run_ctx()
+    if ctx is None or not runtime.exists():
+        return None
+    instancia = runtime.get_instance()
+    return lambda: instancia.is_active_session(ctx.session_id)
+
+
+def finish_ingestion(categoria, ingesta):
+    """Carga lo último de una ingesta continua terminada y la quita de la sesión"""
+    absorb_ingestion_parts(categoria, ingesta, final=True)
+    save_to_store(st.session_state[f"df_{categoria}"])
+    record_performance(ingesta.perfil)
+    st.session_state.pop(f"ingesta_{categoria}", None)
+
+
+def absorb_ingestion_parts(categoria, ingesta, final=False):
+    """Toma las partes que la ingesta ya terminó y las suma a la tabla por tramos"""
+    partes = ingesta.recoger()
+    st.session_state.setdefault(f"ingesta_pendiente_{categoria}", []).extend(partes)
+    for parte in partes:
+        st.session_state[f"ingesta_errores_{categoria}"].extend(parte.errores)
+        st.session_state[f"ingesta_duplicados_{categoria}"].extend(parte.duplicados)
+    merge_ingestion_parts(categoria, final)
+
+
+def pending_ingestion_parts(categoria):
+    """Partes de la ingesta continua que aún no están en la tabla de la sesión"""
+    return st.session_state.get(f"ingesta_pendiente_{categoria}", [])
+
+
+def merge_ingestion_parts(categoria, final=False):
+    """
+    Suma a la tabla de la sesión las partes pendientes de la ingesta continua
+    Concatenar cada segundo sobre toda la tabla costaría tiempo cuadrático:
+    las partes se juntan hasta tener al menos tantas filas como la tabla (o
+    TRAMO_INGESTA), así la tabla se duplica en cada tramo y el costo total
+    queda lineal. Con final se suma lo que haya
+    """
+    pendientes = pending_ingestion_parts(categoria)
+    if not pendientes:
+        return
+    previo = st.session_state[f"df_{categoria}"]
+    filas = sum(len(parte.df) for parte in pendientes if parte.df is not None)
+    if not final and filas < max(TRAMO_INGESTA, 0 if previo is None else len(previo)):
+        return
+    dfs = [parte.df for parte in pendientes if parte.df is not None]
+    df = aplicar_tipos(pd.concat(dfs, ignore_index=True)) if dfs else None
+    xmls = [xml for parte in pendientes for xml in parte.xmls]
+    st.session_state[f"ingesta_pendiente_{categoria}"] = []
+    store_processing_result(categoria, (df, xmls, [], None), agregar=True)
+
+
+def streaming_ingestion_ui(categoria, uploaded_files, workers, agregar=False):
+    """
+    Procesa los archivos mientras el navegador sigue subiendo los demás
+    Streamlit entrega cada archivo terminado en un rerun: aquí se encolan los
+    nuevos en una IngestaContinua y un fragmento que se refresca cada segundo
+    va sumando a la tabla de la sesión los lotes ya parseados
+    """
+    clave = f"ingesta_{categoria}"
+    # Los archivos ya enviados se recuerdan hasta vaciar el uploader, para
+    # no volver a procesarlos en los reruns posteriores a la ingesta
+    enviados = st.session_state.get(f"ingesta_enviados_{categoria}")
+    if enviados is None:
+        enviados = st.session_state[f"ingesta_enviados_{categoria}"] = set()
+        st.session_state[f"ingesta_errores_{categoria}"] = []
+        st.session_state[f"ingesta_duplicados_{categoria}"] = []
+        st.session_state[f"ingesta_pendiente_{categoria}"] = []
+        if not agregar:
+            # Ingesta nueva: reemplaza la tabla en lugar de sumarse a ella
+            st.session_state[f"df_{categoria}"] = None
+            st.session_state[f"xmls_{categoria}"] = []
+            st.session_state[f"claves_{categoria}"] = []
+            liberar_pdfs(st.session_state[f"pdfs_{categoria}"])
+            st.session_state[f"pdfs_{categoria}"] = []
+    nuevos = [f for f in uploaded_files if f.file_id not in enviados]
+
+    ingesta = st.session_state.get(clave)
+    if ingesta is not None and ingesta.cerrada and nuevos:
+        # Se cerró sola por inactividad: se termina antes de abrir otra
+        ingesta.esperar()
+        finish_ingestion(categoria, ingesta)
+        ingesta = None
+    if ingesta is None and nuevos:
+        ingesta = IngestaContinua(
+            categoria.capitalize(),
+            workers=workers,
+            cache=get_cache(),
+            vistos=uuids_cargados(st.session_state[f"df_{categoria}"]),
+            activa=session_alive_check(),
+        )
+        st.session_state[clave] = ingesta
+    for uploaded_file in nuevos:
+        # Copia propia: el hilo lector no comparte la posición del archivo
+        contenido = io.BytesIO(uploaded_file.getvalue())
+        # Si se cerró justo ahora por inactividad, se envía en el siguiente rerun
+        if ingesta.enviar(uploaded_file.name, contenido):
+            enviados.add(uploaded_file.file_id)
+
+    if ingesta is not None and st.button(
+        "⏹️ Finalizar (ya se subieron todos los archivos)",
+        key=f"finalizar_{categoria}",
+    ):
+        ingesta.cerrar()
+
+    @st.fragment(run_every=1.0)
+    def progreso():
+        absorb_ingestion_parts(categoria, ingesta)
+        totales = ingesta.resumen()
+        col1, col2, col3, col4, col5 = st.columns(5)
+        col1.metric("Archivos", totales["archivos"])
+        col2.metric("XMLs", totales["documentos"])
+        col3.metric("Conceptos", totales["conceptos"])
+        col4.metric("Duplicados", totales["duplicados"])
+        col5.metric("Errores", totales["errores"])
+        df = st.session_state[f"df_{categoria}"]
+        pendientes = [
+            parte.df
+            for parte in pending_ingestion_parts(categoria)
+            if parte.df is not None
+        ]
+        if df is not None or pendientes:
+            # El cubo de la tabla más lo que aún no se sumó a ella
+            total = get_cube(df).totales()["Total_CFDI"] if df is not None else 0.0
+            total += sum(parte["Total_CFDI"].sum() for parte in pendientes)
+            st.caption(f"Total acumulado: ${total:,.2f}")
+
+        if not ingesta.terminada:
+            st.caption(
+                "⏳ Procesando mientras se suben los archivos... Se finaliza sola "
+                f"tras {ingesta.inactividad:.0f} s sin archivos nuevos"
             )
-            progress_bar.progress((i + 1) / len(uploaded_files))
+            return
+        finish_ingestion(categoria, ingesta)
+        st.rerun()
 
-            # Leer el archivo XML
-            xml_content = uploaded_file.read()
+    if ingesta is not None:
+        progreso()
+    elif st.session_state[f"df_{categoria}"] is not None:
+        st.success(f"✅ {len(enviados)} archivos procesados")
 
-            # Procesar con satcfdi - ACCESO DIRECTO SIN JSON
-            cfdi = CFDI.from_string(xml_content)
+    errores = st.session_state[f"ingesta_errores_{categoria}"]
+    for archivo, error in errores:
+        st.error(f"Error procesando {archivo}: {error}")
+    duplicados = st.session_state[f"ingesta_duplicados_{categoria}"]
+    if duplicados:
+        with st.expander(f"🔁 {len(duplicados)} CFDIs duplicados omitidos"):
+            st.dataframe(reporte_duplicados(duplicados), use_container_width=True)
 
-            # Generar PDF del CFDI
-            try:
-                pdf_bytes = render.pdf_bytes(cfdi)
-                all_pdfs.append(
-                    {
-                        "filename": uploaded_file.name.replace(".xml", ".pdf"),
-                        "content": pdf_bytes,
-                    }
-                )
-            except Exception as e:
-                st.warning(f"No se pudo generar PDF para {uploaded_file.name}: {e}")
-
-            # Extraer información DIRECTAMENTE del objeto CFDI
-            fecha = cfdi.get("Fecha", "")
-            if fecha:
-                # La fecha ya viene como datetime desde satcfdi 4.7.5
-                if isinstance(fecha, str):
-                    fecha_obj = datetime.strptime(fecha, "%Y-%m-%d %H:%M:%S")
-                else:
-                    fecha_obj = fecha
-                mes = fecha_obj.strftime("%Y-%m")
-                fecha_formato = fecha_obj.strftime("%d/%m/%Y")
-            else:
-                mes = ""
-                fecha_formato = ""
-
-            tipo_comprobante = str(cfdi.get("TipoDeComprobante", ""))
-            folio = str(cfdi.get("Folio", ""))
-            uuid = str(
-                cfdi.get("Complemento", {})
-                .get("TimbreFiscalDigital", {})
-                .get("UUID", "")
+
+def get_jobs():
+    """Tabla de trabajos en segundo plano, compartida por todas las sesiones"""
+    return trabajos_por_defecto()
+
+
+def job_owner():
+    """
+    Dueño de los trabajos que envía esta sesión
+    Vive en la URL (?sesion=...) para que al recargar el navegador la sesión
+    nueva vea los trabajos de la anterior y no los de otros usuarios
+    """
+    if "sesion" not in st.query_params:
+        st.query_params["sesion"] = uuid.uuid4().hex
+    return st.query_params["sesion"]
+
+
+def submit_job(clave, tipo, titulo, params, preparar=None):
+    """Encola un trabajo de fondo y guarda su id en la sesión bajo clave"""
+    if st.session_state.get("perfil_jsonl"):
+        params = {**params, "perfil_jsonl": ruta_jsonl_por_defecto()}
+    id_trabajo = get_jobs().enviar(tipo, params, titulo, preparar, job_owner())
+    st.session_state[clave] = id_trabajo
+    return id_trabajo
+
+
+def cancel_job(clave):
+    """Cancela el trabajo de la sesión guardado bajo clave, si hay uno"""
+    id_trabajo = st.session_state.pop(clave, None)
+    if id_trabajo is not None:
+        get_jobs().cancelar(id_trabajo)
+
+
+def job_progress_ui(clave, widget_key=None):
+    """
+    Sigue el trabajo cuyo id está en st.session_state[clave]
+    Mientras corre, un fragmento consulta su avance cada segundo y relanza la
+    app cuando termina. Retorna el estado del trabajo terminado con éxito (y
+    lo olvida de la sesión); los errores y cancelaciones sólo se reportan
+    """
+    id_trabajo = st.session_state.get(clave)
+    if id_trabajo is None:
+        return None
+    trabajos = get_jobs()
+    estado = trabajos.estado(id_trabajo)
+    if estado is None or estado["estado"] in FINALES:
+        st.session_state.pop(clave, None)
+        if estado is None or estado["estado"] == TERMINADO:
+            return estado
+        mensaje = f"{estado['titulo']}: trabajo {estado['estado']}"
+        st.error(f"{mensaje} ({estado['error']})" if estado["error"] else mensaje)
+        return None
+
+    @st.fragment(run_every=1.0)
+    def progreso():
+        estado = trabajos.estado(id_trabajo)
+        if estado is None or estado["estado"] in FINALES:
+            st.rerun()
+        avance = estado["avance"]
+        fraccion = avance["hechos"] / avance["total"] if avance["total"] else 0.0
+        st.progress(
+            min(fraccion, 1.0),
+            text=f"⏳ {estado['titulo']}: {avance['hechos']}/{avance['total']} "
+            f"{avance['mensaje']}",
+        )
+        if st.button("⏹️ Cancelar", key=f"cancelar_{widget_key or clave}"):
+            trabajos.cancelar(id_trabajo)
+
+    progreso()
+    return None
+
+
+def job_download(
+    key,
+    fingerprint,
+    tipo,
+    titulo,
+    params,
+    preparar=None,
+    prepare_label=None,
+    **download_kwargs,
+):
+    """
+    Como lazy_download, pero el archivo lo construye un trabajo de fondo
+    El trabajo se encola al pulsar prepare_label (sin él, en cuanto hace
+    falta) y su resultado se memoriza con fingerprint. Retorna el resultado
+    del trabajo una vez terminado, o None mientras no lo esté
+    """
+    descargas = st.session_state.setdefault("descargas", {})
+    clave = f"trabajo_{key}"
+    guardado = descargas.get(key)
+    vigente = guardado is not None and guardado[0] == fingerprint
+    if not vigente and clave not in st.session_state:
+        # Otra sesión pudo haber construido (o estar construyendo) el mismo archivo
+        previo = get_jobs().buscar(tipo, fingerprint)
+        if previo is not None:
+            st.session_state[clave] = previo["id"]
+    estado = job_progress_ui(clave)
+    if estado is not None and estado["params"].get("huella") == fingerprint:
+        resultado = estado["resultado"]
+        for ruta, error in resultado.get("errores", []):
+            st.warning(f"Error agregando {os.path.basename(ruta)}: {error}")
+        if not resultado["archivo"]:
+            descargas.pop(key, None)
+            return resultado
+        ruta = get_jobs().ruta(estado["id"], resultado["archivo"])
+        descargas[key] = (fingerprint, ruta, resultado)
+
+    guardado = descargas.get(key)
+    if guardado is None or guardado[0] != fingerprint:
+        if clave in st.session_state:
+            return None
+        if prepare_label and not st.button(prepare_label, key=f"preparar_{key}"):
+            return None
+        submit_job(clave, tipo, titulo, dict(params, huella=fingerprint), preparar)
+        job_progress_ui(clave)
+        return None
+
+    with open(guardado[1], "rb") as archivo:
+        st.download_button(data=archivo, key=f"descargar_{key}", **download_kwargs)
+    return guardado[2]
+
+
+def fingerprint_uploads(uploaded_files, *extra):
+    """Huella del contenido de los archivos subidos (y de extra), igual entre sesiones"""
+    huella = hashlib.sha256()
+    for valor in extra:
+        huella.update(f"{valor}\n".encode())
+    for uploaded_file in uploaded_files:
+        huella.update(uploaded_file.name.encode() + b"\0")
+        huella.update(hashlib.sha256(uploaded_file.getvalue()).digest())
+    return huella.hexdigest()
+
+
+def submit_ingestion_job(categoria, uploaded_files, workers, agregar=False):
+    """
+    Guarda los archivos subidos en un trabajo de ingesta y lo encola
+    Si otra sesión ya procesó (o está procesando) exactamente los mismos
+    archivos, la sesión sigue ese trabajo en lugar de encolar otro
+    """
+    vistos = []
+    if agregar:
+        # Los UUIDs de la sesión se omiten como duplicados
+        vistos = sorted(uuids_cargados(st.session_state[f"df_{categoria}"]))
+    huella = fingerprint_uploads(
+        uploaded_files,
+        categoria,
+        VERSION_CACHE,
+        agregar,
+        hashlib.sha256("\n".join(vistos).encode()).hexdigest(),
+    )
+    clave = f"trabajo_ingesta_{categoria}"
+    previo = get_jobs().buscar("ingesta", huella)
+    if previo is not None:
+        st.session_state[clave] = previo["id"]
+        return
+
+    def preparar(directorio):
+        entrada = os.path.join(directorio, DIRECTORIO_ENTRADA)
+        for i, uploaded_file in enumerate(uploaded_files):
+            ruta = os.path.join(entrada, f"{i:06d}_{uploaded_file.name}")
+            with open(ruta, "wb") as archivo:
+                archivo.write(uploaded_file.getvalue())
+        if vistos:
+            with open(os.path.join(directorio, "vistos.json"), "w") as archivo:
+                json.dump(vistos, archivo)
+
+    submit_job(
+        clave,
+        "ingesta",
+        f"Ingesta de {len(uploaded_files)} archivos ({categoria})",
+        {
+            "categoria": categoria.capitalize(),
+            "workers": workers,
+            "usar_cache": st.session_state.get("usar_cache", True),
+            "agregar": agregar,
+            "huella": huella,
+        },
+        preparar,
+    )
+
+
+def ingestion_output(estado):
+    """
+    (df, xmls) de un trabajo de ingesta terminado
+    Se leen de disco una vez por proceso; las demás sesiones que cargan el
+    mismo trabajo los toman de la caché compartida en memoria
+    """
+
+    def leer():
+        trabajos = get_jobs()
+        resultado = estado["resultado"]
+        df = None
+        if resultado["tabla"]:
+            df = cargar_tabla(trabajos.ruta(estado["id"], resultado["tabla"]))
+        return df, leer_xmls(trabajos.ruta(estado["id"], "xmls.zip"))
+
+    return get_shared_memory().obtener_o_calcular(("ingesta", estado["id"]), leer)
+
+
+def load_ingestion_result(categoria, estado, agregar=False):
+    """Carga en la sesión la tabla y los XMLs de un trabajo de ingesta terminado"""
+    resultado = estado["resultado"]
+    df, xmls = ingestion_output(estado)
+    # La lista compartida no se modifica: la sesión recibe su propia copia
+    xmls = list(xmls)
+    claves = claves_unicas(df) if df is not None else []
+    store_processing_result(categoria, (df, xmls, claves, None), agregar)
+    save_to_store(st.session_state[f"df_{categoria}"])
+
+    for archivo, error in resultado["errores"]:
+        st.error(f"Error procesando {archivo}: {error}")
+    duplicados = reporte_duplicados([tuple(d) for d in resultado["duplicados"]])
+    if not duplicados.empty:
+        st.warning(f"🔁 {len(duplicados)} CFDIs duplicados omitidos (mismo UUID)")
+        with st.expander("Ver CFDIs duplicados"):
+            st.dataframe(duplicados, use_container_width=True)
+    if resultado["desde_cache"]:
+        st.info(
+            f"♻️ {resultado['desde_cache']} de {resultado['xmls']} XMLs recuperados de caché"
+        )
+
+
+def ingestion_job_ui(categoria):
+    """
+    Avance del trabajo de ingesta de la sesión y carga de su resultado
+    Se muestra aunque ya no haya archivos en el uploader: la ingesta corre
+    en segundo plano y sólo se espera su resultado
+    """
+    estado = job_progress_ui(f"trabajo_ingesta_{categoria}")
+    if estado is None:
+        return
+    load_ingestion_result(categoria, estado, estado["params"].get("agregar", False))
+    if st.session_state[f"df_{categoria}"] is not None:
+        st.success(
+            f"✅ {len(st.session_state[f'df_{categoria}'])} conceptos procesados"
+        )
+        st.success(
+            f"📄 {len(st.session_state[f'xmls_{categoria}'])} XMLs listos para PDF"
+        )
+        st.success(
+            f"🔑 {len(st.session_state[f'claves_{categoria}'])} claves de productos/servicios encontradas"
+        )
+
+
+def jobs_panel_ui():
+    """
+    Trabajos recientes de esta sesión, en la barra lateral
+    Después de recargar el navegador, aquí se recuperan los resultados de los
+    trabajos que siguieron corriendo y se reintentan los interrumpidos
+    """
+    trabajos = get_jobs()
+    estados = trabajos.listar(limite=10, dueno=job_owner())
+    activos = sum(estado["estado"] not in FINALES for estado in estados)
+    with st.sidebar.expander(f"🗂️ Trabajos en segundo plano ({activos} activos)"):
+        if not estados:
+            st.caption("Sin trabajos recientes")
+        st.button("🔄 Actualizar", key="actualizar_trabajos")
+        for estado in estados:
+            id_trabajo = estado["id"]
+            avance = estado["avance"]
+            st.markdown(f"**{estado['titulo']}** · {estado['estado']}")
+            st.caption(
+                f"{datetime.fromtimestamp(estado['creado']):%d/%m %H:%M} · "
+                f"{avance['hechos']}/{avance['total']} {avance['mensaje']}"
             )
-            emisor_rfc = str(cfdi.get("Emisor", {}).get("Rfc", ""))
-            emisor_nombre = str(cfdi.get("Emisor", {}).get("Nombre", ""))
-            receptor_rfc = str(cfdi.get("Receptor", {}).get("Rfc", ""))
-            receptor_nombre = str(cfdi.get("Receptor", {}).get("Nombre", ""))
-            subtotal_cfdi = float(cfdi.get("SubTotal", 0))
-            total_cfdi = float(cfdi.get("Total", 0))
-
-            # Procesar conceptos DIRECTAMENTE
-            conceptos = cfdi.get("Conceptos", [])
-
-            for concepto in conceptos:
-                # Recopilar clave única para el checklist - convertir a string
-                clave_prodserv = str(concepto.get("ClaveProdServ", ""))
-                if clave_prodserv:
-                    unique_claves_prodserv.add(clave_prodserv)
-
-                row = {
-                    "Archivo_XML": uploaded_file.name,
-                    "UUID": uuid,
-                    "Folio": folio,
-                    "Fecha": fecha_formato,
-                    "Mes": mes,
-                    "Tipo_Comprobante": tipo_comprobante,
-                    "Emisor_RFC": emisor_rfc,
-                    "Emisor_Nombre": emisor_nombre,
-                    "Receptor_RFC": receptor_rfc,
-                    "Receptor_Nombre": receptor_nombre,
-                    "SubTotal_CFDI": subtotal_cfdi,
-                    "Total_CFDI": total_cfdi,
-                    "Monto_Concepto": float(concepto.get("Importe", 0)),
-                    "Concepto_Descripcion": str(concepto.get("Descripcion", "")),
-                    "Cantidad": float(concepto.get("Cantidad", 1)),
-                    "Unidad": str(concepto.get("Unidad", "")),
-                    "Valor_Unitario": float(concepto.get("ValorUnitario", 0)),
-                    "Clave_ProdServ": clave_prodserv,
-                    "Categoria": file_type,
-                    "Deducible": False,  # Campo inicial para marcar deducibilidad
-                }
+            if estado["error"]:
+                st.caption(f"❌ {estado['error']}")
+            resultado = estado["resultado"] or {}
+            if estado["estado"] not in FINALES:
+                if st.button("⏹️ Cancelar", key=f"cancelar_trabajo_{id_trabajo}"):
+                    trabajos.cancelar(id_trabajo)
+                continue
+            if estado["tipo"] == "ingesta" and resultado.get("xmls"):
+                if st.button("📥 Cargar en la sesión", key=f"cargar_{id_trabajo}"):
+                    categoria = estado["params"]["categoria"].lower()
+                    # listar() sólo trae el resumen; errores y duplicados no
+                    load_ingestion_result(categoria, trabajos.estado(id_trabajo))
+                    st.rerun()
+            elif resultado.get("archivo"):
+                ruta = trabajos.ruta(id_trabajo, resultado["archivo"])
+                if os.path.exists(ruta):
+                    with open(ruta, "rb") as archivo:
+                        st.download_button(
+                            f"📥 {resultado['archivo']}",
+                            data=archivo,
+                            file_name=resultado["archivo"],
+                            key=f"descargar_trabajo_{id_trabajo}",
+                        )
+            if estado["estado"] != TERMINADO:
+                if st.button("🔁 Reintentar", key=f"reintentar_{id_trabajo}"):
+                    trabajos.reintentar(id_trabajo)
+                    st.rerun()
+            if st.button("🗑️ Borrar", key=f"borrar_{id_trabajo}"):
+                trabajos.borrar(id_trabajo)
+                st.rerun()
 
-                # Inicializar campos de impuestos
-                row.update(
-                    {
-                        "Ingresos_Subtotal": 0,
-                        "Ingresos_IVA": 0,
-                        "Ingresos_Retencion_IVA": 0,
-                        "Ingresos_Retencion_ISR": 0,
-                        "Egresos_Subtotal": 0,
-                        "Egresos_IVA": 0,
-                        "Egresos_Total": 0,
-                    }
-                )
 
-                # Procesar impuestos según tipo de comprobante
-                if tipo_comprobante.startswith("I"):  # Ingreso
-                    subtotal = float(concepto.get("Importe", 0))
-                    row["Ingresos_Subtotal"] = subtotal
-
-                    impuestos = concepto.get("Impuestos", {})
-
-                    # IVA trasladado
-                    traslados = impuestos.get("Traslados", {})
-                    iva_trasladado = 0
-                    for key, traslado in traslados.items():
-                        if "002" in key:  # 002 es IVA
-                            iva_trasladado += float(traslado.get("Importe", 0))
-                    row["Ingresos_IVA"] = iva_trasladado
-
-                    # Retenciones
-                    retenciones = impuestos.get("Retenciones", {})
-                    retencion_iva = 0
-                    retencion_isr = 0
-
-                    for key, retencion in retenciones.items():
-                        if "002" in key:  # IVA
-                            retencion_iva += float(retencion.get("Importe", 0))
-                        elif "001" in key:  # ISR
-                            retencion_isr += float(retencion.get("Importe", 0))
-
-                    row["Ingresos_Retencion_IVA"] = retencion_iva
-                    row["Ingresos_Retencion_ISR"] = retencion_isr
-
-                elif tipo_comprobante.startswith("E"):  # Egreso
-                    subtotal = float(concepto.get("Importe", 0))
-                    row["Egresos_Subtotal"] = subtotal
-
-                    impuestos = concepto.get("Impuestos", {})
-                    traslados = impuestos.get("Traslados", {})
-                    iva_trasladado = 0
-                    for key, traslado in traslados.items():
-                        if "002" in key:
-                            iva_trasladado += float(traslado.get("Importe", 0))
-                    row["Egresos_IVA"] = iva_trasladado
-                    row["Egresos_Total"] = subtotal + iva_trasladado
-
-                all_data.append(row)
+def record_performance(perfil):
+    """
+    Guarda en la sesión el rendimiento de un lote que corrió en el script
+    Con el registro activado también se agrega al archivo JSONL
+    """
+    recientes = st.session_state.setdefault("rendimiento_sesion", [])
+    recientes.append(perfil.a_dict())
+    del recientes[:-10]
+    if st.session_state.get("perfil_jsonl"):
+        perfil.escribir_jsonl(ruta_jsonl_por_defecto())
 
-        except Exception as e:
-            st.error(f"Error procesando {uploaded_file.name}: {e}")
 
-    status_text.text("✅ Procesamiento completado")
-    progress_bar.empty()
+def performance_panel_ui():
+    """
+    Tiempo, CPU y memoria por etapa de los lotes recientes
+    Muestra los trabajos de fondo terminados y lo que corrió en esta sesión,
+    para ver si un lote lento está limitado por el parseo o por el render
+    """
+    lotes = [
+        (f"{estado['titulo']} · {estado['id']}", estado["resultado"]["rendimiento"])
+        for estado in get_jobs().listar(limite=20, dueno=job_owner())
+        if estado["estado"] == TERMINADO
+        and (estado["resultado"] or {}).get("rendimiento")
+    ]
+    lotes += [
+        (f"{datos['nombre']} · sesión", datos)
+        for datos in reversed(st.session_state.get("rendimiento_sesion", []))
+    ]
+    with st.expander("⏱️ Rendimiento"):
+        if not lotes:
+            st.caption("Aún no hay lotes medidos")
+            return
+        nombres = [nombre for nombre, _ in lotes]
+        elegido = st.selectbox("Lote", nombres, key="rendimiento_lote")
+        datos = lotes[nombres.index(elegido)][1]
+        st.dataframe(
+            tabla_rendimiento(datos),
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "Pared (s)": st.column_config.NumberColumn(format="%.3f"),
+                "CPU (s)": st.column_config.NumberColumn(format="%.3f"),
+                "Δ RSS máx. (MB)": st.column_config.NumberColumn(
+                    format="%.1f",
+                    help="Mayor crecimiento del RSS en una llamada de la etapa; "
+                    "no incluye lo que se asigna y se libera dentro de ella",
+                ),
+                "% del tiempo": st.column_config.NumberColumn(format="%.1f%%"),
+            },
+        )
+        texto = f"Total del lote: {datos['pared_total']:.2f} s"
+        dominante = etapa_dominante(datos)
+        if dominante:
+            texto += f" · etapa dominante: {ETAPAS.get(dominante, dominante)}"
+        st.caption(
+            f"{texto}. El parseo, la extracción y el render corren en varios "
+            "procesos: su tiempo es la suma de todos y puede superar el total."
+        )
+
+
+def register_cube(df, cubo):
+    """Asocia un cubo a su tabla; se conservan los de las últimas tablas usadas"""
+    cubos = st.session_state.setdefault("cubos", {})
+    cubos.pop(id(df), None)
+    # Se guarda la tabla junto al cubo para que su id no se reutilice
+    cubos[id(df)] = (df, cubo)
+    while len(cubos) > 4:
+        cubos.pop(next(iter(cubos)))
+    return cubo
+
+
+def get_shared_derived(nombre, df, build, compartir=True):
+    """
+    Estructura derivada de df (cubo, índice) compartida entre sesiones
+    Las sesiones que cargaron la misma tabla de la caché compartida tienen el
+    mismo objeto df, así que la estructura se construye una sola vez. Con
+    compartir=False (tablas filtradas, que sólo existen en una sesión) se
+    busca pero no se guarda en la caché compartida
+    """
+    memoria = get_shared_memory()
+    guardado = memoria.obtener((nombre, id(df)))
+    if guardado is not None and guardado[0] is df:
+        return guardado[1]
+    derivado = build(df)
+    if compartir:
+        # La tabla va junto a la estructura para que su id no se reutilice,
+        # pero se cuenta en la entrada de la tabla, no en la derivada
+        memoria.guardar((nombre, id(df)), (df, derivado), tamano_de(derivado))
+    return derivado
+
+
+def get_cube(df, compartir=True):
+    """
+    Cubo pre-agregado de df, construido una vez por tabla
+    Con compartir=False el cubo se guarda sólo en la sesión (ver
+    get_shared_derived)
+    """
+    guardado = st.session_state.setdefault("cubos", {}).get(id(df))
+    if guardado is not None and guardado[0] is df:
+        return guardado[1]
+    cubo = get_shared_derived("cubo", df, CuboConceptos, compartir)
+    return register_cube(df, cubo)
+
 
-    return (
-        pd.DataFrame(all_data) if all_data else None,
-        all_pdfs,
-        sorted(list(unique_claves_prodserv)),
+def get_spool():
+    """Directorio temporal de la sesión para PDFs y archivos de descarga"""
+    if "pdf_spool" not in st.session_state:
+        st.session_state.pdf_spool = directorio_spool()
+    return st.session_state.pdf_spool
+
+
+def fingerprint_df(df):
+    """
+    Huella del contenido de un DataFrame (cambia si cambia cualquier celda)
+    Las tablas de la sesión no se modifican en su lugar, así que la huella se
+    calcula una vez por objeto y se reutiliza en cada rerun
+    """
+    huellas = st.session_state.setdefault("huellas", {})
+    guardado = huellas.get(id(df))
+    if guardado is not None and guardado[0] is df:
+        return guardado[1]
+    hashes = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    huella = hashlib.sha1(hashes.tobytes()).hexdigest()
+    # Se guarda la tabla junto a la huella para que su id no se reutilice
+    huellas[id(df)] = (df, huella)
+    while len(huellas) > 8:
+        huellas.pop(next(iter(huellas)))
+    return huella
+
+
+def consolidated_table():
+    """
+    Emitidos y recibidos en una sola tabla
+    Se memoriza junto con las dos tablas de la sesión de las que salió, así
+    que un rerun sin cambios en los datos no vuelve a concatenar
+    """
+    tablas = (st.session_state.df_emitidos, st.session_state.df_recibidos)
+    guardado = st.session_state.get("consolidado")
+    if guardado is None or any(a is not b for a, b in zip(guardado[0], tablas)):
+        presentes = [tabla for tabla in tablas if tabla is not None]
+        df = pd.concat(presentes, ignore_index=True) if presentes else pd.DataFrame()
+        guardado = st.session_state["consolidado"] = (tablas, df)
+    return guardado[1]
+
+
+def consolidated_cfdi_count(df_consolidado):
+    """
+    CFDIs distintos (por UUID) de la tabla consolidada
+    Un CFDI entre dos RFCs propios está en emitidos y en recibidos; el cubo
+    lo cuenta una vez en cada categoría, aquí se cuenta una sola vez
+    """
+    guardado = st.session_state.get("consolidado_cfdis")
+    if guardado is None or guardado[0] is not df_consolidado:
+        total = int(df_consolidado["UUID"].nunique())
+        guardado = st.session_state["consolidado_cfdis"] = (df_consolidado, total)
+    return guardado[1]
+
+
+def consolidated_fingerprint():
+    """Huella de la tabla consolidada a partir de las huellas de cada categoría"""
+    return "|".join(
+        fingerprint_df(tabla) if tabla is not None else "-"
+        for tabla in (st.session_state.df_emitidos, st.session_state.df_recibidos)
     )
 
 
-def create_enhanced_excel(df, filename, sheet_name):
-    """Crea un Excel con múltiples hojas y formato mejorado"""
+def fingerprint_files(pdf_list):
+    """Huella de un conjunto de PDFs del spool: rutas y fecha de modificación"""
+    huella = hashlib.sha1()
+    for pdf_info in pdf_list:
+        try:
+            mtime = os.stat(pdf_info["path"]).st_mtime_ns
+        except OSError:
+            mtime = 0
+        huella.update(f"{pdf_info['path']}|{mtime}\n".encode())
+    return huella.hexdigest()
+
+
+def lazy_download(key, fingerprint, build, prepare_label=None, **download_kwargs):
+    """
+    Botón de descarga cuyo archivo se construye sólo cuando hace falta
+    build() escribe el archivo y retorna su ruta (o None). El resultado se
+    memoriza con fingerprint: mientras los datos no cambien, los reruns de
+    Streamlit reutilizan el archivo en lugar de reconstruirlo. Con
+    prepare_label el archivo sólo se construye al pulsar ese botón.
+    """
+    descargas = st.session_state.setdefault("descargas", {})
+    guardado = descargas.get(key)
+    if guardado is None or guardado[0] != fingerprint:
+        if prepare_label and not st.button(prepare_label, key=f"preparar_{key}"):
+            return
+        with st.spinner("Preparando archivo..."):
+            ruta = build()
+        if ruta is None:
+            descargas.pop(key, None)
+            return
+        guardado = descargas[key] = (fingerprint, ruta)
+
+    with open(guardado[1], "rb") as archivo:
+        st.download_button(data=archivo, key=f"descargar_{key}", **download_kwargs)
+
+
+def ensure_pdfs(categorias, button_label, button_key):
+    """
+    Muestra un botón para generar en segundo plano los PDFs que falten
+    Retorna True cuando todos los PDFs de las categorías están listos
+    """
+    for c in categorias:
+        estado = job_progress_ui(f"trabajo_pdfs_{c}", f"{button_key}_{c}")
+        if estado is not None:
+            st.session_state[f"pdfs_{c}"] = estado["resultado"]["pdfs"]
+            for filename, error in estado["resultado"]["errores"]:
+                st.warning(f"No se pudo generar PDF para {filename}: {error}")
+        elif not pdfs_disponibles(st.session_state[f"pdfs_{c}"]):
+            # El trabajo que los generó venció y se purgó: se regeneran
+            st.session_state[f"pdfs_{c}"] = []
+            st.warning(f"Los PDFs de {c} expiraron; genéralos de nuevo")
+
+    pendientes = [
+        c
+        for c in categorias
+        if st.session_state[f"xmls_{c}"] and not st.session_state[f"pdfs_{c}"]
+    ]
+    if not pendientes:
+        return True
+    if any(f"trabajo_pdfs_{c}" in st.session_state for c in pendientes):
+        return False
+
+    if st.button(button_label, key=button_key):
+        for c in pendientes:
+            xmls = st.session_state[f"xmls_{c}"]
+            submit_job(
+                f"trabajo_pdfs_{c}",
+                "pdfs",
+                f"PDFs de {len(xmls)} CFDIs ({c})",
+                {
+                    "categoria": c,
+                    "prefijo": f"{c}_",
+                    "workers": st.session_state.get("ingesta_workers"),
+                    "usar_cache": st.session_state.get("usar_cache", True),
+                },
+                lambda directorio, xmls=xmls: escribir_xmls(
+                    xmls, os.path.join(directorio, DIRECTORIO_ENTRADA, "xmls.zip")
+                ),
+            )
+        st.rerun()
+
+    return False
+
+
+def create_enhanced_excel(df, filename, sheet_name, destino=None):
+    """
+    Crea un Excel con múltiples hojas y formato mejorado
+    Con destino escribe el archivo en esa ruta y la retorna; si no, retorna
+    los bytes del Excel
+    """
     if df is None or df.empty:
         return None
 
-    buffer = io.BytesIO()
-
-    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-        # Hoja principal con todos los datos
-        df.to_excel(writer, sheet_name=f"Detalle_{sheet_name}", index=False)
-
-        # Hoja de resumen por mes
-        if "Mes" in df.columns and not df["Mes"].isna().all():
-            resumen_mes = (
-                df.groupby(["Mes"])
-                .agg(
-                    {
-                        "Monto_Concepto": "sum",
-                        "Ingresos_Subtotal": "sum",
-                        "Ingresos_IVA": "sum",
-                        "Ingresos_Retencion_IVA": "sum",
-                        "Ingresos_Retencion_ISR": "sum",
-                        "Egresos_Subtotal": "sum",
-                        "Egresos_IVA": "sum",
-                        "Egresos_Total": "sum",
-                        "UUID": "count",
-                    }
-                )
-                .reset_index()
+    # Escritor en flujo (xlsxwriter) con anchos calculados sobre el DataFrame
+    perfil = Perfil(filename)
+    salida = destino if destino is not None else io.BytesIO()
+    with perfil.etapa("excel"):
+        escribir_excel(hojas_resumen(df, sheet_name), salida)
+    record_performance(perfil)
+    return destino if destino is not None else salida.getvalue()
+
+
+def build_excel_file(df, filename, sheet_name):
+    """Escribe el Excel en el spool de la sesión y retorna su ruta"""
+    return create_enhanced_excel(
+        df, filename, sheet_name, destino=os.path.join(get_spool(), filename)
+    )
+
+
+def diot_providers_from_table(tabla):
+    """
+    Convierte la tabla de agregar_proveedores en los dicts de proveedores
+    que usa la interfaz DIOT, con los enums de satcfdi (o del modelo local)
+    """
+    proveedores = []
+    for proveedor in tabla.to_dict("records"):
+        tipo_tercero = proveedor.pop("tipo_tercero")
+        tipo_operacion = proveedor.pop("tipo_operacion")
+        proveedor.pop("num_cfdis")
+        proveedor.update(
+            tipo_tercero=ETIQUETAS_TERCERO[tipo_tercero],
+            tipo_operacion=ETIQUETAS_OPERACION[tipo_operacion],
+            tipo_tercero_enum=TipoTercero[tipo_tercero],
+            tipo_operacion_enum=TipoOperacion[tipo_operacion],
+            auto_generado=True,  # Marca para identificar
+        )
+        if tipo_tercero == "PROVEEDOR_EXTRANJERO":
+            # El RFC genérico no identifica al extranjero: se declara sin RFC
+            # y su id fiscal y nacionalidad se capturan después
+            proveedor.update(
+                rfc="",
+                id_fiscal="",
+                nombre_extranjero=proveedor["nombre"],
+                nacionalidad="",
             )
-            resumen_mes.rename(columns={"UUID": "Num_CFDIs"}, inplace=True)
-            resumen_mes.to_excel(writer, sheet_name="Resumen_Mensual", index=False)
-
-        # Hoja de totales generales
-        totales_data = {
-            "Concepto": ["TOTAL GENERAL"],
-            "Num_CFDIs_Unicos": [len(df["UUID"].unique())],
-            "Total_Conceptos": [len(df)],
-            "Monto_Total": [df["Monto_Concepto"].sum()],
-            "Ingresos_Subtotal": [df["Ingresos_Subtotal"].sum()],
-            "Ingresos_IVA": [df["Ingresos_IVA"].sum()],
-            "Ingresos_Retencion_IVA": [df["Ingresos_Retencion_IVA"].sum()],
-            "Ingresos_Retencion_ISR": [df["Ingresos_Retencion_ISR"].sum()],
-            "Egresos_Subtotal": [df["Egresos_Subtotal"].sum()],
-            "Egresos_IVA": [df["Egresos_IVA"].sum()],
-            "Egresos_Total": [df["Egresos_Total"].sum()],
-        }
-        df_totales = pd.DataFrame(totales_data)
-        df_totales.to_excel(writer, sheet_name="Totales_Generales", index=False)
-
-        # Formatear todas las hojas
-        for sheet_name_ws in writer.sheets:
-            worksheet = writer.sheets[sheet_name_ws]
-
-            # Ajustar ancho de columnas
-            for column in worksheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                worksheet.column_dimensions[column_letter].width = adjusted_width
-
-    return buffer.getvalue()
+        proveedores.append(proveedor)
+    return proveedores
 
 
 def create_diot_interface():
@@ -324,65 +1008,10 @@ def create_diot_interface():
         df_recibidos, rfc_contribuyente, periodo_seleccionado
     ):
         """Analiza CFDIs recibidos y genera proveedores DIOT automáticamente"""
-        if df_recibidos is None or df_recibidos.empty:
-            return []
-
-        # Filtrar por el RFC del contribuyente (como receptor) y periodo si están disponibles
-        df_filtrado = df_recibidos.copy()
-
-        if rfc_contribuyente:
-            df_filtrado = df_filtrado[df_filtrado["Receptor_RFC"] == rfc_contribuyente]
-
-        if periodo_seleccionado:
-            # Filtrar por mes/periodo
-            df_filtrado = df_filtrado[
-                df_filtrado["Mes"].str.contains(periodo_seleccionado, na=False)
-            ]
-
-        if df_filtrado.empty:
-            return []
-
-        # Agrupar por proveedor (Emisor) y sumar montos
-        proveedores_auto = []
-
-        # Agrupar datos por RFC del emisor
-        grupos_emisor = (
-            df_filtrado.groupby(["Emisor_RFC", "Emisor_Nombre"])
-            .agg(
-                {
-                    "Egresos_Subtotal": "sum",
-                    "Egresos_IVA": "sum",
-                    "Egresos_Total": "sum",
-                }
-            )
-            .reset_index()
+        tabla = agregar_proveedores(
+            df_recibidos, rfc_contribuyente, periodo_seleccionado
         )
-
-        for _, row in grupos_emisor.iterrows():
-            if row["Egresos_Subtotal"] > 0:  # Solo incluir si hay montos
-                proveedor = {
-                    "tipo_tercero": "Proveedor Nacional",
-                    "tipo_operacion": "Otros",
-                    "rfc": row["Emisor_RFC"],
-                    "nombre": row["Emisor_Nombre"],
-                    "iva16": row["Egresos_IVA"],  # IVA pagado
-                    "iva16_na": 0,
-                    "iva_rfn": 0,
-                    "iva_rfn_na": 0,
-                    "iva_import16": 0,
-                    "iva_import16_na": 0,
-                    "iva_import_exento": 0,
-                    "iva0": 0,
-                    "iva_exento": 0,
-                    "retenido": 0,
-                    "devoluciones": 0,
-                    "tipo_tercero_enum": TipoTercero.PROVEEDOR_NACIONAL,
-                    "tipo_operacion_enum": TipoOperacion.OTROS,
-                    "auto_generado": True,  # Marca para identificar
-                }
-                proveedores_auto.append(proveedor)
-
-        return proveedores_auto
+        return diot_providers_from_table(tabla)
 
     # Formulario para datos de identificación - MEJORADO
     st.subheader("📝 Datos de Identificación")
@@ -612,7 +1241,13 @@ def create_diot_interface():
         st.session_state.proveedores_diot = []
 
     # NUEVA FUNCIONALIDAD: Auto-generar proveedores desde CFDIs
-    if datos_cfdi_disponibles and st.session_state.df_recibidos is not None:
+    # Con el almacén activo se consulta el histórico del RFC y periodo, no
+    # sólo lo que esté cargado en la sesión
+    store = get_store()
+    hay_historico = store is not None and store.contar("Recibidos") > 0
+    if (
+        datos_cfdi_disponibles and st.session_state.df_recibidos is not None
+    ) or hay_historico:
         col1, col2 = st.columns([2, 1])
         with col1:
             st.info(
@@ -621,11 +1256,24 @@ def create_diot_interface():
         with col2:
             if st.button("🚀 Auto-generar Proveedores", type="secondary"):
                 with st.spinner("Analizando CFDIs y generando proveedores..."):
+                    # Mes o trimestre del ejercicio elegido: 2025-01, 2025-Q1
                     periodo_seleccionado = (
-                        periodo[2][:7] if periodo and len(periodo) > 2 else None
-                    )  # Formato 2025-01
+                        f"{int(ejercicio)}-{periodo[2][5:]}"
+                        if periodo and len(periodo) > 2
+                        else None
+                    )
+                    df_fuente = st.session_state.df_recibidos
+                    if hay_historico and rfc and periodo_seleccionado:
+                        # Consulta por índice sólo el RFC y periodo elegidos
+                        rango = pd.Period(periodo_seleccionado)
+                        df_fuente = store.consultar(
+                            "Recibidos",
+                            receptores=[rfc],
+                            desde=rango.start_time,
+                            hasta=rango.end_time,
+                        )
                     proveedores_auto = generar_proveedores_desde_cfdis(
-                        st.session_state.df_recibidos, rfc, periodo_seleccionado
+                        df_fuente, rfc, periodo_seleccionado
                     )
 
                     if proveedores_auto:
@@ -683,15 +1331,27 @@ def create_diot_interface():
             st.write(f"🤖 **Auto-generados ({len(proveedores_auto)}):**")
             for i, prov in enumerate(proveedores_auto):
                 with st.expander(
-                    f"🤖 Proveedor {i + 1}: {prov.get('rfc', 'N/A')} - {prov.get('nombre', 'Sin nombre')}"
+                    f"🤖 Proveedor {i + 1}: {prov.get('rfc') or 'N/A'} - {prov.get('nombre', 'Sin nombre')}"
                 ):
                     col1, col2 = st.columns([3, 1])
                     with col1:
-                        st.write(f"**RFC:** {prov.get('rfc', 'N/A')}")
+                        st.write(f"**RFC:** {prov.get('rfc') or 'N/A'}")
                         st.write(f"**Nombre:** {prov.get('nombre', 'N/A')}")
                         st.write(f"**Tipo:** {prov['tipo_tercero']}")
                         st.write(f"**Operación:** {prov['tipo_operacion']}")
-                        st.write(f"**IVA 16%:** ${prov.get('iva16', 0):,.2f}")
+                        st.write(f"**Actos al 16%:** ${prov.get('iva16', 0):,.2f}")
+                        if prov.get("iva_sin_clasificar"):
+                            st.warning(
+                                "IVA sin base gravable: "
+                                f"${prov['iva_sin_clasificar']:,.2f} no se incluye "
+                                "en la DIOT; revisa estos CFDIs"
+                            )
+                        extranjero = TipoTercero.PROVEEDOR_EXTRANJERO
+                        if prov["tipo_tercero_enum"] == extranjero:
+                            st.warning(
+                                "Proveedor extranjero: captura su ID fiscal y "
+                                "nacionalidad antes de presentar la DIOT"
+                            )
                         st.caption("✨ Generado automáticamente desde CFDIs")
                     with col2:
                         if st.button(f"🗑️ Eliminar", key=f"del_auto_prov_{i}"):
@@ -703,7 +1363,7 @@ def create_diot_interface():
             for i, prov in enumerate(proveedores_manuales):
                 prov_index = st.session_state.proveedores_diot.index(prov)
                 with st.expander(
-                    f"✏️ Proveedor {i + 1}: {prov.get('nombre', prov.get('rfc', 'N/A'))}"
+                    f"✏️ Proveedor {i + 1}: {prov.get('nombre', prov.get('rfc') or 'N/A')}"
                 ):
                     col1, col2 = st.columns([3, 1])
                     with col1:
@@ -713,7 +1373,7 @@ def create_diot_interface():
                             st.write(f"**RFC:** {prov['rfc']}")
                         if "nombre_extranjero" in prov:
                             st.write(f"**Nombre:** {prov['nombre_extranjero']}")
-                        st.write(f"**IVA 16%:** ${prov.get('iva16', 0):,.2f}")
+                        st.write(f"**Actos al 16%:** ${prov.get('iva16', 0):,.2f}")
                         st.caption("✏️ Ingresado manualmente")
                     with col2:
                         if st.button(
@@ -780,45 +1440,50 @@ def create_diot_interface():
                 )
                 nacionalidad = st.text_input("Nacionalidad", key="nueva_nacionalidad")
 
-        # Montos de IVA
-        st.write("**Montos de IVA:**")
+        # Valor de los actos (base sin IVA) por tasa, como en el TXT de la DIOT
+        st.write("**Valor de los actos o actividades (sin IVA):**")
         col1, col2, col3 = st.columns(3)
 
         with col1:
             iva16 = st.number_input(
-                "IVA 16%", min_value=0.0, value=0.0, key="nuevo_iva16"
+                "Actos al 16%", min_value=0.0, value=0.0, key="nuevo_iva16"
             )
             iva16_na = st.number_input(
-                "IVA 16% No Acreditable", min_value=0.0, value=0.0, key="nuevo_iva16_na"
+                "Actos al 16% No Acreditable",
+                min_value=0.0,
+                value=0.0,
+                key="nuevo_iva16_na",
+            )
+            iva0 = st.number_input(
+                "Actos al 0%", min_value=0.0, value=0.0, key="nuevo_iva0"
             )
-            iva0 = st.number_input("IVA 0%", min_value=0.0, value=0.0, key="nuevo_iva0")
 
         with col2:
             iva_rfn = st.number_input(
-                "IVA RFN", min_value=0.0, value=0.0, key="nuevo_iva_rfn"
+                "Actos RFN", min_value=0.0, value=0.0, key="nuevo_iva_rfn"
             )
             iva_rfn_na = st.number_input(
-                "IVA RFN No Acreditable",
+                "Actos RFN No Acreditable",
                 min_value=0.0,
                 value=0.0,
                 key="nuevo_iva_rfn_na",
             )
             iva_exento = st.number_input(
-                "IVA Exento", min_value=0.0, value=0.0, key="nuevo_iva_exento"
+                "Actos Exentos", min_value=0.0, value=0.0, key="nuevo_iva_exento"
             )
 
         with col3:
             iva_import16 = st.number_input(
-                "IVA Import. 16%", min_value=0.0, value=0.0, key="nuevo_iva_import16"
+                "Import. al 16%", min_value=0.0, value=0.0, key="nuevo_iva_import16"
             )
             iva_import16_na = st.number_input(
-                "IVA Import. 16% NA",
+                "Import. al 16% NA",
                 min_value=0.0,
                 value=0.0,
                 key="nuevo_iva_import16_na",
             )
             iva_import_exento = st.number_input(
-                "IVA Import. Exento",
+                "Import. Exentas",
                 min_value=0.0,
                 value=0.0,
                 key="nuevo_iva_import_exento",
@@ -951,29 +1616,21 @@ def create_diot_interface():
             with st.spinner("Generando DIOT..."):
                 txt_content = ""  # Inicializar variable
                 try:
-                    # Generar contenido básico manualmente ya que tenemos todos los datos
-                    txt_content = (
-                        f"DIOT|{rfc}|{razon_social}|{ejercicio}|{periodo[1].value}\n"
+                    # Las líneas se escriben en bloque desde una tabla columnar
+                    tabla_proveedores = tabla_de_proveedores(
+                        st.session_state.proveedores_diot
                     )
-                    txt_content += (
-                        f"# Proveedores: {len(st.session_state.proveedores_diot)}\n"
+                    salida = io.StringIO()
+                    escribir_txt_diot(
+                        tabla_proveedores,
+                        salida,
+                        encabezado=[
+                            f"DIOT|{rfc}|{razon_social}|{ejercicio}|{periodo[1].value}",
+                            f"# Proveedores: {len(tabla_proveedores)}",
+                        ],
+                        tipos=(TipoTercero, TipoOperacion),
                     )
-
-                    for i, prov in enumerate(st.session_state.proveedores_diot):
-                        linea = f"{prov['tipo_tercero_enum'].value}|{prov['tipo_operacion_enum'].value}|"
-
-                        if prov.get("rfc"):
-                            linea += f"{prov['rfc']}||||||"
-                        else:
-                            linea += f"|{prov.get('id_fiscal', '')}|{prov.get('nombre_extranjero', '')}|||"
-
-                        linea += (
-                            f"{prov.get('iva16', 0):.2f}|{prov.get('iva16_na', 0):.2f}|"
-                        )
-                        linea += f"{prov.get('iva0', 0):.2f}|{prov.get('iva_exento', 0):.2f}|"
-                        linea += f"{prov.get('iva_rfn', 0):.2f}|{prov.get('retenido', 0):.2f}|"
-                        linea += f"{prov.get('devoluciones', 0):.2f}\n"
-                        txt_content += linea
+                    txt_content = salida.getvalue()
 
                     st.success("✅ DIOT generado exitosamente")
 
@@ -1000,10 +1657,10 @@ def create_diot_interface():
                         total_proveedores = len(st.session_state.proveedores_diot)
                         st.metric("Proveedores", total_proveedores)
                     with col2:
-                        total_iva = sum(
+                        total_actos16 = sum(
                             p.get("iva16", 0) for p in st.session_state.proveedores_diot
                         )
-                        st.metric("Total IVA 16%", f"${total_iva:,.2f}")
+                        st.metric("Total actos al 16%", f"${total_actos16:,.2f}")
                     with col3:
                         st.metric("Ejercicio", ejercicio)
 
@@ -1034,51 +1691,279 @@ def create_diot_interface():
             st.error("Verifica que todos los campos estén completos y sean válidos")
 
 
-def merge_pdfs(pdf_list):
-    """Fusiona múltiples PDFs en uno solo"""
-    if not pdf_list:
-        return None
+def batch_diot_ui(workers=None):
+    """
+    DIOTs en lote: una por RFC receptor y periodo de los CFDIs recibidos
+    Los proveedores se agregan una sola vez y los TXT se escriben en paralelo
+    en un trabajo de fondo; el ZIP se memoriza mientras no cambien los datos
+    ni la selección
+    """
+    df = st.session_state.df_recibidos
+    st.subheader("📦 DIOTs en lote")
+    if df is None or df.empty:
+        st.info("Procesa CFDIs recibidos para generar DIOTs en lote")
+        return
 
-    merger = PdfMerger()
+    rfcs = st.multiselect(
+        "RFCs receptores (vacío = todos)",
+        options=sorted(df["Receptor_RFC"].dropna().astype(str).unique()),
+        key="diot_lote_rfcs",
+    )
+    frecuencia = st.radio(
+        "Periodicidad",
+        options=["M", "Q"],
+        format_func={"M": "Mensual", "Q": "Trimestral"}.get,
+        horizontal=True,
+        key="diot_lote_frecuencia",
+    )
 
-    for pdf_info in pdf_list:
+    def preparar(directorio):
+        ruta = os.path.join(directorio, DIRECTORIO_ENTRADA, "conceptos.parquet")
+        guardar_tabla(df, ruta)
+
+    huella = f"{fingerprint_df(df)}|{','.join(rfcs)}|{frecuencia}"
+    resultado = job_download(
+        "diot_lote",
+        huella,
+        "diot_lote",
+        "DIOTs en lote",
+        {"frecuencia": frecuencia, "rfcs": rfcs or None, "workers": workers},
+        preparar,
+        prepare_label="📦 Generar DIOTs",
+        label="📦 Descargar DIOTs (ZIP)",
+        file_name="DIOTs.zip",
+        mime="application/zip",
+    )
+    if resultado is None:
+        return
+    if not resultado["archivo"]:
+        st.warning("No hay CFDIs recibidos con montos para esa selección")
+        return
+    st.success(f"✅ {len(resultado['resumen'])} DIOTs generadas")
+    st.dataframe(
+        pd.DataFrame(resultado["resumen"]),
+        use_container_width=True,
+        hide_index=True,
+    )
+
+
+def load_table_into_session(categoria, df):
+    """Reemplaza la tabla de la categoría en la sesión por df (sin XMLs ni PDFs)"""
+    st.session_state[f"df_{categoria}"] = df
+    st.session_state[f"claves_{categoria}"] = claves_unicas(df)
+    # Sin XMLs originales no hay PDFs para este periodo
+    st.session_state[f"xmls_{categoria}"] = []
+    cancel_job(f"trabajo_pdfs_{categoria}")
+    liberar_pdfs(st.session_state[f"pdfs_{categoria}"])
+    st.session_state[f"pdfs_{categoria}"] = []
+
+
+def saved_table_ui(categoria):
+    """
+    Carga en la sesión un periodo guardado en Parquet o Arrow
+    Evita volver a parsear los XMLs de un mes que ya se procesó antes
+    """
+    with st.expander("📂 Cargar periodo guardado (Parquet / Arrow)"):
+        archivo = st.file_uploader(
+            "Tabla de conceptos exportada previamente",
+            type=["parquet", "arrow", "feather"],
+            key=f"tabla_{categoria}",
+        )
+        if archivo is None or not st.button(
+            "📂 Cargar periodo", key=f"cargar_tabla_{categoria}"
+        ):
+            return
+
+        inicio = time.perf_counter()
         try:
-            pdf_buffer = io.BytesIO(pdf_info["content"])
-            merger.append(pdf_buffer)
+            df = cargar_tabla(archivo)
         except Exception as e:
-            st.warning(f"Error agregando PDF {pdf_info['filename']}: {e}")
+            st.error(f"No se pudo cargar {archivo.name}: {e}")
+            return
+
+        load_table_into_session(categoria, df)
+        save_to_store(df)
+        transcurrido = (time.perf_counter() - inicio) * 1000
+        st.success(f"✅ {len(df)} conceptos cargados en {transcurrido:.0f} ms")
+        st.info("Los PDFs requieren los XMLs originales; súbelos si los necesitas")
+
 
-    output_buffer = io.BytesIO()
-    merger.write(output_buffer)
-    merger.close()
+def stored_history_ui(categoria):
+    """
+    Consulta el histórico del almacén local por RFC y rango de fechas
+    El resultado reemplaza la tabla de la sesión, así que filtros, calculadora,
+    consolidado y DIOT trabajan sólo sobre el rango consultado
+    """
+    store = get_store()
+    if store is None:
+        return
+    nombre = categoria.capitalize()
+    with st.expander("🗄️ Histórico del almacén"):
+        total = store.contar(nombre)
+        if not total:
+            st.caption("El almacén todavía no tiene CFDIs de esta categoría")
+            return
+        st.caption(f"{total:,} conceptos guardados")
+
+        # En emitidos el contribuyente es el emisor; en recibidos, el receptor
+        columna_rfc = "Emisor_RFC" if nombre == "Emitidos" else "Receptor_RFC"
+        rfcs = st.multiselect(
+            "RFC del contribuyente",
+            options=store.valores(columna_rfc, nombre),
+            key=f"almacen_rfc_{categoria}",
+        )
+        primera, ultima = store.rango_fechas(nombre)
+        rango = st.date_input(
+            "Rango de fechas",
+            value=(primera.date(), ultima.date()) if primera is not None else (),
+            key=f"almacen_rango_{categoria}",
+        )
+        if not st.button(
+            "🗄️ Consultar almacén", key=f"consultar_almacen_{categoria}"
+        ):
+            return
 
-    return output_buffer.getvalue()
+        desde = rango[0] if len(rango) > 0 else None
+        hasta = rango[1] if len(rango) > 1 else desde
+        filtro_rfc = {"emisores" if nombre == "Emitidos" else "receptores": rfcs}
+        inicio = time.perf_counter()
+        df = store.consultar(nombre, desde=desde, hasta=hasta, **filtro_rfc)
+        if df.empty:
+            st.warning("No hay CFDIs en el almacén para esa consulta")
+            return
+        load_table_into_session(categoria, df)
+        transcurrido = (time.perf_counter() - inicio) * 1000
+        st.success(f"✅ {len(df)} conceptos consultados en {transcurrido:.0f} ms")
+
+
+def table_downloads(df, nombre_base):
+    """Descargas de la tabla completa en Parquet y Arrow, para recargarla después"""
+    huella = fingerprint_df(df)
+    for formato, etiqueta in (("parquet", "🗃️ Parquet"), ("arrow", "🏹 Arrow")):
+        file_name = f"{nombre_base}.{formato}"
+        lazy_download(
+            f"{formato}_{nombre_base}",
+            huella,
+            lambda: guardar_tabla(df, os.path.join(get_spool(), file_name), formato),
+            prepare_label=f"{etiqueta}: Preparar",
+            label=f"{etiqueta}: Descargar",
+            file_name=file_name,
+            mime="application/octet-stream",
+        )
 
 
-def apply_deducibility_filter(df, selected_claves):
+def deducibility_rules_ui(categoria):
     """
-    Aplica el filtro de deducibilidad basado en las claves seleccionadas
+    Reglas de deducibilidad del contribuyente: claves, familias del catálogo
+    y excepciones por proveedor. Se guardan por RFC, se aplican a la tabla
+    de la sesión y, en adelante, a cada ingesta
     """
-    if df is None or df.empty:
-        return df
+    df = st.session_state[f"df_{categoria}"]
+    claves = st.session_state.get(f"claves_{categoria}")
+    if df is None or not claves:
+        return
+    guardadas = get_deducibility_rules()
+    columna_rfc = columna_contribuyente(categoria.capitalize())
+    corto = {"emitidos": "emit", "recibidos": "rec"}[categoria]
+
+    st.subheader("✅ Seleccionar Servicios Deducibles")
 
-    # Crear una copia del DataFrame
-    df_filtered = df.copy()
+    with st.expander("Configurar Deducibilidad", expanded=True):
+        rfcs = sorted(str(rfc) for rfc in df[columna_rfc].dropna().unique() if rfc)
+        if not rfcs:
+            return
+        rfc = st.selectbox(
+            "RFC del contribuyente:", options=rfcs, key=f"deducible_rfc_{categoria}"
+        )
+        reglas = guardadas.obtener(rfc) if guardadas else ReglasDeducibilidad()
 
-    # Marcar como deducible los conceptos con claves seleccionadas
-    df_filtered["Deducible"] = df_filtered["Clave_ProdServ"].isin(selected_claves)
+        st.info(
+            "💡 Selecciona las claves de productos/servicios que son deducibles de impuestos:"
+        )
 
-    return df_filtered
+        # Crear columnas para mostrar las claves organizadamente
+        n_cols = min(3, len(claves))  # Máximo 3 columnas
+        cols = st.columns(n_cols)
+
+        selected_claves = []
+        for i, clave in enumerate(claves):
+            with cols[i % n_cols]:
+                if st.checkbox(
+                    f"🔑 {clave}",
+                    value=clave in reglas.claves,
+                    key=f"clave_{corto}_{rfc}_{clave}",
+                ):
+                    selected_claves.append(clave)
+
+        prefijos = st.text_input(
+            "Familias deducibles (prefijos del catálogo SAT, separados por coma):",
+            value=", ".join(reglas.prefijos),
+            help="Ejemplo: 8013 marca como deducibles todas las claves 8013xxxx",
+            key=f"prefijos_{corto}_{rfc}",
+        )
+
+        emisores = sorted(str(e) for e in df["Emisor_RFC"].dropna().unique() if e)
+        col_si, col_no = st.columns(2)
+        with col_si:
+            siempre = st.multiselect(
+                "Proveedores siempre deducibles:",
+                options=emisores,
+                default=[e for e, v in reglas.emisores.items() if v and e in emisores],
+                key=f"siempre_{corto}_{rfc}",
+            )
+        with col_no:
+            nunca = st.multiselect(
+                "Proveedores nunca deducibles:",
+                options=emisores,
+                default=[
+                    e for e, v in reglas.emisores.items() if not v and e in emisores
+                ],
+                key=f"nunca_{corto}_{rfc}",
+            )
+
+        if st.button(
+            "💾 Aplicar Configuración de Deducibilidad", key=f"apply_deduct_{corto}"
+        ):
+            # Las excepciones de proveedores que no están en esta tabla se conservan
+            excepciones = {
+                e: v for e, v in reglas.emisores.items() if e not in emisores
+            }
+            excepciones.update({e: True for e in siempre})
+            excepciones.update({e: False for e in nunca})
+            nuevas = ReglasDeducibilidad(
+                selected_claves, prefijos.split(","), excepciones
+            )
+            with st.spinner("Aplicando configuración..."):
+                if guardadas is not None:
+                    guardadas.guardar(rfc, nuevas)
+                st.session_state[f"df_{categoria}"] = etiquetar(df, {rfc: nuevas})
+                save_to_store(st.session_state[f"df_{categoria}"], solo_deducible=True)
+                st.success(
+                    f"✅ Configuración aplicada: {len(selected_claves)} claves marcadas como deducibles"
+                )
+                # Usar tiempo corto para evitar bucles infinitos
+                time.sleep(0.5)
+            st.rerun()
 
 
 def create_data_calculator_ui(df, prefix=""):
     """
     Crea una calculadora simple para consultas rápidas de los datos
+    Las métricas se obtienen sumando las celdas del cubo pre-agregado de df,
+    no recorriendo los conceptos
     """
     if df is None or df.empty:
         st.warning("No hay datos disponibles para calcular.")
         return df
 
+    # Sólo el cubo de una tabla completa se comparte; el de una tabla
+    # filtrada es de esta sesión
+    completa = any(
+        st.session_state.get(f"df_{categoria}") is df
+        for categoria in ("emitidos", "recibidos")
+    )
+    cubo = get_cube(df, compartir=completa)
+
     st.subheader("🧮 Calculadora de CFDIs")
 
     with st.expander("Realizar Cálculos", expanded=False):
@@ -1088,30 +1973,13 @@ def create_data_calculator_ui(df, prefix=""):
             st.write("**Filtros para el cálculo:**")
 
             # Filtro por RFC Emisor (el más importante para DIOT)
-            emisores_unicos = ["Todos"] + sorted(
-                [
-                    f"{row['Emisor_RFC']} - {row['Emisor_Nombre']}"
-                    for _, row in df[["Emisor_RFC", "Emisor_Nombre"]]
-                    .drop_duplicates()
-                    .iterrows()
-                    if pd.notna(row["Emisor_RFC"]) and pd.notna(row["Emisor_Nombre"])
-                ]
-            )
+            emisores_unicos = ["Todos"] + sorted(cubo.etiquetas["Emisor_RFC"])
             selected_emisor = st.selectbox(
                 "RFC Emisor:", options=emisores_unicos, key=f"calc_emisor_{prefix}"
             )
 
             # Filtro por RFC Receptor
-            receptores_unicos = ["Todos"] + sorted(
-                [
-                    f"{row['Receptor_RFC']} - {row['Receptor_Nombre']}"
-                    for _, row in df[["Receptor_RFC", "Receptor_Nombre"]]
-                    .drop_duplicates()
-                    .iterrows()
-                    if pd.notna(row["Receptor_RFC"])
-                    and pd.notna(row["Receptor_Nombre"])
-                ]
-            )
+            receptores_unicos = ["Todos"] + sorted(cubo.etiquetas["Receptor_RFC"])
             selected_receptor = st.selectbox(
                 "RFC Receptor:",
                 options=receptores_unicos,
@@ -1140,94 +2008,71 @@ def create_data_calculator_ui(df, prefix=""):
 
             if st.button("🧮 Calcular", key=f"calc_btn_{prefix}"):
                 # Aplicar filtros
-                df_calc = df.copy()
+                filtros = {}
 
                 if selected_emisor != "Todos":
                     # Extraer solo el RFC (antes del ' - ')
-                    rfc_emisor = selected_emisor.split(" - ")[0]
-                    df_calc = df_calc[df_calc["Emisor_RFC"] == rfc_emisor]
+                    filtros["emisores"] = [selected_emisor.split(" - ")[0]]
 
                 if selected_receptor != "Todos":
                     # Extraer solo el RFC (antes del ' - ')
-                    rfc_receptor = selected_receptor.split(" - ")[0]
-                    df_calc = df_calc[df_calc["Receptor_RFC"] == rfc_receptor]
+                    filtros["receptores"] = [selected_receptor.split(" - ")[0]]
 
                 # Sin filtro de fechas por ahora
 
-                # Realizar cálculos
-                if df_calc.empty:
+                # Realizar cálculos sobre las celdas del cubo
+                totales = cubo.totales(**filtros)
+                total_deducible = cubo.totales(deducible=True, **filtros)[
+                    "Monto_Concepto"
+                ]
+                conceptos = int(totales["Conceptos"])
+                iva_total = totales["Ingresos_IVA"] + totales["Egresos_IVA"]
+                promedio = totales["Total_CFDI"] / max(conceptos, 1)
+
+                if not conceptos:
                     st.error(
                         "No hay datos que coincidan con los filtros seleccionados."
                     )
                 else:
-                    st.success(f"📊 Datos encontrados: {len(df_calc)} registros")
+                    st.success(f"📊 Datos encontrados: {conceptos} registros")
 
                     if tipo_calculo == "Ingresos Totales":
-                        total = df_calc["Total_CFDI"].sum()
+                        total = totales["Total_CFDI"]
                         st.metric("💰 Ingresos Totales", f"${total:,.2f}")
 
                     elif tipo_calculo == "IVA Total":
-                        iva_total = (
-                            df_calc["Ingresos_IVA"].sum() + df_calc["Egresos_IVA"].sum()
-                        )
                         st.metric("📋 IVA Total", f"${iva_total:,.2f}")
 
                     elif tipo_calculo == "Subtotal sin IVA":
-                        subtotal = df_calc["SubTotal_CFDI"].sum()
+                        subtotal = totales["SubTotal_CFDI"]
                         st.metric("📊 Subtotal (sin IVA)", f"${subtotal:,.2f}")
 
                     elif tipo_calculo == "Número de Facturas":
-                        num_facturas = df_calc["UUID"].nunique()
+                        num_facturas = int(totales["CFDIs"])
                         st.metric("📄 Número de Facturas", num_facturas)
 
                     elif tipo_calculo == "Promedio por Factura":
-                        if len(df_calc) > 0:
-                            promedio = df_calc["Total_CFDI"].mean()
-                            st.metric("📈 Promedio por Factura", f"${promedio:,.2f}")
+                        st.metric("📈 Promedio por Factura", f"${promedio:,.2f}")
 
                     elif tipo_calculo == "Gastos Deducibles":
-                        if "Deducible" in df_calc.columns:
-                            deducibles = df_calc[df_calc["Deducible"] == True]
-                            total_deducible = deducibles["Monto_Concepto"].sum()
-                            st.metric(
-                                "💸 Gastos Deducibles", f"${total_deducible:,.2f}"
-                            )
-                        else:
-                            st.info(
-                                "Primero marca los servicios deducibles en el checklist"
-                            )
+                        st.metric("💸 Gastos Deducibles", f"${total_deducible:,.2f}")
 
                     elif tipo_calculo == "Resumen Completo":
                         col_res1, col_res2, col_res3 = st.columns(3)
 
                         with col_res1:
+                            st.metric("💰 Total", f"${totales['Total_CFDI']:,.2f}")
                             st.metric(
-                                "💰 Total", f"${df_calc['Total_CFDI'].sum():,.2f}"
-                            )
-                            st.metric(
-                                "📊 Subtotal", f"${df_calc['SubTotal_CFDI'].sum():,.2f}"
+                                "📊 Subtotal", f"${totales['SubTotal_CFDI']:,.2f}"
                             )
 
                         with col_res2:
-                            iva_total = (
-                                df_calc["Ingresos_IVA"].sum()
-                                + df_calc["Egresos_IVA"].sum()
-                            )
                             st.metric("📋 IVA Total", f"${iva_total:,.2f}")
-                            st.metric("📄 Facturas", df_calc["UUID"].nunique())
+                            st.metric("📄 Facturas", int(totales["CFDIs"]))
 
                         with col_res3:
-                            if "Deducible" in df_calc.columns:
-                                deducibles = df_calc[df_calc["Deducible"] == True]
-                                st.metric(
-                                    "💸 Deducibles",
-                                    f"${deducibles['Monto_Concepto'].sum():,.2f}",
-                                )
-                            else:
-                                st.metric("💸 Deducibles", "N/A")
-                            st.metric(
-                                "📈 Promedio", f"${df_calc['Total_CFDI'].mean():,.2f}"
-                            )
+                            st.metric("💸 Deducibles", f"${total_deducible:,.2f}")
+                            st.metric("📈 Promedio", f"${promedio:,.2f}")
 
                     # Mostrar información adicional
                     if selected_emisor != "Todos":
@@ -1238,14 +2083,33 @@ def create_data_calculator_ui(df, prefix=""):
     return df
 
 
+def get_filter_index(df, prefix):
+    """
+    Índice de filtros de la tabla, construido una vez por tabla
+    Se guarda junto con la tabla que lo originó: mientras la sesión conserve
+    el mismo objeto, los reruns reutilizan el índice (y las demás sesiones con
+    esa misma tabla lo toman de la caché compartida)
+    """
+    clave = f"indice_filtros_{prefix}"
+    guardado = st.session_state.get(clave)
+    if guardado is None or guardado[0] is not df:
+        indice = get_shared_derived("indice_filtros", df, IndiceFiltros)
+        guardado = st.session_state[clave] = (df, indice)
+    return guardado[1]
+
+
 def create_data_filter_ui(df, prefix=""):
     """
     Crea una interfaz para filtrar los datos por diferentes criterios
+    Las opciones y los filtros salen de un índice precalculado, así que un
+    rerun no vuelve a recorrer la tabla completa
     """
     if df is None or df.empty:
         st.warning("No hay datos disponibles para filtrar.")
         return df
 
+    indice = get_filter_index(df, prefix)
+
     st.subheader("🔍 Filtros de Datos")
 
     with st.expander("Configurar Filtros", expanded=False):
@@ -1253,28 +2117,25 @@ def create_data_filter_ui(df, prefix=""):
 
         with col1:
             # Filtro por RFC Receptor
-            receptores_unicos = sorted(df["Receptor_RFC"].dropna().unique())
             selected_receptores = st.multiselect(
                 "RFC Receptor:",
-                options=receptores_unicos,
+                options=indice.opciones["Receptor_RFC"],
                 default=[],
                 key=f"receptores_{prefix}",
             )
 
             # Filtro por RFC Emisor
-            emisores_unicos = sorted(df["Emisor_RFC"].dropna().unique())
             selected_emisores = st.multiselect(
                 "RFC Emisor:",
-                options=emisores_unicos,
+                options=indice.opciones["Emisor_RFC"],
                 default=[],
                 key=f"emisores_{prefix}",
             )
 
             # Filtro por Tipo de Comprobante
-            tipos_comprobante = sorted(df["Tipo_Comprobante"].dropna().unique())
             selected_tipos = st.multiselect(
                 "Tipo de Comprobante:",
-                options=tipos_comprobante,
+                options=indice.opciones["Tipo_Comprobante"],
                 default=[],
                 key=f"tipos_{prefix}",
             )
@@ -1284,76 +2145,66 @@ def create_data_filter_ui(df, prefix=""):
             fecha_inicio = None
             fecha_fin = None
 
-            if "Fecha" in df.columns and not df["Fecha"].isna().all():
-                fechas_validas = pd.to_datetime(
-                    df["Fecha"], format="%d/%m/%Y", errors="coerce"
-                ).dropna()
-                if not fechas_validas.empty:
-                    fecha_min = fechas_validas.min().date()
-                    fecha_max = fechas_validas.max().date()
-
-                    fecha_inicio = st.date_input(
-                        "Fecha Inicio:",
-                        value=fecha_min,
-                        min_value=fecha_min,
-                        max_value=fecha_max,
-                    )
+            fecha_min, fecha_max = indice.rango_fechas()
+            if fecha_min is not None:
+                fecha_min = fecha_min.date()
+                fecha_max = fecha_max.date()
+
+                fecha_inicio = st.date_input(
+                    "Fecha Inicio:",
+                    value=fecha_min,
+                    min_value=fecha_min,
+                    max_value=fecha_max,
+                    key=f"fecha_inicio_{prefix}",
+                )
 
-                    fecha_fin = st.date_input(
-                        "Fecha Fin:",
-                        value=fecha_max,
-                        min_value=fecha_min,
-                        max_value=fecha_max,
-                    )
+                fecha_fin = st.date_input(
+                    "Fecha Fin:",
+                    value=fecha_max,
+                    min_value=fecha_min,
+                    max_value=fecha_max,
+                    key=f"fecha_fin_{prefix}",
+                )
 
             # Filtro por monto mínimo
             monto_min = st.number_input(
-                "Monto Mínimo:", min_value=0.0, value=0.0, step=100.0
+                "Monto Mínimo:",
+                min_value=0.0,
+                value=0.0,
+                step=100.0,
+                key=f"monto_min_{prefix}",
             )
 
             # Filtro por deducibilidad
             filtro_deducible = st.selectbox(
                 "Mostrar solo:",
                 options=["Todos", "Solo Deducibles", "Solo No Deducibles"],
+                key=f"deducible_{prefix}",
             )
 
-    # Aplicar filtros
-    df_filtered = df.copy()
-
-    if selected_receptores:
-        df_filtered = df_filtered[df_filtered["Receptor_RFC"].isin(selected_receptores)]
-
-    if selected_emisores:
-        df_filtered = df_filtered[df_filtered["Emisor_RFC"].isin(selected_emisores)]
-
-    if selected_tipos:
-        df_filtered = df_filtered[df_filtered["Tipo_Comprobante"].isin(selected_tipos)]
-
-    if fecha_inicio is not None and fecha_fin is not None:
-        # Convertir fechas del DataFrame para comparación
-        df_fechas = pd.to_datetime(
-            df_filtered["Fecha"], format="%d/%m/%Y", errors="coerce"
-        )
-        # Manejo seguro de tipos de fecha de Streamlit
-        try:
-            # Convertir a string y luego a timestamp para manejar todos los tipos
-            inicio_str = str(fecha_inicio)
-            fin_str = str(fecha_fin)
-            inicio_ts = pd.Timestamp(inicio_str)
-            fin_ts = pd.Timestamp(fin_str)
-            mask_fecha = (df_fechas >= inicio_ts) & (df_fechas <= fin_ts)
-            df_filtered = df_filtered[mask_fecha]
-        except (TypeError, ValueError):
-            # Si hay problemas con las fechas, simplemente no aplicar el filtro
-            pass
-
-    if monto_min > 0:
-        df_filtered = df_filtered[df_filtered["Monto_Concepto"] >= monto_min]
-
-    if filtro_deducible == "Solo Deducibles":
-        df_filtered = df_filtered[df_filtered["Deducible"] == True]
-    elif filtro_deducible == "Solo No Deducibles":
-        df_filtered = df_filtered[df_filtered["Deducible"] == False]
+    # El rango completo de fechas no filtra: también conserva filas sin Fecha
+    if (fecha_inicio, fecha_fin) == (fecha_min, fecha_max):
+        fecha_inicio = fecha_fin = None
+
+    filtros = dict(
+        receptores=selected_receptores,
+        emisores=selected_emisores,
+        tipos=selected_tipos,
+        desde=fecha_inicio,
+        hasta=fecha_fin,
+        monto_minimo=monto_min,
+        deducible={"Solo Deducibles": True, "Solo No Deducibles": False}.get(
+            filtro_deducible
+        ),
+    )
+    # Con los mismos filtros se reutiliza la misma tabla filtrada, así que su
+    # cubo en la calculadora tampoco se reconstruye en cada rerun
+    clave = f"filtrado_{prefix}"
+    guardado = st.session_state.get(clave)
+    if guardado is None or guardado[0] is not df or guardado[1] != filtros:
+        resultado = indice.filtrar(df, **filtros)
+        guardado = st.session_state[clave] = (df, filtros, resultado)
+    df_filtered = guardado[2]
 
     # Mostrar resumen del filtrado
     if len(df_filtered) != len(df):
@@ -1416,6 +2267,9 @@ def create_custom_export_ui(df, prefix=""):
                     df_export.to_excel(
                         writer, sheet_name="Datos_Personalizados", index=False
                     )
+                    formatear_fechas_excel(
+                        writer.sheets["Datos_Personalizados"], df_export
+                    )
 
                 st.download_button(
                     label="📥 Descargar Excel Personalizado",
@@ -1426,7 +2280,9 @@ def create_custom_export_ui(df, prefix=""):
 
             elif formato_export == "CSV (.csv)":
                 # Crear CSV
-                csv_data = df_export.to_csv(index=False, encoding="utf-8-sig")
+                csv_data = df_export.to_csv(
+                    index=False, encoding="utf-8-sig", date_format=FORMATO_FECHA
+                )
 
                 st.download_button(
                     label="📥 Descargar CSV Personalizado",
@@ -1482,6 +2338,47 @@ def main():
     - Datos de emisor/receptor
     """)
 
+    # Configuración de ingesta paralela
+    st.sidebar.header("⚙️ Procesamiento")
+    workers = st.sidebar.number_input(
+        "Procesos paralelos",
+        min_value=1,
+        max_value=max(1, os.cpu_count() or 1) * 2,
+        value=workers_por_defecto(),
+        help="Procesos para parsear XMLs y generar PDFs. Usa 1 para procesar en serie.",
+        key="ingesta_workers",
+    )
+    st.sidebar.checkbox(
+        "♻️ Usar caché de XMLs",
+        value=True,
+        help="Reutiliza los resultados de XMLs ya procesados (por hash de contenido)",
+        key="usar_cache",
+    )
+    if st.sidebar.button("🗑️ Vaciar caché", key="vaciar_cache"):
+        cache = get_cache()
+        if cache is not None:
+            cache.limpiar()
+            st.sidebar.success("Caché vaciada")
+    memoria = get_shared_memory().resumen()
+    st.sidebar.caption(
+        f"🧠 Caché compartida: {memoria['entradas']} resultados, "
+        f"{memoria['bytes'] / 2**20:.0f} de {memoria['max_bytes'] / 2**20:.0f} MB"
+    )
+    st.sidebar.checkbox(
+        "🗄️ Guardar en almacén local",
+        value=True,
+        help="Guarda los conceptos procesados en output/ para consultarlos en otras sesiones",
+        key="usar_almacen",
+    )
+    st.sidebar.checkbox(
+        "📝 Registrar rendimiento en JSONL",
+        value=False,
+        help="Agrega el tiempo y la memoria por etapa de cada lote a output/rendimiento.jsonl",
+        key="perfil_jsonl",
+    )
+
+    jobs_panel_ui()
+
     # Tabs principales - agregamos DIOT
     tab1, tab2, tab3, tab4 = st.tabs(
         ["📤 CFDIs Emitidos", "📥 CFDIs Recibidos", "📊 Consolidado", "📋 DIOT"]
@@ -1492,6 +2389,10 @@ def main():
         st.session_state.df_emitidos = None
     if "df_recibidos" not in st.session_state:
         st.session_state.df_recibidos = None
+    if "xmls_emitidos" not in st.session_state:
+        st.session_state.xmls_emitidos = []
+    if "xmls_recibidos" not in st.session_state:
+        st.session_state.xmls_recibidos = []
     if "pdfs_emitidos" not in st.session_state:
         st.session_state.pdfs_emitidos = []
     if "pdfs_recibidos" not in st.session_state:
@@ -1505,79 +2406,51 @@ def main():
         st.header("📤 CFDIs Emitidos")
 
         uploaded_emitidos = st.file_uploader(
-            "📁 Selecciona archivos XML de CFDIs emitidos",
-            type=["xml"],
+            "📁 Selecciona archivos XML o ZIP de CFDIs emitidos",
+            type=["xml", "zip"],
             accept_multiple_files=True,
             key="emitidos",
         )
+        saved_table_ui("emitidos")
+        stored_history_ui("emitidos")
 
+        if not uploaded_emitidos:
+            stop_ingestion("emitidos")
         if uploaded_emitidos:
-            if st.button("🚀 Procesar CFDIs Emitidos", key="btn_emitidos"):
-                with st.spinner("Procesando CFDIs emitidos..."):
-                    result = process_xml_files_enhanced(uploaded_emitidos, "Emitidos")
-                    # La función ahora retorna 3 valores: df, pdfs, claves_unicas
-                    (
-                        st.session_state.df_emitidos,
-                        st.session_state.pdfs_emitidos,
-                        st.session_state.claves_emitidos,
-                    ) = result
-
-                if st.session_state.df_emitidos is not None:
-                    st.success(
-                        f"✅ {len(st.session_state.df_emitidos)} conceptos procesados"
-                    )
-                    st.success(
-                        f"📄 {len(st.session_state.pdfs_emitidos)} PDFs generados"
-                    )
-                    st.success(
-                        f"🔑 {len(st.session_state.claves_emitidos)} claves de productos/servicios encontradas"
-                    )
-
-        if st.session_state.df_emitidos is not None:
-            # Checklist de deducibilidad
-            if (
-                "claves_emitidos" in st.session_state
-                and st.session_state.claves_emitidos
+            agregar = st.session_state.df_emitidos is not None and st.checkbox(
+                "➕ Agregar a los CFDIs ya cargados",
+                help="Conserva los CFDIs de la sesión y omite los UUIDs que ya están",
+                key="agregar_emitidos",
+            )
+            continua = st.checkbox(
+                "⚡ Procesar mientras se suben",
+                help="Parsea cada archivo en cuanto termina de subir, sin esperar a los demás",
+                key="continua_emitidos",
+            )
+            if continua:
+                streaming_ingestion_ui(
+                    "emitidos", uploaded_emitidos, int(workers), agregar
+                )
+            elif st.session_state.get("ingesta_emitidos") is not None:
+                stop_ingestion("emitidos")
+            if not continua and st.button(
+                "🚀 Procesar CFDIs Emitidos", key="btn_emitidos"
             ):
-                st.subheader("✅ Seleccionar Servicios Deducibles")
+                submit_ingestion_job(
+                    "emitidos", uploaded_emitidos, int(workers), agregar
+                )
 
-                with st.expander("Configurar Deducibilidad", expanded=True):
-                    st.info(
-                        "💡 Selecciona las claves de productos/servicios que son deducibles de impuestos:"
-                    )
+        # La ingesta corre en segundo plano; su resultado se carga al terminar
+        ingestion_job_ui("emitidos")
 
-                    # Crear columnas para mostrar las claves organizadamente
-                    n_claves = len(st.session_state.claves_emitidos)
-                    n_cols = min(3, n_claves)  # Máximo 3 columnas
-                    cols = st.columns(n_cols)
-
-                    selected_claves = []
-                    for i, clave in enumerate(st.session_state.claves_emitidos):
-                        col_idx = i % n_cols
-                        with cols[col_idx]:
-                            if st.checkbox(f"� {clave}", key=f"clave_emit_{clave}"):
-                                selected_claves.append(clave)
-
-                    if st.button(
-                        "💾 Aplicar Configuración de Deducibilidad",
-                        key="apply_deduct_emit",
-                    ):
-                        with st.spinner("Aplicando configuración..."):
-                            # Aplicar el filtro de deducibilidad
-                            st.session_state.df_emitidos = apply_deducibility_filter(
-                                st.session_state.df_emitidos, selected_claves
-                            )
-                            st.success(
-                                f"✅ Configuración aplicada: {len(selected_claves)} claves marcadas como deducibles"
-                            )
-                            # Usar tiempo corto para evitar bucles infinitos
-                            import time
-
-                            time.sleep(0.5)
-                        st.rerun()
+        if st.session_state.df_emitidos is not None:
+            # Reglas de deducibilidad del contribuyente
+            deducibility_rules_ui("emitidos")
 
             # Filtros de datos
-            df_filtered = st.session_state.df_emitidos
+            df_filtered = create_data_filter_ui(
+                st.session_state.df_emitidos, "emitidos"
+            )
 
             # Calculadora de CFDIs
             create_data_calculator_ui(df_filtered, "emitidos")
@@ -1610,117 +2483,110 @@ def main():
                 with col6:
                     st.metric(
                         "📊 % Deducible",
-                        f"{len(deducibles) / len(df_filtered) * 100:.1f}%",
+                        f"{len(deducibles) / max(len(df_filtered), 1) * 100:.1f}%",
                     )
 
             # Mostrar datos filtrados
             st.subheader("📋 Datos Detallados")
-            st.dataframe(df_filtered, use_container_width=True, height=300)
+            st.dataframe(
+                df_filtered,
+                use_container_width=True,
+                height=300,
+                column_config=config_columnas(),
+            )
 
             # Exportación personalizada - Simplificada en botones tradicionales
 
             # Botones de descarga tradicionales
             st.subheader("📥 Descargas Tradicionales")
-            col1, col2 = st.columns(2)
+            col1, col2, col3 = st.columns(3)
 
             with col1:
-                excel_data = create_enhanced_excel(df_filtered, "Emitidos", "Emitidos")
-                if excel_data:
-                    st.download_button(
-                        label="📊 Descargar Excel Completo",
-                        data=excel_data,
-                        file_name="CFDIs_Emitidos_Completo.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    )
+                # El Excel se construye sólo al pedirlo y se reutiliza
+                # mientras los datos filtrados no cambien
+                lazy_download(
+                    "excel_emitidos",
+                    fingerprint_df(df_filtered),
+                    lambda: build_excel_file(
+                        df_filtered, "CFDIs_Emitidos_Completo.xlsx", "Emitidos"
+                    ),
+                    prepare_label="📊 Preparar Excel Completo",
+                    label="📊 Descargar Excel Completo",
+                    file_name="CFDIs_Emitidos_Completo.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                )
 
             with col2:
-                if st.session_state.pdfs_emitidos:
-                    merged_pdf = merge_pdfs(st.session_state.pdfs_emitidos)
-                    if merged_pdf:
-                        st.download_button(
-                            label="📄 Descargar PDF Consolidado",
-                            data=merged_pdf,
-                            file_name="CFDIs_Emitidos_Consolidado.pdf",
-                            mime="application/pdf",
-                        )
+                if ensure_pdfs(["emitidos"], "🖨️ Generar PDFs", "gen_pdfs_emitidos"):
+                    # La fusión se memoriza con la huella de los PDFs
+                    pdfs = st.session_state.pdfs_emitidos
+                    job_download(
+                        "pdf_emitidos",
+                        fingerprint_files(pdfs),
+                        "fusion",
+                        "Fusión de CFDIs_Emitidos_Consolidado.pdf",
+                        {
+                            "rutas": [pdf["path"] for pdf in pdfs],
+                            "nombre": "CFDIs_Emitidos_Consolidado.pdf",
+                        },
+                        label="📄 Descargar PDF Consolidado",
+                        file_name="CFDIs_Emitidos_Consolidado.pdf",
+                        mime="application/pdf",
+                    )
+
+            with col3:
+                # Tabla completa con tipos, para recargar el periodo sin XMLs
+                table_downloads(st.session_state.df_emitidos, "CFDIs_Emitidos")
 
     with tab2:
         st.header("📥 CFDIs Recibidos")
 
         uploaded_recibidos = st.file_uploader(
-            "📁 Selecciona archivos XML de CFDIs recibidos",
-            type=["xml"],
+            "📁 Selecciona archivos XML o ZIP de CFDIs recibidos",
+            type=["xml", "zip"],
             accept_multiple_files=True,
             key="recibidos",
         )
+        saved_table_ui("recibidos")
+        stored_history_ui("recibidos")
 
+        if not uploaded_recibidos:
+            stop_ingestion("recibidos")
         if uploaded_recibidos:
-            if st.button("🚀 Procesar CFDIs Recibidos", key="btn_recibidos"):
-                with st.spinner("Procesando CFDIs recibidos..."):
-                    result = process_xml_files_enhanced(uploaded_recibidos, "Recibidos")
-                    # La función ahora retorna 3 valores: df, pdfs, claves_unicas
-                    (
-                        st.session_state.df_recibidos,
-                        st.session_state.pdfs_recibidos,
-                        st.session_state.claves_recibidos,
-                    ) = result
-
-                if st.session_state.df_recibidos is not None:
-                    st.success(
-                        f"✅ {len(st.session_state.df_recibidos)} conceptos procesados"
-                    )
-                    st.success(
-                        f"📄 {len(st.session_state.pdfs_recibidos)} PDFs generados"
-                    )
-                    st.success(
-                        f"🔑 {len(st.session_state.claves_recibidos)} claves de productos/servicios encontradas"
-                    )
-
-        if st.session_state.df_recibidos is not None:
-            # Checklist de deducibilidad
-            if (
-                "claves_recibidos" in st.session_state
-                and st.session_state.claves_recibidos
+            agregar = st.session_state.df_recibidos is not None and st.checkbox(
+                "➕ Agregar a los CFDIs ya cargados",
+                help="Conserva los CFDIs de la sesión y omite los UUIDs que ya están",
+                key="agregar_recibidos",
+            )
+            continua = st.checkbox(
+                "⚡ Procesar mientras se suben",
+                help="Parsea cada archivo en cuanto termina de subir, sin esperar a los demás",
+                key="continua_recibidos",
+            )
+            if continua:
+                streaming_ingestion_ui(
+                    "recibidos", uploaded_recibidos, int(workers), agregar
+                )
+            elif st.session_state.get("ingesta_recibidos") is not None:
+                stop_ingestion("recibidos")
+            if not continua and st.button(
+                "🚀 Procesar CFDIs Recibidos", key="btn_recibidos"
             ):
-                st.subheader("✅ Seleccionar Servicios Deducibles")
-
-                with st.expander("Configurar Deducibilidad", expanded=True):
-                    st.info(
-                        "💡 Selecciona las claves de productos/servicios que son deducibles de impuestos:"
-                    )
+                submit_ingestion_job(
+                    "recibidos", uploaded_recibidos, int(workers), agregar
+                )
 
-                    # Crear columnas para mostrar las claves organizadamente
-                    n_claves = len(st.session_state.claves_recibidos)
-                    n_cols = min(3, n_claves)  # Máximo 3 columnas
-                    cols = st.columns(n_cols)
-
-                    selected_claves = []
-                    for i, clave in enumerate(st.session_state.claves_recibidos):
-                        col_idx = i % n_cols
-                        with cols[col_idx]:
-                            if st.checkbox(f"🔑 {clave}", key=f"clave_rec_{clave}"):
-                                selected_claves.append(clave)
-
-                    if st.button(
-                        "💾 Aplicar Configuración de Deducibilidad",
-                        key="apply_deduct_rec",
-                    ):
-                        with st.spinner("Aplicando configuración..."):
-                            # Aplicar el filtro de deducibilidad
-                            st.session_state.df_recibidos = apply_deducibility_filter(
-                                st.session_state.df_recibidos, selected_claves
-                            )
-                            st.success(
-                                f"✅ Configuración aplicada: {len(selected_claves)} claves marcadas como deducibles"
-                            )
-                            # Usar tiempo corto para evitar bucles infinitos
-                            import time
+        # La ingesta corre en segundo plano; su resultado se carga al terminar
+        ingestion_job_ui("recibidos")
 
-                            time.sleep(0.5)
-                        st.rerun()
+        if st.session_state.df_recibidos is not None:
+            # Reglas de deducibilidad del contribuyente
+            deducibility_rules_ui("recibidos")
 
             # Filtros de datos
-            df_filtered = st.session_state.df_recibidos
+            df_filtered = create_data_filter_ui(
+                st.session_state.df_recibidos, "recibidos"
+            )
 
             # Calculadora de CFDIs
             create_data_calculator_ui(df_filtered, "recibidos")
@@ -1757,41 +2623,60 @@ def main():
                 with col6:
                     st.metric(
                         "📊 % Deducible",
-                        f"{len(deducibles) / len(df_filtered) * 100:.1f}%",
+                        f"{len(deducibles) / max(len(df_filtered), 1) * 100:.1f}%",
                     )
 
             # Mostrar datos filtrados
             st.subheader("📋 Datos Detallados")
-            st.dataframe(df_filtered, use_container_width=True, height=300)
+            st.dataframe(
+                df_filtered,
+                use_container_width=True,
+                height=300,
+                column_config=config_columnas(),
+            )
 
             # Exportación personalizada - Simplificada en botones tradicionales
 
             # Botones de descarga tradicionales
             st.subheader("📥 Descargas Tradicionales")
-            col1, col2 = st.columns(2)
+            col1, col2, col3 = st.columns(3)
 
             with col1:
-                excel_data = create_enhanced_excel(
-                    df_filtered, "Recibidos", "Recibidos"
+                # El Excel se construye sólo al pedirlo y se reutiliza
+                # mientras los datos filtrados no cambien
+                lazy_download(
+                    "excel_recibidos",
+                    fingerprint_df(df_filtered),
+                    lambda: build_excel_file(
+                        df_filtered, "CFDIs_Recibidos_Completo.xlsx", "Recibidos"
+                    ),
+                    prepare_label="📊 Preparar Excel Completo",
+                    label="📊 Descargar Excel Completo",
+                    file_name="CFDIs_Recibidos_Completo.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 )
-                if excel_data:
-                    st.download_button(
-                        label="📊 Descargar Excel Completo",
-                        data=excel_data,
-                        file_name="CFDIs_Recibidos_Completo.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    )
 
             with col2:
-                if st.session_state.pdfs_recibidos:
-                    merged_pdf = merge_pdfs(st.session_state.pdfs_recibidos)
-                    if merged_pdf:
-                        st.download_button(
-                            label="📄 Descargar PDF Consolidado",
-                            data=merged_pdf,
-                            file_name="CFDIs_Recibidos_Consolidado.pdf",
-                            mime="application/pdf",
-                        )
+                if ensure_pdfs(["recibidos"], "🖨️ Generar PDFs", "gen_pdfs_recibidos"):
+                    # La fusión se memoriza con la huella de los PDFs
+                    pdfs = st.session_state.pdfs_recibidos
+                    job_download(
+                        "pdf_recibidos",
+                        fingerprint_files(pdfs),
+                        "fusion",
+                        "Fusión de CFDIs_Recibidos_Consolidado.pdf",
+                        {
+                            "rutas": [pdf["path"] for pdf in pdfs],
+                            "nombre": "CFDIs_Recibidos_Consolidado.pdf",
+                        },
+                        label="📄 Descargar PDF Consolidado",
+                        file_name="CFDIs_Recibidos_Consolidado.pdf",
+                        mime="application/pdf",
+                    )
+
+            with col3:
+                # Tabla completa con tipos, para recargar el periodo sin XMLs
+                table_downloads(st.session_state.df_recibidos, "CFDIs_Recibidos")
 
     with tab3:
         st.header("📊 Resumen Consolidado")
@@ -1800,190 +2685,178 @@ def main():
             st.session_state.df_emitidos is not None
             or st.session_state.df_recibidos is not None
         ):
-            # Crear DataFrame consolidado
-            df_consolidado = pd.DataFrame()
+            # Tabla consolidada, concatenada sólo cuando cambia alguna categoría
+            df_consolidado = consolidated_table()
 
-            if st.session_state.df_emitidos is not None:
-                df_consolidado = pd.concat(
-                    [df_consolidado, st.session_state.df_emitidos], ignore_index=True
-                )
-
-            if st.session_state.df_recibidos is not None:
-                df_consolidado = pd.concat(
-                    [df_consolidado, st.session_state.df_recibidos], ignore_index=True
+            if not df_consolidado.empty:
+                # Métricas y gráficas desde los cubos de cada categoría
+                cubo = CuboConceptos.combinar(
+                    [
+                        get_cube(tabla)
+                        for tabla in (
+                            st.session_state.df_emitidos,
+                            st.session_state.df_recibidos,
+                        )
+                        if tabla is not None
+                    ]
                 )
+                totales = cubo.totales()
 
-            if not df_consolidado.empty:
                 # Métricas consolidadas
                 col1, col2, col3, col4 = st.columns(4)
 
                 with col1:
-                    st.metric("Total CFDIs", len(df_consolidado["UUID"].unique()))
+                    st.metric("Total CFDIs", consolidated_cfdi_count(df_consolidado))
                 with col2:
-                    st.metric("Total Conceptos", len(df_consolidado))
+                    st.metric("Total Conceptos", int(totales["Conceptos"]))
                 with col3:
-                    total_ingresos = df_consolidado["Ingresos_Subtotal"].sum()
+                    total_ingresos = totales["Ingresos_Subtotal"]
                     st.metric("Total Ingresos", f"${total_ingresos:,.2f}")
                 with col4:
-                    total_egresos = df_consolidado["Egresos_Subtotal"].sum()
+                    total_egresos = totales["Egresos_Subtotal"]
                     st.metric("Total Egresos", f"${total_egresos:,.2f}")
 
                 # Gráfico interactivo mejorado
                 st.subheader("📈 Análisis Temporal Interactivo")
 
-                # Convertir fechas para el gráfico
-                if (
-                    "Fecha" in df_consolidado.columns
-                    and not df_consolidado["Fecha"].isna().all()
-                ):
-                    df_grafico = df_consolidado.copy()
+                # Las celdas sin día (CFDIs sin Fecha) no entran al gráfico
+                if cubo.celdas["Dia"].notna().any():
+                    # Controles para el gráfico
+                    col_graf1, col_graf2 = st.columns(2)
+
+                    with col_graf1:
+                        metrica_grafico = st.selectbox(
+                            "¿Qué quieres visualizar?",
+                            options=[
+                                "Ingresos_Subtotal",
+                                "Egresos_Subtotal",
+                                "Ingresos_IVA",
+                                "Egresos_IVA",
+                                "Total_CFDI",
+                                "Monto_Concepto",
+                            ],
+                            format_func=lambda x: {
+                                "Ingresos_Subtotal": "💰 Ingresos (Subtotal)",
+                                "Egresos_Subtotal": "💸 Egresos (Subtotal)",
+                                "Ingresos_IVA": "📊 IVA Ingresos",
+                                "Egresos_IVA": "📊 IVA Egresos",
+                                "Total_CFDI": "🧾 Total CFDIs",
+                                "Monto_Concepto": "💵 Monto por Concepto",
+                            }.get(x, str(x)),
+                        )
 
-                    # Convertir fecha a datetime
-                    df_grafico["Fecha_dt"] = pd.to_datetime(
-                        df_grafico["Fecha"], format="%d/%m/%Y", errors="coerce"
-                    )
-                    df_grafico = df_grafico.dropna(subset=["Fecha_dt"])
-
-                    if not df_grafico.empty:
-                        # Controles para el gráfico
-                        col_graf1, col_graf2 = st.columns(2)
-
-                        with col_graf1:
-                            metrica_grafico = st.selectbox(
-                                "¿Qué quieres visualizar?",
-                                options=[
-                                    "Ingresos_Subtotal",
-                                    "Egresos_Subtotal",
-                                    "Ingresos_IVA",
-                                    "Egresos_IVA",
-                                    "Total_CFDI",
-                                    "Monto_Concepto",
-                                ],
-                                format_func=lambda x: {
-                                    "Ingresos_Subtotal": "💰 Ingresos (Subtotal)",
-                                    "Egresos_Subtotal": "💸 Egresos (Subtotal)",
-                                    "Ingresos_IVA": "📊 IVA Ingresos",
-                                    "Egresos_IVA": "📊 IVA Egresos",
-                                    "Total_CFDI": "🧾 Total CFDIs",
-                                    "Monto_Concepto": "💵 Monto por Concepto",
-                                }.get(x, str(x)),
-                            )
+                    with col_graf2:
+                        agrupar_por = st.selectbox(
+                            "Agrupar por:",
+                            options=["Día", "Semana", "Mes"],
+                            index=2,  # Por defecto "Mes"
+                        )
 
-                        with col_graf2:
-                            agrupar_por = st.selectbox(
-                                "Agrupar por:",
-                                options=["Día", "Semana", "Mes"],
-                                index=2,  # Por defecto "Mes"
+                    # Agrupar por periodo sumando los días del cubo
+                    frecuencia = {"Día": "D", "Semana": "W", "Mes": "M"}[agrupar_por]
+                    datos_agregados = cubo.serie(metrica_grafico, frecuencia)
+
+                    if not datos_agregados.empty:
+                        try:
+                            import plotly.express as px
+
+                            fig = px.line(
+                                datos_agregados,
+                                x="Periodo",
+                                y=metrica_grafico,
+                                color="Categoria",
+                                title=f"Evolución de {metrica_grafico.replace('_', ' ')} por {agrupar_por}",
+                                markers=True,
                             )
 
-                        # Agrupar datos según selección
-                        if agrupar_por == "Día":
-                            df_grafico["Periodo"] = df_grafico["Fecha_dt"].dt.strftime(
-                                "%Y-%m-%d"
-                            )
-                        elif agrupar_por == "Semana":
-                            df_grafico["Periodo"] = (
-                                df_grafico["Fecha_dt"].dt.to_period("W").astype(str)
+                            # Mejorar el diseño
+                            fig.update_layout(
+                                xaxis_title=f"Periodo ({agrupar_por})",
+                                yaxis_title="Monto ($)",
+                                hovermode="x unified",
                             )
-                        else:  # Mes
-                            df_grafico["Periodo"] = df_grafico["Fecha_dt"].dt.strftime(
-                                "%Y-%m"
+
+                            st.plotly_chart(fig, use_container_width=True)
+
+                            # Gráfico adicional de barras
+                            fig_bar = px.bar(
+                                datos_agregados,
+                                x="Periodo",
+                                y=metrica_grafico,
+                                color="Categoria",
+                                title=f"Comparación por {agrupar_por} - {metrica_grafico.replace('_', ' ')}",
+                                barmode="group",
                             )
 
-                        # Crear datos agregados
-                        datos_agregados = (
-                            df_grafico.groupby(["Periodo", "Categoria"])
-                            .agg({metrica_grafico: "sum"})
-                            .reset_index()
-                        )
+                            st.plotly_chart(fig_bar, use_container_width=True)
 
-                        if not datos_agregados.empty:
-                            try:
-                                import plotly.express as px
-
-                                fig = px.line(
-                                    datos_agregados,
-                                    x="Periodo",
-                                    y=metrica_grafico,
-                                    color="Categoria",
-                                    title=f"Evolución de {metrica_grafico.replace('_', ' ')} por {agrupar_por}",
-                                    markers=True,
-                                )
-
-                                # Mejorar el diseño
-                                fig.update_layout(
-                                    xaxis_title=f"Periodo ({agrupar_por})",
-                                    yaxis_title="Monto ($)",
-                                    hovermode="x unified",
-                                )
-
-                                st.plotly_chart(fig, use_container_width=True)
-
-                                # Gráfico adicional de barras
-                                fig_bar = px.bar(
-                                    datos_agregados,
-                                    x="Periodo",
-                                    y=metrica_grafico,
-                                    color="Categoria",
-                                    title=f"Comparación por {agrupar_por} - {metrica_grafico.replace('_', ' ')}",
-                                    barmode="group",
-                                )
-
-                                st.plotly_chart(fig_bar, use_container_width=True)
-
-                            except ImportError:
-                                st.warning(
-                                    "📊 Para gráficos avanzados, instala plotly: pip install plotly"
-                                )
-                                # Gráfico básico con Streamlit
-                                st.line_chart(
-                                    datos_agregados.set_index("Periodo")[
-                                        metrica_grafico
-                                    ]
-                                )
+                        except ImportError:
+                            st.warning(
+                                "📊 Para gráficos avanzados, instala plotly: pip install plotly"
+                            )
+                            # Gráfico básico con Streamlit
+                            st.line_chart(
+                                datos_agregados.set_index("Periodo")[metrica_grafico]
+                            )
 
                 # Tabla resumen
                 st.subheader("📋 Tabla Resumen")
-                st.dataframe(df_consolidado, use_container_width=True, height=400)
+                st.dataframe(
+                    df_consolidado,
+                    use_container_width=True,
+                    height=400,
+                    column_config=config_columnas(),
+                )
 
                 # Descargas consolidadas
                 st.subheader("💾 Descargas Consolidadas")
                 col1, col2, col3 = st.columns(3)
 
                 with col1:
-                    # Excel consolidado
-                    excel_consolidado = create_enhanced_excel(
-                        df_consolidado, "Consolidado", "Todos"
+                    # Excel consolidado, construido sólo al pedirlo
+                    lazy_download(
+                        "excel_consolidado",
+                        consolidated_fingerprint(),
+                        lambda: build_excel_file(
+                            df_consolidado, "CFDIs_Consolidado_Completo.xlsx", "Todos"
+                        ),
+                        prepare_label="📊 Preparar Excel Consolidado",
+                        label="📊 Excel Consolidado",
+                        file_name="CFDIs_Consolidado_Completo.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                     )
-                    if excel_consolidado:
-                        st.download_button(
-                            label="📊 Excel Consolidado",
-                            data=excel_consolidado,
-                            file_name="CFDIs_Consolidado_Completo.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        )
 
                 with col2:
                     # PDF consolidado de todos
-                    all_pdfs = (
-                        st.session_state.pdfs_emitidos + st.session_state.pdfs_recibidos
-                    )
+                    all_pdfs = []
+                    if ensure_pdfs(
+                        ["emitidos", "recibidos"], "🖨️ Generar PDFs", "gen_pdfs_todos"
+                    ):
+                        all_pdfs = (
+                            st.session_state.pdfs_emitidos
+                            + st.session_state.pdfs_recibidos
+                        )
                     if all_pdfs:
-                        merged_all_pdf = merge_pdfs(all_pdfs)
-                        if merged_all_pdf:
-                            st.download_button(
-                                label="📄 PDF Consolidado Total",
-                                data=merged_all_pdf,
-                                file_name="CFDIs_Todos_Consolidado.pdf",
-                                mime="application/pdf",
-                            )
+                        job_download(
+                            "pdf_todos",
+                            fingerprint_files(all_pdfs),
+                            "fusion",
+                            "Fusión de CFDIs_Todos_Consolidado.pdf",
+                            {
+                                "rutas": [pdf["path"] for pdf in all_pdfs],
+                                "nombre": "CFDIs_Todos_Consolidado.pdf",
+                            },
+                            label="📄 PDF Consolidado Total",
+                            file_name="CFDIs_Todos_Consolidado.pdf",
+                            mime="application/pdf",
+                        )
 
                 with col3:
                     # Mostrar estadísticas adicionales
                     st.info(f"""
                     **Estadísticas:**
-                    - CFDIs Emitidos: {len(st.session_state.pdfs_emitidos)}
-                    - CFDIs Recibidos: {len(st.session_state.pdfs_recibidos)}
+                    - CFDIs Emitidos: {len(st.session_state.xmls_emitidos)}
+                    - CFDIs Recibidos: {len(st.session_state.xmls_recibidos)}
                     - Total PDFs: {len(all_pdfs)}
                     """)
         else:
@@ -1998,6 +2871,10 @@ def main():
 
     with tab4:
         create_diot_interface()
+        st.markdown("---")
+        batch_diot_ui(st.session_state.get("ingesta_workers"))
+
+    performance_panel_ui()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Procesamiento por lotes de CFDIs sin interfaz
+
+Comando no interactivo para cron y servidores. Recibe directorios, ZIPs de
+descarga masiva o XMLs sueltos y escribe la tabla de conceptos en Excel, CSV
+o Parquet usando el mismo motor de extracción que la aplicación web.
+
+Uso:
+    python cfdi_batch.py ./clientes/ACME/recibidas descarga.zip -o recibidos.csv
+    python cfdi_batch.py ./emitidas --categoria Emitidos --workers 8 -f parquet
+    python cfdi_batch.py ./recibidas -o recibidos.xlsx --progreso json
+    python cfdi_batch.py ./recibidas --categoria Recibidos --deducibilidad
+    python cfdi_batch.py ./recibidas -o recibidos.xlsx --perfil rendimiento.jsonl
+
+Los XMLs se procesan en lotes (--lote) para acotar la memoria; CSV y Parquet
+se escriben de forma incremental al terminar cada lote. Excel se escribe al
+final. Con --progreso json cada evento es una línea JSON en stdout. Al
+terminar se reporta el tiempo por etapa (lectura, parseo, extracción, tabla,
+escritura); con --perfil además se agrega a un archivo JSONL.
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from cfdi_excel import escribir_excel
+from cfdi_extractor import (
+    TablaConceptos,
+    procesar_lote,
+    separar_duplicados,
+    workers_por_defecto,
+)
+from cfdi_fuentes import iterar_rutas
+from cfdi_parquet import con_version
+from cfdi_perfil import Perfil, resumen_texto
+
+FORMATOS = ("xlsx", "csv", "parquet")
+FORMATO_FECHA = "%d/%m/%Y"
+
+
+class SalidaTabla:
+    """
+    Escribe la tabla de conceptos por partes
+
+    CSV y Parquet agregan cada parte al archivo en cuanto llega; Excel junta
+    las partes y escribe el archivo al cerrar. Con perfil la escritura se
+    mide como etapa "excel" o "escritura".
+    """
+
+    def __init__(self, ruta, formato, perfil=None):
+        self.ruta = ruta
+        self.formato = formato
+        self.perfil = perfil
+        self.filas = 0
+        self._archivo = None
+        self._escritor = None
+        self._esquema = None
+        self._partes = []
+
+    def agregar(self, df):
+        if df.empty:
+            return
+        self.filas += len(df)
+        if self.formato == "xlsx":
+            self._partes.append(df)
+            return
+        with self._etapa():
+            if self.formato == "csv":
+                self._agregar_csv(df)
+            else:
+                self._agregar_parquet(df)
+
+    def _etapa(self):
+        if self.perfil is None:
+            return contextlib.nullcontext()
+        return self.perfil.etapa("excel" if self.formato == "xlsx" else "escritura")
+
+    def _agregar_csv(self, df):
+        primera = self._archivo is None
+        if primera:
+            # utf-8-sig como la exportación de la app, para abrir en Excel
+            self._archivo = open(self.ruta, "w", encoding="utf-8-sig", newline="")
+        df.to_csv(
+            self._archivo, header=primera, index=False, date_format=FORMATO_FECHA
+        )
+
+    def _agregar_parquet(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        tabla = con_version(pa.Table.from_pandas(df, preserve_index=False))
+        if self._escritor is None:
+            # Índices de diccionario fijos: cada parte tiene sus propias
+            # categorías y el ancho de los índices varía entre partes
+            self._esquema = pa.schema(
+                [
+                    pa.field(campo.name, pa.dictionary(pa.int32(), pa.string()))
+                    if pa.types.is_dictionary(campo.type)
+                    else campo
+                    for campo in tabla.schema
+                ],
+                metadata=tabla.schema.metadata,
+            )
+            self._escritor = pq.ParquetWriter(self.ruta, self._esquema)
+        self._escritor.write_table(tabla.cast(self._esquema))
+
+    def cerrar(self):
+        if self._archivo is not None:
+            self._archivo.close()
+        if self._escritor is not None:
+            self._escritor.close()
+        if self.formato == "xlsx" and self._partes:
+            with self._etapa():
+                df = pd.concat(self._partes, ignore_index=True)
+                self._partes = []
+                escribir_excel({"CFDIs": df}, self.ruta)
+
+
+class Progreso:
+    """Reporta el avance como texto, como líneas JSON o no lo reporta"""
+
+    def __init__(self, modo):
+        self.modo = modo
+
+    def evento(self, tipo, mensaje, **datos):
+        if self.modo == "json":
+            linea = json.dumps({"evento": tipo, **datos}, ensure_ascii=False)
+            print(linea, flush=True)
+        elif self.modo == "texto":
+            print(mensaje, flush=True)
+
+    def error(self, archivo, mensaje):
+        if self.modo == "json":
+            self.evento("error", "", archivo=archivo, error=mensaje)
+        else:
+            # Los errores se reportan también en modo silencioso
+            print(f"Error en {archivo}: {mensaje}", file=sys.stderr, flush=True)
+
+
+def procesar_rutas(
+    rutas,
+    salida,
+    categoria="",
+    workers=None,
+    lote=2000,
+    cache=None,
+    progreso=None,
+    reglas=None,
+    perfil=None,
+):
+    """
+    Procesa todas las rutas por lotes y escribe cada lote en salida
+
+    Los CFDIs con un UUID ya visto en la corrida se omiten y se reportan como
+    eventos "duplicado". Con reglas (un ReglasPorRFC) cada lote se escribe con
+    Deducible ya marcado. Con perfil (cfdi_perfil.Perfil) se miden las
+    etapas de cada lote. Con workers > 1 todos los lotes usan el mismo pool
+    de procesos. Retorna un dict con los totales de archivos,
+    conceptos, errores y duplicados.
+    """
+    progreso = progreso or Progreso("silencioso")
+    perfil = perfil or Perfil()
+    errores_lectura = []
+    documentos = iterar_rutas(rutas, errores_lectura)
+    totales = {
+        "archivos": 0,
+        "conceptos": 0,
+        "errores": 0,
+        "desde_cache": 0,
+        "duplicados": 0,
+    }
+    # UUIDs vistos en toda la corrida: un CFDI repetido en dos descargas
+    # traslapadas sólo se procesa la primera vez
+    vistos = {}
+    inicio = time.perf_counter()
+
+    # Un solo pool para toda la corrida: crear procesos por lote cuesta más
+    # que parsear un lote pequeño
+    workers = workers or workers_por_defecto()
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        while True:
+            with perfil.etapa("lectura"):
+                bloque = list(itertools.islice(documentos, lote))
+
+            for ruta, mensaje in errores_lectura:
+                totales["errores"] += 1
+                progreso.error(ruta, mensaje)
+            errores_lectura.clear()
+
+            if not bloque:
+                break
+
+            bloque, duplicados = separar_duplicados(bloque, vistos)
+            for archivo, uuid, original in duplicados:
+                totales["duplicados"] += 1
+                progreso.evento(
+                    "duplicado",
+                    f"Duplicado omitido: {archivo} (UUID {uuid}, ya en {original})",
+                    archivo=archivo,
+                    uuid=uuid,
+                    original=original,
+                )
+
+            tabla = TablaConceptos()
+            resultados = procesar_lote(
+                bloque,
+                categoria,
+                workers=workers,
+                cache=cache,
+                pool=pool,
+                perfil=perfil,
+            )
+            for resultado in resultados:
+                totales["archivos"] += 1
+                if resultado.error:
+                    totales["errores"] += 1
+                    progreso.error(resultado.archivo, resultado.error)
+                    continue
+                tabla.agregar(resultado.filas)
+                totales["desde_cache"] += resultado.desde_cache
+
+            totales["conceptos"] += len(tabla)
+            if len(tabla):
+                with perfil.etapa("tabla"):
+                    df = tabla.construir()
+                    if reglas is not None:
+                        df = reglas.etiquetar(df)
+                salida.agregar(df)
+
+            progreso.evento(
+                "lote",
+                f"{totales['archivos']} XMLs procesados, {totales['conceptos']} "
+                f"conceptos, {totales['errores']} errores, "
+                f"{totales['duplicados']} duplicados",
+                **totales,
+            )
+
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    salida.cerrar()
+    totales["segundos"] = round(time.perf_counter() - inicio, 3)
+    return totales
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "entradas", nargs="+", help="Directorios, archivos ZIP o XMLs a procesar"
+    )
+    parser.add_argument(
+        "-o", "--salida", help="Archivo de salida (por defecto cfdis.<formato>)"
+    )
+    parser.add_argument(
+        "-f",
+        "--formato",
+        choices=FORMATOS,
+        help="Formato de salida; si se omite se deduce de la extensión de --salida",
+    )
+    parser.add_argument(
+        "--categoria", default="", help="Valor de la columna Categoria"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=workers_por_defecto(),
+        help="Procesos paralelos (por defecto CFDI_WORKERS o núcleos)",
+    )
+    parser.add_argument(
+        "--lote", type=int, default=2000, help="XMLs por lote (acota la memoria)"
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Usar la caché de XMLs en disco (CFDI_CACHE_DIR)",
+    )
+    parser.add_argument(
+        "--deducibilidad",
+        action="store_true",
+        help="Marcar Deducible con las reglas guardadas por RFC (CFDI_STORE_DIR)",
+    )
+    parser.add_argument(
+        "--perfil",
+        metavar="RUTA",
+        help="Agregar el tiempo y la memoria por etapa a un archivo JSONL",
+    )
+    grupo = parser.add_mutually_exclusive_group()
+    grupo.add_argument(
+        "-q", "--quiet", action="store_true", help="Sólo reportar errores"
+    )
+    grupo.add_argument(
+        "--progreso",
+        choices=["texto", "json"],
+        default="texto",
+        help="Formato de los mensajes de avance",
+    )
+    args = parser.parse_args(argv)
+
+    formato = args.formato
+    if formato is None and args.salida:
+        formato = os.path.splitext(args.salida)[1].lstrip(".").lower()
+        if formato not in FORMATOS:
+            parser.error(f"No se reconoce el formato de {args.salida}; usa --formato")
+    formato = formato or "xlsx"
+    ruta_salida = args.salida or f"cfdis.{formato}"
+
+    if formato == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("El formato parquet requiere pyarrow: pip install pyarrow")
+
+    for entrada in args.entradas:
+        if not os.path.exists(entrada):
+            parser.error(f"No existe la entrada: {entrada}")
+
+    cache = None
+    if args.cache:
+        from cfdi_cache import cache_por_defecto
+
+        cache = cache_por_defecto()
+
+    reglas = None
+    if args.deducibilidad:
+        from cfdi_deducibilidad import reglas_por_defecto
+
+        reglas = reglas_por_defecto()
+
+    progreso = Progreso("silencioso" if args.quiet else args.progreso)
+    progreso.evento(
+        "inicio",
+        f"Procesando {len(args.entradas)} entradas con {args.workers} procesos",
+        entradas=args.entradas,
+        workers=args.workers,
+        salida=ruta_salida,
+        formato=formato,
+    )
+
+    perfil = Perfil(ruta_salida)
+    totales = procesar_rutas(
+        args.entradas,
+        SalidaTabla(ruta_salida, formato, perfil),
+        categoria=args.categoria,
+        workers=max(1, args.workers),
+        lote=max(1, args.lote),
+        cache=cache,
+        progreso=progreso,
+        reglas=reglas,
+        perfil=perfil,
+    )
+
+    rendimiento = perfil.a_dict()
+    progreso.evento("rendimiento", resumen_texto(rendimiento), **rendimiento)
+    if args.perfil:
+        perfil.escribir_jsonl(args.perfil, entradas=args.entradas, formato=formato)
+
+    if totales["conceptos"]:
+        mensaje = f"Archivo creado: {ruta_salida} ({totales['segundos']} s)"
+    else:
+        mensaje = "No se extrajeron conceptos; no se creó archivo de salida"
+    progreso.evento("fin", mensaje, salida=ruta_salida, **totales)
+
+    # Código 1 si hubo archivos con error o no se extrajo nada, para cron
+    return 1 if totales["errores"] or not totales["conceptos"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
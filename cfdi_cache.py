@@ -0,0 +1,218 @@
+"""
+Caché persistente de CFDIs direccionada por contenido
+
+Cada XML se identifica por el SHA-256 de sus bytes. Para cada hash se guardan
+las filas de conceptos ya extraídas y, opcionalmente, el PDF generado, en un
+archivo SQLite. Volver a subir los XMLs del mes pasado sólo parsea los nuevos.
+
+- Desalojo LRU por tamaño: al superar max_bytes se borran las entradas
+  usadas hace más tiempo.
+- Sello de versión: las entradas de otra versión de extracción se descartan.
+"""
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from cfdi_extractor import COLUMNAS, VERSION_EXTRACCION
+
+# Cambia cuando cambia la lógica de extracción o el orden de columnas
+VERSION_CACHE = f"{VERSION_EXTRACCION}:{'|'.join(COLUMNAS)}"
+
+_IDX_ARCHIVO = COLUMNAS.index("Archivo_XML")
+_IDX_CATEGORIA = COLUMNAS.index("Categoria")
+
+
+def hash_xml(xml_content):
+    """SHA-256 hexadecimal de los bytes del XML"""
+    if isinstance(xml_content, str):
+        xml_content = xml_content.encode("utf-8")
+    return hashlib.sha256(xml_content).hexdigest()
+
+
+def reetiquetar(filas, archivo, categoria):
+    """Las filas en caché no dependen del nombre de archivo ni de la categoría"""
+    resultado = []
+    for fila in filas:
+        fila = list(fila)
+        fila[_IDX_ARCHIVO] = archivo
+        fila[_IDX_CATEGORIA] = categoria
+        resultado.append(tuple(fila))
+    return resultado
+
+
+class CacheCFDI:
+    """Caché en disco de filas extraídas (y PDFs) indexada por hash del XML"""
+
+    def __init__(self, ruta, max_bytes=512 * 2**20, version=VERSION_CACHE):
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        self.version = version
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entradas (
+                    hash TEXT PRIMARY KEY,
+                    version TEXT NOT NULL,
+                    filas BLOB,
+                    pdf BLOB,
+                    tamano INTEGER NOT NULL,
+                    acceso REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_entradas_acceso ON entradas (acceso)"
+            )
+            # Invalidar entradas generadas con otra lógica de extracción
+            self._conn.execute("DELETE FROM entradas WHERE version != ?", (version,))
+            self._total = self._conn.execute(
+                "SELECT COALESCE(SUM(tamano), 0) FROM entradas"
+            ).fetchone()[0]
+
+    def obtener_filas(self, hashes):
+        """
+        Busca varios hashes a la vez
+
+        Retorna {hash: filas} sólo con los aciertos. Las filas conservan el
+        archivo y la categoría con que se guardaron; usar reetiquetar().
+        """
+        encontrados = {}
+        hashes = list(dict.fromkeys(hashes))
+        ahora = time.time()
+        with self._lock, self._conn:
+            for inicio in range(0, len(hashes), 500):
+                bloque = hashes[inicio : inicio + 500]
+                marcas = ",".join("?" * len(bloque))
+                cursor = self._conn.execute(
+                    f"SELECT hash, filas FROM entradas "
+                    f"WHERE filas IS NOT NULL AND hash IN ({marcas})",
+                    bloque,
+                )
+                for hash_, filas in cursor:
+                    encontrados[hash_] = pickle.loads(filas)
+                self._conn.executemany(
+                    "UPDATE entradas SET acceso = ? WHERE hash = ?",
+                    [(ahora, h) for h in bloque if h in encontrados],
+                )
+        return encontrados
+
+    def guardar_filas(self, hash_, filas):
+        """Guarda las filas extraídas de un XML"""
+        blob = pickle.dumps(list(filas), protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO entradas (hash, version, filas, pdf, tamano, acceso)
+                VALUES (?, ?, ?, NULL, ?, ?)
+                ON CONFLICT(hash) DO UPDATE SET
+                    filas = excluded.filas,
+                    tamano = excluded.tamano + COALESCE(length(entradas.pdf), 0),
+                    acceso = excluded.acceso
+                """,
+                (hash_, self.version, blob, len(blob), time.time()),
+            )
+            self._total += len(blob)
+        self._desalojar()
+
+    def obtener_pdf(self, hash_):
+        """Bytes del PDF en caché o None"""
+        with self._lock, self._conn:
+            fila = self._conn.execute(
+                "SELECT pdf FROM entradas WHERE hash = ? AND pdf IS NOT NULL",
+                (hash_,),
+            ).fetchone()
+            if fila is None:
+                return None
+            self._conn.execute(
+                "UPDATE entradas SET acceso = ? WHERE hash = ?", (time.time(), hash_)
+            )
+        return fila[0]
+
+    def guardar_pdf(self, hash_, pdf):
+        """Guarda el PDF generado de un XML"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO entradas (hash, version, filas, pdf, tamano, acceso)
+                VALUES (?, ?, NULL, ?, ?, ?)
+                ON CONFLICT(hash) DO UPDATE SET
+                    pdf = excluded.pdf,
+                    tamano = excluded.tamano + COALESCE(length(entradas.filas), 0),
+                    acceso = excluded.acceso
+                """,
+                (hash_, self.version, pdf, len(pdf), time.time()),
+            )
+            self._total += len(pdf)
+        self._desalojar()
+
+    def tamano_total(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(SUM(tamano), 0) FROM entradas"
+            ).fetchone()[0]
+
+    def _desalojar(self):
+        """Borra las entradas menos usadas hasta quedar bajo max_bytes"""
+        # _total es una estimación barata; sólo se recalcula al superar el límite
+        if self._total <= self.max_bytes:
+            return
+        with self._lock, self._conn:
+            total = self._conn.execute(
+                "SELECT COALESCE(SUM(tamano), 0) FROM entradas"
+            ).fetchone()[0]
+            self._total = total
+            if total <= self.max_bytes:
+                return
+            # Liberar hasta 90% del límite para no desalojar en cada inserción
+            objetivo = total - int(self.max_bytes * 0.9)
+            liberado = 0
+            borrar = []
+            for hash_, tamano in self._conn.execute(
+                "SELECT hash, tamano FROM entradas ORDER BY acceso"
+            ):
+                borrar.append((hash_,))
+                liberado += tamano
+                if liberado >= objetivo:
+                    break
+            self._conn.executemany("DELETE FROM entradas WHERE hash = ?", borrar)
+            self._total = total - liberado
+
+    def limpiar(self):
+        """Vacía la caché"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entradas")
+            self._total = 0
+
+
+_cache_global = None
+_cache_lock = threading.Lock()
+
+
+def cache_por_defecto():
+    """
+    Caché compartida del proceso
+
+    Se guarda en CFDI_CACHE_DIR (por defecto ./output/cache, el volumen
+    montado en docker-compose) con un límite de CFDI_CACHE_MAX_MB megabytes.
+    """
+    global _cache_global
+    with _cache_lock:
+        if _cache_global is None:
+            directorio = os.environ.get(
+                "CFDI_CACHE_DIR", os.path.join("output", "cache")
+            )
+            max_mb = int(os.environ.get("CFDI_CACHE_MAX_MB", "512"))
+            _cache_global = CacheCFDI(
+                os.path.join(directorio, "cfdi_cache.sqlite"),
+                max_bytes=max_mb * 2**20,
+            )
+    return _cache_global
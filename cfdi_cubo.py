@@ -0,0 +1,141 @@
+"""
+Cubo pre-agregado de la tabla de conceptos
+
+Una celda por (Dia, Emisor_RFC, Receptor_RFC, Categoria, Tipo_Comprobante,
+Deducible) con la suma de los montos, el número de conceptos y el número de
+CFDIs. La calculadora y las gráficas por día, semana o mes se contestan
+sumando celdas, así que su costo depende del tamaño del cubo y no del número
+de conceptos.
+
+- El cubo se mantiene incremental: agregar() suma las celdas de un lote
+  nuevo a las existentes sin volver a recorrer los conceptos anteriores.
+  Regresa un cubo nuevo: los cubos se comparten entre sesiones
+  (cfdi_memoria) y nunca se modifican en sitio.
+- Cada CFDI se cuenta en la celda de su primer concepto, así que sumar
+  CFDIs entre celdas da los UUIDs distintos (por categoría) sin guardar
+  los UUIDs.
+- Las sumas de SubTotal_CFDI y Total_CFDI son por concepto, igual que
+  sumar esas columnas sobre la tabla.
+"""
+import pandas as pd
+
+CLAVES_CUBO = [
+    "Dia",
+    "Emisor_RFC",
+    "Receptor_RFC",
+    "Categoria",
+    "Tipo_Comprobante",
+    "Deducible",
+]
+MEDIDAS_CUBO = [
+    "SubTotal_CFDI",
+    "Total_CFDI",
+    "Monto_Concepto",
+    "Ingresos_Subtotal",
+    "Ingresos_IVA",
+    "Egresos_Subtotal",
+    "Egresos_IVA",
+    "Conceptos",
+    "CFDIs",
+]
+_CATEGORICAS = ["Emisor_RFC", "Receptor_RFC", "Categoria", "Tipo_Comprobante"]
+_NOMBRES = {"Emisor_RFC": "Emisor_Nombre", "Receptor_RFC": "Receptor_Nombre"}
+
+
+def _sumar_celdas(celdas):
+    """Agrupa celdas con la misma clave (tras concatenar cubos o conceptos)"""
+    celdas = celdas.groupby(CLAVES_CUBO, observed=True, dropna=False, sort=False)[
+        MEDIDAS_CUBO
+    ].sum()
+    celdas = celdas.reset_index()
+    return celdas.astype({columna: "category" for columna in _CATEGORICAS})
+
+
+def _etiquetas(df, columna):
+    """Etiquetas "RFC - Nombre" distintas de una columna de RFC"""
+    pares = df[[columna, _NOMBRES[columna]]].dropna().drop_duplicates()
+    return {f"{rfc} - {nombre}" for rfc, nombre in pares.itertuples(index=False)}
+
+
+class CuboConceptos:
+    """Sumas por día, RFCs, categoría, tipo y deducibilidad"""
+
+    def __init__(self, df=None):
+        self.celdas = pd.DataFrame(columns=CLAVES_CUBO + MEDIDAS_CUBO)
+        self.etiquetas = {columna: set() for columna in _NOMBRES}
+        if df is not None and not df.empty:
+            primero = ~df.duplicated(["UUID", "Categoria"]).to_numpy()
+            datos = df[CLAVES_CUBO[1:] + MEDIDAS_CUBO[:-2]].assign(
+                Dia=df["Fecha"].dt.floor("D"), Conceptos=1, CFDIs=primero.astype(int)
+            )
+            self.celdas = _sumar_celdas(datos[CLAVES_CUBO + MEDIDAS_CUBO])
+            for columna in _NOMBRES:
+                self.etiquetas[columna] = _etiquetas(df, columna)
+
+    def agregar(self, df):
+        """
+        Cubo nuevo con los conceptos de df (un lote nuevo de la tabla) sumados
+
+        self no cambia: puede estar compartido con otras sesiones.
+        """
+        if df is None or df.empty:
+            return self
+        return CuboConceptos.combinar([self, CuboConceptos(df)])
+
+    @classmethod
+    def combinar(cls, cubos):
+        """Cubo con las celdas de varios cubos (por ejemplo emitidos y recibidos)"""
+        combinado = cls()
+        cubos = [cubo for cubo in cubos if cubo is not None and len(cubo.celdas)]
+        if cubos:
+            celdas = pd.concat([cubo.celdas for cubo in cubos], ignore_index=True)
+            combinado.celdas = _sumar_celdas(celdas)
+            for cubo in cubos:
+                for columna in _NOMBRES:
+                    combinado.etiquetas[columna] |= cubo.etiquetas[columna]
+        return combinado
+
+    def filtrar(
+        self, emisores=(), receptores=(), desde=None, hasta=None, deducible=None
+    ):
+        """
+        Celdas que cumplen los filtros
+
+        desde y hasta son fechas inclusivas; con cualquiera de las dos se
+        descartan las celdas sin Dia. deducible es True, False o None (todos).
+        """
+        celdas = self.celdas
+        mascara = pd.Series(True, index=celdas.index)
+        if emisores:
+            mascara &= celdas["Emisor_RFC"].isin(emisores)
+        if receptores:
+            mascara &= celdas["Receptor_RFC"].isin(receptores)
+        if desde is not None:
+            mascara &= celdas["Dia"] >= pd.Timestamp(desde).normalize()
+        if hasta is not None:
+            mascara &= celdas["Dia"] <= pd.Timestamp(hasta).normalize()
+        if deducible is not None:
+            mascara &= celdas["Deducible"] == deducible
+        return celdas[mascara]
+
+    def totales(self, **filtros):
+        """Serie con la suma de cada medida de las celdas filtradas"""
+        celdas = self.filtrar(**filtros)
+        return celdas[MEDIDAS_CUBO].sum().reindex(MEDIDAS_CUBO, fill_value=0)
+
+    def serie(self, medida, frecuencia="M", por="Categoria", **filtros):
+        """
+        medida por periodo ("D", "W" o "M") y por la columna por
+
+        Retorna un DataFrame con Periodo (texto), por y medida; las celdas
+        sin Dia se omiten.
+        """
+        celdas = self.filtrar(**filtros).dropna(subset=["Dia"])
+        # Primero por día: el periodo se calcula sobre días distintos, no celdas
+        diario = celdas.groupby(["Dia", por], observed=True)[medida].sum()
+        diario = diario.reset_index()
+        periodo = diario["Dia"].dt.to_period(frecuencia).rename("Periodo")
+        serie = diario.groupby([periodo, por], observed=True)[medida].sum()
+        serie = serie.reset_index()
+        serie["Periodo"] = serie["Periodo"].astype(str)
+        return serie
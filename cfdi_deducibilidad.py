@@ -0,0 +1,177 @@
+"""
+Reglas de deducibilidad por RFC
+
+Cada contribuyente (el emisor en los CFDIs emitidos, el receptor en los
+recibidos) tiene un conjunto de reglas que se guarda en un archivo JSON junto
+al almacén local, así que sobrevive a la sesión y se aplica al ingerir:
+
+- claves: Clave_ProdServ deducibles exactas.
+- prefijos: familias del catálogo del SAT (división de 2 dígitos, grupo de 4
+  o clase de 6), por ejemplo "8013" para los servicios inmobiliarios.
+- emisores: excepciones por proveedor ({RFC: True o False}), que ganan sobre
+  las claves y los prefijos.
+
+Las reglas se compilan a una tabla booleana indexada por los códigos de la
+categórica Clave_ProdServ: etiquetar es una búsqueda por fila, sin isin ni
+copia de la tabla (sólo se reemplaza la columna Deducible).
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+ARCHIVO_REGLAS = "cfdi_deducibilidad.json"
+
+
+def columna_contribuyente(categoria):
+    """Columna con el RFC del contribuyente para una categoría de CFDIs"""
+    return "Emisor_RFC" if str(categoria).lower() == "emitidos" else "Receptor_RFC"
+
+
+def _codigos(serie):
+    """(códigos, categorías como texto) de una columna categórica o de texto"""
+    if not isinstance(serie.dtype, pd.CategoricalDtype):
+        serie = serie.astype("category")
+    return serie.cat.codes.to_numpy(), serie.cat.categories.astype(str)
+
+
+class ReglasDeducibilidad:
+    """Claves, prefijos de familia y excepciones por emisor de un contribuyente"""
+
+    def __init__(self, claves=(), prefijos=(), emisores=None):
+        self.claves = set(claves)
+        self.prefijos = tuple(sorted({p.strip() for p in prefijos if p.strip()}))
+        self.emisores = dict(emisores or {})
+
+    def __bool__(self):
+        return bool(self.claves or self.prefijos or self.emisores)
+
+    def a_dict(self):
+        return {
+            "claves": sorted(self.claves),
+            "prefijos": list(self.prefijos),
+            "emisores": dict(sorted(self.emisores.items())),
+        }
+
+    @classmethod
+    def desde_dict(cls, datos):
+        return cls(
+            datos.get("claves", ()), datos.get("prefijos", ()), datos.get("emisores")
+        )
+
+    def es_deducible(self, clave, emisor=None):
+        """Deducibilidad de un solo concepto (la referencia de compilar)"""
+        if emisor in self.emisores:
+            return self.emisores[emisor]
+        return clave in self.claves or str(clave).startswith(self.prefijos)
+
+    def compilar(self, categorias):
+        """
+        Tabla booleana por código de Clave_ProdServ
+
+        Tiene una posición extra al final, siempre False, para el código -1
+        de las claves faltantes.
+        """
+        tabla = np.zeros(len(categorias) + 1, dtype=bool)
+        for codigo, clave in enumerate(categorias):
+            tabla[codigo] = clave in self.claves or clave.startswith(self.prefijos)
+        return tabla
+
+    def compilar_emisores(self, categorias):
+        """Por código de Emisor_RFC: 1 deducible, 0 no deducible, -1 sin excepción"""
+        tabla = np.full(len(categorias) + 1, -1, dtype=np.int8)
+        if self.emisores:
+            posiciones = {rfc: codigo for codigo, rfc in enumerate(categorias)}
+            for rfc, deducible in self.emisores.items():
+                if rfc in posiciones:
+                    tabla[posiciones[rfc]] = int(bool(deducible))
+        return tabla
+
+
+def etiquetar(df, reglas_por_rfc):
+    """
+    Tabla con Deducible calculado por las reglas de cada contribuyente
+
+    reglas_por_rfc es {RFC: ReglasDeducibilidad}. Las filas de contribuyentes
+    sin entrada conservan su Deducible; con reglas vacías (el usuario quitó
+    todas) quedan como no deducibles. Regresa un DataFrame nuevo que comparte
+    todas las columnas con df salvo Deducible.
+    """
+    if df is None or df.empty or not reglas_por_rfc:
+        return df
+
+    claves, categorias_clave = _codigos(df["Clave_ProdServ"])
+    emisores, categorias_emisor = _codigos(df["Emisor_RFC"])
+    receptores, categorias_receptor = _codigos(df["Receptor_RFC"])
+    emitido = (df["Categoria"].astype(str) == "Emitidos").to_numpy(dtype=bool)
+    posicion_emisor = {rfc: codigo for codigo, rfc in enumerate(categorias_emisor)}
+    posicion_receptor = {rfc: codigo for codigo, rfc in enumerate(categorias_receptor)}
+
+    deducible = df["Deducible"].to_numpy(dtype=bool, copy=True)
+    for rfc, reglas in reglas_por_rfc.items():
+        propias = np.zeros(len(df), dtype=bool)
+        if rfc in posicion_emisor:
+            propias |= emitido & (emisores == posicion_emisor[rfc])
+        if rfc in posicion_receptor:
+            propias |= ~emitido & (receptores == posicion_receptor[rfc])
+        if not propias.any():
+            continue
+        por_clave = reglas.compilar(categorias_clave)[claves[propias]]
+        excepcion = reglas.compilar_emisores(categorias_emisor)[emisores[propias]]
+        deducible[propias] = np.where(excepcion >= 0, excepcion == 1, por_clave)
+    return df.assign(Deducible=deducible)
+
+
+class ReglasPorRFC:
+    """Conjuntos de reglas por RFC guardados en un archivo JSON"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.reglas = {}
+        if os.path.exists(ruta):
+            with open(ruta, encoding="utf-8") as archivo:
+                datos = json.load(archivo)
+            self.reglas = {
+                rfc: ReglasDeducibilidad.desde_dict(reglas)
+                for rfc, reglas in datos.items()
+            }
+
+    def obtener(self, rfc):
+        """Reglas del RFC (vacías si no tiene)"""
+        return self.reglas.get(rfc, ReglasDeducibilidad())
+
+    def guardar(self, rfc, reglas):
+        """Reemplaza las reglas del RFC y escribe el archivo"""
+        if reglas:
+            self.reglas[rfc] = reglas
+        else:
+            self.reglas.pop(rfc, None)
+        directorio = os.path.dirname(self.ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        # Se escribe a un temporal y se reemplaza, para no dejar un JSON a medias
+        temporal = f"{self.ruta}.tmp"
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            json.dump(
+                {rfc: r.a_dict() for rfc, r in sorted(self.reglas.items())},
+                archivo,
+                ensure_ascii=False,
+                indent=2,
+            )
+        os.replace(temporal, self.ruta)
+
+    def etiquetar(self, df):
+        """etiquetar(df) con todas las reglas guardadas"""
+        return etiquetar(df, self.reglas)
+
+
+def reglas_por_defecto():
+    """
+    Reglas guardadas del proceso
+
+    Se leen de CFDI_STORE_DIR (por defecto ./output, junto al almacén) como
+    cfdi_deducibilidad.json.
+    """
+    directorio = os.environ.get("CFDI_STORE_DIR", "output")
+    return ReglasPorRFC(os.path.join(directorio, ARCHIVO_REGLAS))
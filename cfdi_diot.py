@@ -0,0 +1,512 @@
+"""
+Agregación de proveedores para la DIOT a partir de la tabla de conceptos
+
+Calcula en un solo groupby, sin recorrer filas, los montos de la DIOT por
+proveedor, tipo de tercero y tipo de operación. No depende de Streamlit ni
+de satcfdi: los tipos se regresan como nombres de los enums TipoTercero y
+TipoOperacion, y la app los convierte.
+
+Los montos se asignan desde el punto de vista del receptor:
+
+- Compras (CFDI de ingreso del proveedor): el subtotal del concepto va a
+  iva16 si su IVA trasladado equivale a ~16%, a iva_rfn (región fronteriza,
+  8%) si es menor y a iva0 si no trasladó IVA. La tabla no distingue tasa 0
+  de exento, así que iva_exento queda en 0.
+- retenido: IVA retenido en las compras.
+- devoluciones: IVA de los CFDIs de egreso (notas de crédito) del proveedor.
+- iva_sin_clasificar: IVA trasladado en compras con base 0, que no cabe en
+  ninguna tasa. No va al TXT; se reporta para que se revise.
+
+Los proveedores extranjeros (RFC genérico XEXX010101000) se declaran sin RFC
+y con su identificación (id fiscal, nombre, país, nacionalidad), que el CFDI
+no trae y se captura en la interfaz.
+
+generar_diots produce en lote una DIOT por RFC receptor y periodo, en un
+pool de procesos, y las empaqueta en un ZIP.
+"""
+import io
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from operator import attrgetter
+
+import numpy as np
+import pandas as pd
+
+# RFCs genéricos del SAT
+RFC_EXTRANJERO = "XEXX010101000"
+RFC_PUBLICO_GENERAL = "XAXX010101000"
+
+# ClaveProdServ 8013xxxx: servicios de bienes raíces (arrendamiento)
+PREFIJO_ARRENDAMIENTO = "8013"
+
+# Una tasa efectiva mayor a esta se considera 16%; entre 0 y esta, 8%
+_UMBRAL_TASA_16 = 0.12
+
+MONTOS_DIOT = [
+    "iva16",
+    "iva16_na",
+    "iva_rfn",
+    "iva_rfn_na",
+    "iva_import16",
+    "iva_import16_na",
+    "iva_import_exento",
+    "iva0",
+    "iva_exento",
+    "retenido",
+    "devoluciones",
+]
+COLUMNAS_DIOT = ["tipo_tercero", "tipo_operacion", "rfc", "nombre"] + MONTOS_DIOT
+COLUMNAS_DIOT += ["iva_sin_clasificar", "num_cfdis"]
+
+ETIQUETAS_TERCERO = {
+    "PROVEEDOR_NACIONAL": "Proveedor Nacional",
+    "PROVEEDOR_EXTRANJERO": "Proveedor Extranjero",
+    "PROVEEDOR_GLOBAL": "Proveedor Global",
+}
+ETIQUETAS_OPERACION = {
+    "OTROS": "Otros",
+    "ARRENDAMIENTO_DE_INMUEBLES": "Arrendamiento de Inmuebles",
+    "PRESTACION_DE_SERVICIOS_PROFESIONALES": "Prestación de Servicios Profesionales",
+}
+
+
+def filtrar_periodo(df, rfc=None, periodo=None):
+    """
+    Conceptos recibidos por rfc dentro del periodo
+
+    periodo es un texto que entiende pandas.Period: "2025-03" para un mes o
+    "2025-Q1" para un trimestre. Se filtra sobre Fecha, no sobre el texto de
+    Mes.
+    """
+    mascara = np.ones(len(df), dtype=bool)
+    if rfc:
+        mascara &= (df["Receptor_RFC"] == rfc).to_numpy(dtype=bool)
+    if periodo:
+        rango = pd.Period(periodo)
+        fechas = df["Fecha"]
+        dentro = (fechas >= rango.start_time) & (fechas <= rango.end_time)
+        mascara &= dentro.to_numpy(dtype=bool)
+    return df[mascara]
+
+
+def agregar_proveedores(df, rfc=None, periodo=None, por=()):
+    """
+    Tabla DIOT con una fila por proveedor, tipo de tercero y tipo de operación
+
+    Retorna un DataFrame con COLUMNAS_DIOT, ordenado por RFC. Se omiten los
+    proveedores sin montos. num_cfdis cuenta los UUIDs distintos agregados e
+    iva_sin_clasificar suma el IVA de compras sin base gravable.
+    por son columnas de df que se agregan antes del proveedor (por ejemplo
+    Receptor_RFC y Periodo), para obtener muchas DIOTs en un solo groupby.
+    """
+    columnas = list(por) + COLUMNAS_DIOT
+    if df is None or df.empty:
+        return pd.DataFrame(columns=columnas)
+    datos = filtrar_periodo(df, rfc, periodo)
+    if datos.empty:
+        return pd.DataFrame(columns=columnas)
+
+    # Sobre categóricas, .str trabaja con las categorías, no fila por fila
+    tipo = datos["Tipo_Comprobante"].astype("category")
+    es_ingreso = tipo.str.startswith("I").to_numpy(dtype=bool, na_value=False)
+    es_egreso = tipo.str.startswith("E").to_numpy(dtype=bool, na_value=False)
+
+    base = datos["Ingresos_Subtotal"].to_numpy(dtype="float64")
+    iva = datos["Ingresos_IVA"].to_numpy(dtype="float64")
+    tasa = np.divide(iva, base, out=np.zeros_like(iva), where=base != 0)
+    al_16 = es_ingreso & (tasa > _UMBRAL_TASA_16)
+    al_8 = es_ingreso & (tasa > 0) & ~al_16
+    al_0 = es_ingreso & (iva == 0)
+    # IVA sin base: no se puede saber la tasa ni el monto de la operación
+    sin_base = es_ingreso & (iva != 0) & (base == 0)
+
+    emisor = datos["Emisor_RFC"].astype(str).to_numpy()
+    tipo_tercero = np.select(
+        [emisor == RFC_EXTRANJERO, emisor == RFC_PUBLICO_GENERAL],
+        ["PROVEEDOR_EXTRANJERO", "PROVEEDOR_GLOBAL"],
+        "PROVEEDOR_NACIONAL",
+    )
+    clave = datos["Clave_ProdServ"].astype("category")
+    arrendamiento = clave.str.startswith(PREFIJO_ARRENDAMIENTO).to_numpy(
+        dtype=bool, na_value=False
+    )
+    profesionales = datos["Ingresos_Retencion_ISR"].to_numpy(dtype="float64") > 0
+    tipo_operacion = np.select(
+        [arrendamiento, profesionales],
+        ["ARRENDAMIENTO_DE_INMUEBLES", "PRESTACION_DE_SERVICIOS_PROFESIONALES"],
+        "OTROS",
+    )
+
+    montos = pd.DataFrame(
+        {
+            **{columna: datos[columna].array for columna in por},
+            "tipo_tercero": tipo_tercero,
+            "tipo_operacion": tipo_operacion,
+            "rfc": emisor,
+            "nombre": datos["Emisor_Nombre"].to_numpy(),
+            "iva16": np.where(al_16, base, 0.0),
+            "iva_rfn": np.where(al_8, base, 0.0),
+            "iva0": np.where(al_0, base, 0.0),
+            "iva_sin_clasificar": np.where(sin_base, iva, 0.0),
+            "retenido": datos["Ingresos_Retencion_IVA"].to_numpy(dtype="float64"),
+            "devoluciones": np.where(
+                es_egreso, datos["Egresos_IVA"].to_numpy(dtype="float64"), 0.0
+            ),
+            "uuid": datos["UUID"].to_numpy(),
+        }
+    )
+
+    tabla = (
+        montos.groupby(
+            [*por, "rfc", "tipo_tercero", "tipo_operacion"], sort=True, observed=True
+        )
+        .agg(
+            nombre=("nombre", "first"),
+            iva16=("iva16", "sum"),
+            iva_rfn=("iva_rfn", "sum"),
+            iva0=("iva0", "sum"),
+            iva_sin_clasificar=("iva_sin_clasificar", "sum"),
+            retenido=("retenido", "sum"),
+            devoluciones=("devoluciones", "sum"),
+            num_cfdis=("uuid", "nunique"),
+        )
+        .reset_index()
+    )
+    for columna in MONTOS_DIOT:
+        if columna not in tabla.columns:
+            tabla[columna] = 0.0
+    montos_tabla = MONTOS_DIOT + ["iva_sin_clasificar"]
+    tabla[montos_tabla] = tabla[montos_tabla].round(2)
+
+    con_montos = tabla[montos_tabla].to_numpy().any(axis=1)
+    return tabla.loc[con_montos, columnas].reset_index(drop=True)
+
+
+# Layout del TXT: tipos, 5 campos de identificación, uno vacío y los montos
+CAMPOS_TXT = [
+    "tipo_tercero",
+    "tipo_operacion",
+    "rfc",
+    "id_fiscal",
+    "nombre_extranjero",
+    "pais",
+    "nacionalidad",
+]
+MONTOS_TXT = [
+    "iva16",
+    "iva16_na",
+    "iva0",
+    "iva_exento",
+    "iva_rfn",
+    "retenido",
+    "devoluciones",
+]
+FILAS_POR_BLOQUE = 10000
+
+
+def _atributos(proveedores, campo):
+    """Valores de un campo en todos los proveedores (dicts u objetos)"""
+    if not proveedores:
+        return []
+    if isinstance(proveedores[0], dict):
+        return [proveedor.get(campo) for proveedor in proveedores]
+    # Todos son de la misma clase: basta revisar el primero
+    if not hasattr(proveedores[0], campo):
+        return [None] * len(proveedores)
+    return list(map(attrgetter(campo), proveedores))
+
+
+def identificar_terceros(tabla):
+    """
+    Tabla con el RFC o la identificación de extranjero según el tipo de tercero
+
+    Los proveedores extranjeros van sin RFC (el genérico no los identifica)
+    y con id_fiscal, nombre_extranjero (o nombre), país y nacionalidad; los
+    demás, con RFC y esos campos vacíos. Regresa una tabla nueva.
+    """
+    identificacion = CAMPOS_TXT[3:]
+    tabla = tabla.copy()
+    for campo in identificacion:
+        if campo not in tabla:
+            tabla[campo] = ""
+    tabla[identificacion] = tabla[identificacion].fillna("").astype(str)
+    tipos = tabla["tipo_tercero"].astype(str).to_numpy()
+    extranjero = tipos == "PROVEEDOR_EXTRANJERO"
+    if "nombre" in tabla:
+        sin_nombre = extranjero & (tabla["nombre_extranjero"] == "").to_numpy()
+        tabla.loc[sin_nombre, "nombre_extranjero"] = tabla.loc[sin_nombre, "nombre"]
+    tabla["rfc"] = tabla["rfc"].astype(str)
+    tabla.loc[extranjero, "rfc"] = ""
+    tabla.loc[~extranjero, identificacion] = ""
+    return tabla
+
+
+def tabla_de_proveedores(proveedores):
+    """
+    Tabla columnar (CAMPOS_TXT + MONTOS_DIOT) a partir de proveedores sueltos
+
+    Acepta los dicts de la interfaz DIOT (con tipo_tercero_enum, pais_enum)
+    y objetos ProveedorTercero de satcfdi o de diot_models. Los tipos quedan
+    como nombres de enum. Los extranjeros van sin RFC y con su
+    identificación; los demás, con RFC (identificar_terceros).
+    """
+    proveedores = list(proveedores)
+    sufijo = "_enum" if proveedores and isinstance(proveedores[0], dict) else ""
+    tabla = pd.DataFrame(
+        {
+            campo: [
+                getattr(tipo, "name", tipo)
+                for tipo in _atributos(proveedores, campo + sufijo)
+            ]
+            for campo in ("tipo_tercero", "tipo_operacion")
+        }
+    )
+    tabla["rfc"] = [str(rfc or "") for rfc in _atributos(proveedores, "rfc")]
+    # diot_models guarda el nombre del extranjero en "nombre"
+    nombres = zip(
+        _atributos(proveedores, "nombre_extranjero"),
+        _atributos(proveedores, "nombre"),
+    )
+    tabla["id_fiscal"] = _atributos(proveedores, "id_fiscal")
+    tabla["nombre_extranjero"] = [
+        extranjero or nombre for extranjero, nombre in nombres
+    ]
+    paises = _atributos(proveedores, "pais" + sufijo)
+    tabla["pais"] = [getattr(pais, "value", pais) for pais in paises]
+    tabla["nacionalidad"] = _atributos(proveedores, "nacionalidad")
+    tabla = identificar_terceros(tabla)
+
+    for monto in MONTOS_DIOT:
+        # numpy convierte None en NaN
+        valores = np.array(_atributos(proveedores, monto), dtype="float64")
+        tabla[monto] = np.nan_to_num(valores)
+    return tabla
+
+
+_SEPARADOR = "\x1f"
+_SIN_SEPARADORES = str.maketrans("|\r\n", "   ")
+
+
+def _textos(valores):
+    """
+    Textos sin | ni saltos de línea, que romperían el layout
+
+    Se unen, limpian y vuelven a separar en una sola pasada de str, que es
+    más rápida que las operaciones .str de pandas en tablas chicas y grandes.
+    """
+    if not len(valores):
+        return []
+    unido = _SEPARADOR.join(map(str, valores))
+    return unido.translate(_SIN_SEPARADORES).split(_SEPARADOR)
+
+
+def _montos(serie):
+    """Montos con dos decimales; sólo se formatean los distintos de cero"""
+    valores = serie.to_numpy(dtype="float64")
+    textos = np.full(len(valores), "0.00", dtype=object)
+    distintos = np.flatnonzero(valores.round(2) != 0)
+    textos[distintos] = list(map("{:.2f}".format, valores[distintos]))
+    return textos
+
+
+def escribir_txt_diot(tabla, destino, encabezado=(), tipos=None, montos=MONTOS_TXT):
+    """
+    Escribe la DIOT delimitada por | directamente desde una tabla columnar
+
+    tabla tiene las columnas de CAMPOS_TXT (las que falten se escriben
+    vacías) y los montos. destino es una ruta o un archivo de texto abierto;
+    se escribe por bloques de FILAS_POR_BLOQUE proveedores, así que la
+    memoria no crece con el tamaño de la declaración. encabezado son líneas
+    que se escriben antes. tipos es (TipoTercero, TipoOperacion) para
+    convertir los nombres de enum en claves del SAT. Retorna el número de
+    proveedores escritos.
+    """
+    if isinstance(destino, (str, os.PathLike)):
+        with open(destino, "w", encoding="utf-8", newline="\n") as archivo:
+            return escribir_txt_diot(tabla, archivo, encabezado, tipos, montos)
+
+    for linea in encabezado:
+        destino.write(f"{linea}\n")
+
+    codigos = {}
+    if tipos:
+        codigos = {
+            "tipo_tercero": {tipo.name: tipo.value for tipo in tipos[0]},
+            "tipo_operacion": {tipo.name: tipo.value for tipo in tipos[1]},
+        }
+
+    for inicio in range(0, len(tabla), FILAS_POR_BLOQUE):
+        bloque = tabla.iloc[inicio : inicio + FILAS_POR_BLOQUE]
+        vacio = [""] * len(bloque)
+        columnas = []
+        for campo in CAMPOS_TXT:
+            if campo not in bloque:
+                columnas.append(vacio)
+                continue
+            textos = _textos(bloque[campo].to_numpy(dtype=object, na_value=""))
+            if campo in codigos:
+                textos = [codigos[campo].get(texto, texto) for texto in textos]
+            columnas.append(textos)
+        columnas.append(vacio)
+        columnas.extend(_montos(bloque[monto]) for monto in montos)
+        destino.write("\n".join(map("|".join, zip(*columnas))))
+        destino.write("\n")
+    return len(tabla)
+
+
+# Nombres de Periodo (iguales en satcfdi.diot y diot_models)
+MESES = (
+    "ENERO",
+    "FEBRERO",
+    "MARZO",
+    "ABRIL",
+    "MAYO",
+    "JUNIO",
+    "JULIO",
+    "AGOSTO",
+    "SEPTIEMBRE",
+    "OCTUBRE",
+    "NOVIEMBRE",
+    "DICIEMBRE",
+)
+TRIMESTRES = ("ENERO_MARZO", "ABRIL_JUNIO", "JULIO_SEPTIEMBRE", "OCTUBRE_DICIEMBRE")
+
+COLUMNAS_RESUMEN = ["RFC", "Periodo", "Archivo", "Proveedores", "IVA sin clasificar"]
+
+# Columnas que necesita agregar_proveedores; sólo éstas viajan a los workers
+COLUMNAS_AGREGACION = [
+    "UUID",
+    "Fecha",
+    "Tipo_Comprobante",
+    "Emisor_RFC",
+    "Emisor_Nombre",
+    "Receptor_RFC",
+    "Receptor_Nombre",
+    "Clave_ProdServ",
+    "Ingresos_Subtotal",
+    "Ingresos_IVA",
+    "Ingresos_Retencion_IVA",
+    "Ingresos_Retencion_ISR",
+    "Egresos_IVA",
+]
+
+
+def enums_diot():
+    """Periodo, TipoTercero y TipoOperacion de satcfdi.diot (o de diot_models)"""
+    try:
+        from satcfdi.diot import Periodo, TipoOperacion, TipoTercero
+    except ImportError:
+        from diot_models import Periodo, TipoOperacion, TipoTercero
+    return Periodo, TipoTercero, TipoOperacion
+
+
+def periodo_diot(periodo, enum_periodo):
+    """Miembro de Periodo para un pandas.Period mensual o trimestral"""
+    if periodo.freqstr.startswith("Q"):
+        return enum_periodo[TRIMESTRES[periodo.quarter - 1]]
+    return enum_periodo[MESES[periodo.month - 1]]
+
+
+def particionar(df, frecuencia="M", rfcs=None):
+    """
+    Proveedores de todas las DIOTs, agregados por Receptor_RFC y periodo
+
+    frecuencia es "M" (mensual) o "Q" (trimestral). rfcs limita los
+    receptores. Los conceptos se agregan en un solo groupby y la tabla se
+    divide después, así que el costo no crece con el número de DIOTs.
+    Retorna una lista de (rfc, pandas.Period, razón social, proveedores)
+    ordenada por RFC y periodo; los conceptos sin Fecha se omiten.
+    """
+    datos = df.loc[df["Fecha"].notna(), COLUMNAS_AGREGACION]
+    if rfcs:
+        datos = datos[datos["Receptor_RFC"].isin(rfcs)]
+    if datos.empty:
+        return []
+    datos = datos.assign(Periodo=datos["Fecha"].dt.to_period(frecuencia))
+    claves = ["Receptor_RFC", "Periodo"]
+
+    razones = datos.groupby(claves, observed=True)["Receptor_Nombre"].first()
+    tabla = agregar_proveedores(datos, por=claves)
+
+    # La tabla ya viene ordenada por las claves: cada DIOT es un tramo
+    # contiguo y se corta con iloc, sin copiar filas por grupo
+    grupo = tabla.groupby(claves, sort=True, observed=True).ngroup().to_numpy()
+    inicios = np.flatnonzero(np.diff(grupo, prepend=-1))
+    finales = np.append(inicios[1:], len(tabla))
+    particiones = []
+    for inicio, final in zip(inicios, finales):
+        rfc, periodo = tabla["Receptor_RFC"].iat[inicio], tabla["Periodo"].iat[inicio]
+        razon_social = razones.get((rfc, periodo), "")
+        particiones.append((str(rfc), periodo, razon_social, tabla.iloc[inicio:final]))
+    return particiones
+
+
+def generar_diot(rfc, periodo, razon_social, proveedores):
+    """
+    DIOT TXT de un RFC y periodo a partir de su tabla de proveedores
+
+    Retorna (nombre de archivo, texto, número de proveedores).
+    """
+    enum_periodo, tipo_tercero, tipo_operacion = enums_diot()
+    clave_periodo = periodo_diot(periodo, enum_periodo).value
+
+    salida = io.StringIO()
+    escribir_txt_diot(
+        identificar_terceros(proveedores),
+        salida,
+        encabezado=[
+            f"DIOT|{rfc}|{razon_social}|{periodo.year}|{clave_periodo}",
+            f"# Proveedores: {len(proveedores)}",
+        ],
+        tipos=(tipo_tercero, tipo_operacion),
+    )
+    nombre = f"DIOT_{rfc}_{clave_periodo}_{periodo.year}.txt"
+    return nombre, salida.getvalue(), len(proveedores)
+
+
+def _generar_bloque(tareas):
+    return [generar_diot(*tarea) for tarea in tareas]
+
+
+def _ejecutar_tareas(tareas, workers):
+    """
+    Escribe las DIOTs en serie o en el pool, conservando el orden
+
+    Las tareas viajan en un bloque por worker para no pagar un envío por DIOT.
+    """
+    if workers == 1 or len(tareas) < 2:
+        yield from _generar_bloque(tareas)
+        return
+
+    workers = min(workers, len(tareas))
+    tamano = -(-len(tareas) // workers)
+    bloques = [tareas[i : i + tamano] for i in range(0, len(tareas), tamano)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for resultados in pool.map(_generar_bloque, bloques):
+            yield from resultados
+
+
+def generar_diots(df, destino, frecuencia="M", rfcs=None, workers=None):
+    """
+    Genera una DIOT por Receptor_RFC y periodo y las empaqueta en un ZIP
+
+    Los proveedores se agregan una sola vez y los TXT se escriben en un pool
+    de procesos (con workers=1, en serie). destino es una ruta o un archivo
+    binario. Retorna un DataFrame con RFC, Periodo, Archivo, Proveedores e
+    IVA sin clasificar (que no entró al TXT) de cada DIOT.
+    """
+    from cfdi_extractor import workers_por_defecto
+
+    tareas = particionar(df, frecuencia, rfcs)
+    resultados = _ejecutar_tareas(tareas, workers or workers_por_defecto())
+
+    resumen = []
+    with zipfile.ZipFile(destino, "w", compression=zipfile.ZIP_DEFLATED) as archivo:
+        for (rfc, periodo, _, tabla), (nombre, texto, proveedores) in zip(
+            tareas, resultados
+        ):
+            archivo.writestr(nombre, texto)
+            sin_clasificar = round(float(tabla["iva_sin_clasificar"].sum()), 2)
+            resumen.append((rfc, str(periodo), nombre, proveedores, sin_clasificar))
+    return pd.DataFrame(resumen, columns=COLUMNAS_RESUMEN)
@@ -0,0 +1,177 @@
+"""
+Exportación rápida de la tabla de conceptos a Excel
+
+Con xlsxwriter en modo constant_memory cada fila se escribe y se descarta
+en cuanto se completa, así que la memoria no crece con el número de filas.
+Los anchos de columna se calculan sobre el DataFrame con operaciones
+vectorizadas antes de escribir, en lugar de recorrer cada celda de la hoja
+al final. Sin xlsxwriter se usa openpyxl con los mismos anchos.
+"""
+import numpy as np
+import pandas as pd
+
+try:
+    import xlsxwriter
+
+    XLSXWRITER_AVAILABLE = True
+except ImportError:
+    xlsxwriter = None
+    XLSXWRITER_AVAILABLE = False
+
+ANCHO_MAXIMO = 50
+FILAS_POR_BLOQUE = 10000
+FORMATO_FECHA_EXCEL = "dd/mm/yyyy"
+
+
+def hojas_resumen(df, nombre):
+    """
+    Hojas del Excel de la app: Detalle_<nombre>, Resumen_Mensual y Totales_Generales
+
+    Retorna un dict {nombre_hoja: DataFrame} en el orden en que se escriben.
+    """
+    hojas = {f"Detalle_{nombre}": df}
+
+    # Hoja de resumen por mes
+    if "Mes" in df.columns and not df["Mes"].isna().all():
+        resumen_mes = (
+            df.groupby(["Mes"], observed=True)
+            .agg(
+                {
+                    "Monto_Concepto": "sum",
+                    "Ingresos_Subtotal": "sum",
+                    "Ingresos_IVA": "sum",
+                    "Ingresos_Retencion_IVA": "sum",
+                    "Ingresos_Retencion_ISR": "sum",
+                    "Egresos_Subtotal": "sum",
+                    "Egresos_IVA": "sum",
+                    "Egresos_Total": "sum",
+                    "UUID": "count",
+                }
+            )
+            .reset_index()
+        )
+        resumen_mes.rename(columns={"UUID": "Num_CFDIs"}, inplace=True)
+        hojas["Resumen_Mensual"] = resumen_mes
+
+    # Hoja de totales generales
+    hojas["Totales_Generales"] = pd.DataFrame(
+        {
+            "Concepto": ["TOTAL GENERAL"],
+            "Num_CFDIs_Unicos": [df["UUID"].nunique()],
+            "Total_Conceptos": [len(df)],
+            "Monto_Total": [df["Monto_Concepto"].sum()],
+            "Ingresos_Subtotal": [df["Ingresos_Subtotal"].sum()],
+            "Ingresos_IVA": [df["Ingresos_IVA"].sum()],
+            "Ingresos_Retencion_IVA": [df["Ingresos_Retencion_IVA"].sum()],
+            "Ingresos_Retencion_ISR": [df["Ingresos_Retencion_ISR"].sum()],
+            "Egresos_Subtotal": [df["Egresos_Subtotal"].sum()],
+            "Egresos_IVA": [df["Egresos_IVA"].sum()],
+            "Egresos_Total": [df["Egresos_Total"].sum()],
+        }
+    )
+    return hojas
+
+
+def _largo_maximo(serie):
+    """Largo del texto más largo de una columna, sin convertir celda por celda"""
+    if serie.empty:
+        return 0
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        # Basta con medir las categorías que aparecen
+        usadas = serie.cat.remove_unused_categories().cat.categories
+        return int(usadas.astype(str).str.len().max()) if len(usadas) else 0
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return len("dd/mm/yyyy")
+    if pd.api.types.is_bool_dtype(serie):
+        return len("FALSE")
+    if pd.api.types.is_numeric_dtype(serie):
+        valores = serie.to_numpy(dtype="float64", na_value=np.nan)
+        valores = valores[np.isfinite(valores)]
+        if not valores.size:
+            return 0
+        # Los decimales impiden estimar el ancho sólo con el máximo y el
+        # mínimo; la conversión a texto de numpy corre en C
+        return int(np.char.str_len(valores.astype("U")).max())
+    largos = serie.dropna().astype(str).str.len()
+    return int(largos.max()) if len(largos) else 0
+
+
+def anchos_columnas(df, maximo=ANCHO_MAXIMO):
+    """Ancho de cada columna: el texto más largo (incluido el encabezado) + 2"""
+    return [
+        min(max(len(str(columna)), _largo_maximo(df[columna])) + 2, maximo)
+        for columna in df.columns
+    ]
+
+
+def _columnas_para_escribir(df):
+    """Columnas como arreglos de objetos Python, con None en lugar de NaN/NaT"""
+    columnas = []
+    for columna in df.columns:
+        serie = df[columna]
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            valores = np.asarray(serie.dt.to_pydatetime(), dtype=object)
+        else:
+            valores = serie.to_numpy(dtype=object)
+        faltantes = serie.isna().to_numpy()
+        if faltantes.any():
+            valores = np.where(faltantes, None, valores)
+        columnas.append(valores)
+    return columnas
+
+
+def _escribir_xlsxwriter(hojas, destino):
+    libro = xlsxwriter.Workbook(
+        destino,
+        {
+            "constant_memory": True,
+            "default_date_format": FORMATO_FECHA_EXCEL,
+            # Texto tal cual: sin convertir a fórmulas, URLs ni números
+            "strings_to_formulas": False,
+            "strings_to_urls": False,
+            "in_memory": False,
+        },
+    )
+    encabezado = libro.add_format({"bold": True})
+    try:
+        for nombre, df in hojas.items():
+            hoja = libro.add_worksheet(nombre)
+            for indice, ancho in enumerate(anchos_columnas(df)):
+                hoja.set_column(indice, indice, ancho)
+            hoja.write_row(0, 0, [str(c) for c in df.columns], encabezado)
+            # constant_memory exige escribir fila por fila en orden; los
+            # valores se convierten a objetos Python por bloques de filas
+            for inicio in range(0, len(df), FILAS_POR_BLOQUE):
+                bloque = df.iloc[inicio : inicio + FILAS_POR_BLOQUE]
+                filas = zip(*_columnas_para_escribir(bloque))
+                for fila, valores in enumerate(filas, inicio + 1):
+                    hoja.write_row(fila, 0, valores)
+    finally:
+        libro.close()
+
+
+def _escribir_openpyxl(hojas, destino):
+    from openpyxl.utils import get_column_letter
+
+    from cfdi_extractor import formatear_fechas_excel
+
+    with pd.ExcelWriter(destino, engine="openpyxl") as writer:
+        for nombre, df in hojas.items():
+            df.to_excel(writer, sheet_name=nombre, index=False)
+            hoja = writer.sheets[nombre]
+            formatear_fechas_excel(hoja, df)
+            for indice, ancho in enumerate(anchos_columnas(df), 1):
+                hoja.column_dimensions[get_column_letter(indice)].width = ancho
+
+
+def escribir_excel(hojas, destino, rapido=True):
+    """
+    Escribe {nombre_hoja: DataFrame} en destino (ruta o archivo binario)
+
+    Con rapido=True y xlsxwriter instalado usa el escritor en flujo de
+    memoria constante; si no, openpyxl.
+    """
+    if rapido and XLSXWRITER_AVAILABLE:
+        _escribir_xlsxwriter(hojas, destino)
+    else:
+        _escribir_openpyxl(hojas, destino)
@@ -0,0 +1,460 @@
+"""
+Motor compartido de extracción de CFDIs
+
+Convierte un XML de CFDI en filas por concepto sin depender de Streamlit.
+Lo usan cfdi_app_enhanced.py, cfdi_processor_app.py y cfdi_simple.py.
+
+OPTIMIZADO: Acceso directo al objeto CFDI, sin pasar por render.json_str
+"""
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from satcfdi.cfdi import CFDI
+
+from cfdi_perfil import Cronometro
+
+# Incrementar cuando cambie la lógica de extracción (invalida la caché)
+VERSION_EXTRACCION = 3
+
+# Columnas de la tabla de conceptos, en el orden en que se exportan
+COLUMNAS = [
+    "Archivo_XML",
+    "UUID",
+    "Folio",
+    "Fecha",
+    "Mes",
+    "Tipo_Comprobante",
+    "Emisor_RFC",
+    "Emisor_Nombre",
+    "Receptor_RFC",
+    "Receptor_Nombre",
+    "SubTotal_CFDI",
+    "Total_CFDI",
+    "Monto_Concepto",
+    "Concepto_Descripcion",
+    "Cantidad",
+    "Unidad",
+    "Valor_Unitario",
+    "Clave_ProdServ",
+    "Categoria",
+    "Deducible",
+    "Ingresos_Subtotal",
+    "Ingresos_IVA",
+    "Ingresos_Retencion_IVA",
+    "Ingresos_Retencion_ISR",
+    "Egresos_Subtotal",
+    "Egresos_IVA",
+    "Egresos_Total",
+]
+
+# Tipos explícitos de la tabla; las columnas no listadas son texto
+COLUMNAS_CATEGORICAS = [
+    "Mes",
+    "Tipo_Comprobante",
+    "Emisor_RFC",
+    "Receptor_RFC",
+    "Clave_ProdServ",
+    "Categoria",
+]
+COLUMNAS_MONTOS = [
+    "SubTotal_CFDI",
+    "Total_CFDI",
+    "Monto_Concepto",
+    "Cantidad",
+    "Valor_Unitario",
+    "Ingresos_Subtotal",
+    "Ingresos_IVA",
+    "Ingresos_Retencion_IVA",
+    "Ingresos_Retencion_ISR",
+    "Egresos_Subtotal",
+    "Egresos_IVA",
+    "Egresos_Total",
+]
+
+_VACIO = {}
+
+# Resultado por archivo que regresa un worker: filas como tuplas, errores como
+# texto y tiempos como {etapa: (pared, cpu, memoria)} para cfdi_perfil
+ResultadoXML = namedtuple(
+    "ResultadoXML",
+    ["archivo", "filas", "error", "desde_cache", "tiempos"],
+    defaults=[False, None],
+)
+
+
+def _sumar_impuesto(impuestos, clave_impuesto):
+    """Suma los importes de traslados/retenciones cuyo key contiene la clave SAT"""
+    total = 0.0
+    for key, impuesto in impuestos.items():
+        if clave_impuesto in key:
+            total += float(impuesto.get("Importe", 0))
+    return total
+
+
+def extraer_conceptos(cfdi, archivo, categoria):
+    """
+    Extrae una fila por concepto directamente del objeto CFDI
+
+    Retorna una lista de tuplas compactas con el orden de COLUMNAS; Fecha es
+    un datetime (o None si el CFDI no la trae). Mes queda en None: se deriva
+    de Fecha al construir la tabla.
+    """
+    fecha = cfdi.get("Fecha", "")
+    if fecha:
+        # La fecha ya viene como datetime desde satcfdi
+        if isinstance(fecha, str):
+            fecha = datetime.strptime(fecha, "%Y-%m-%d %H:%M:%S")
+    else:
+        fecha = None
+
+    tipo_comprobante = str(cfdi.get("TipoDeComprobante", ""))
+    es_ingreso = tipo_comprobante.startswith("I")
+    es_egreso = tipo_comprobante.startswith("E")
+
+    emisor = cfdi.get("Emisor", _VACIO)
+    receptor = cfdi.get("Receptor", _VACIO)
+
+    # Campos a nivel comprobante, compartidos por todos los conceptos
+    encabezado = (
+        archivo,
+        str(
+            cfdi.get("Complemento", _VACIO)
+            .get("TimbreFiscalDigital", _VACIO)
+            .get("UUID", "")
+        ),
+        str(cfdi.get("Folio", "")),
+        fecha,
+        None,  # Mes
+        tipo_comprobante,
+        str(emisor.get("Rfc", "")),
+        str(emisor.get("Nombre", "")),
+        str(receptor.get("Rfc", "")),
+        str(receptor.get("Nombre", "")),
+        float(cfdi.get("SubTotal", 0)),
+        float(cfdi.get("Total", 0)),
+    )
+
+    filas = []
+    for concepto in cfdi.get("Conceptos", []):
+        importe = float(concepto.get("Importe", 0))
+
+        ingresos_subtotal = ingresos_iva = 0.0
+        retencion_iva = retencion_isr = 0.0
+        egresos_subtotal = egresos_iva = egresos_total = 0.0
+
+        # Procesar impuestos según tipo de comprobante (002 = IVA, 001 = ISR)
+        if es_ingreso:
+            impuestos = concepto.get("Impuestos", _VACIO)
+            retenciones = impuestos.get("Retenciones", _VACIO)
+            ingresos_subtotal = importe
+            ingresos_iva = _sumar_impuesto(impuestos.get("Traslados", _VACIO), "002")
+            for key, retencion in retenciones.items():
+                if "002" in key:
+                    retencion_iva += float(retencion.get("Importe", 0))
+                elif "001" in key:
+                    retencion_isr += float(retencion.get("Importe", 0))
+        elif es_egreso:
+            impuestos = concepto.get("Impuestos", _VACIO)
+            egresos_subtotal = importe
+            egresos_iva = _sumar_impuesto(impuestos.get("Traslados", _VACIO), "002")
+            egresos_total = importe + egresos_iva
+
+        filas.append(
+            encabezado
+            + (
+                importe,
+                str(concepto.get("Descripcion", "")),
+                float(concepto.get("Cantidad", 1)),
+                str(concepto.get("Unidad", "")),
+                float(concepto.get("ValorUnitario", 0)),
+                str(concepto.get("ClaveProdServ", "")),
+                categoria,
+                False,  # Deducible: campo inicial para marcar deducibilidad
+                ingresos_subtotal,
+                ingresos_iva,
+                retencion_iva,
+                retencion_isr,
+                egresos_subtotal,
+                egresos_iva,
+                egresos_total,
+            )
+        )
+
+    return filas
+
+
+def procesar_xml(xml_content, archivo, categoria):
+    """
+    Parsea el contenido de un XML y extrae sus conceptos
+
+    Retorna (cfdi, filas) para que el llamador pueda reutilizar el CFDI.
+    """
+    cfdi = CFDI.from_string(xml_content)
+    return cfdi, extraer_conceptos(cfdi, archivo, categoria)
+
+
+class TablaConceptos:
+    """
+    Constructor columnar de la tabla de conceptos
+
+    En lugar de acumular un dict por concepto, agrega las filas (tuplas) de
+    cada XML a una lista por columna y construye el DataFrame una sola vez
+    con tipos explícitos: categóricas para RFCs, tipo, mes, categoría y
+    clave, float64 para montos y datetime64 para Fecha.
+    """
+
+    def __init__(self):
+        self._columnas = [[] for _ in COLUMNAS]
+
+    def __len__(self):
+        return len(self._columnas[0])
+
+    def agregar(self, filas):
+        """Agrega las tuplas de un XML transponiéndolas a las columnas"""
+        if not filas:
+            return
+        for columna, valores in zip(self._columnas, zip(*filas)):
+            columna.extend(valores)
+
+    def construir(self):
+        """DataFrame tipado; las listas internas se liberan columna por columna"""
+        datos = {}
+        for nombre, valores in zip(COLUMNAS, self._columnas):
+            if nombre == "Mes":
+                continue
+            if nombre in COLUMNAS_CATEGORICAS:
+                datos[nombre] = pd.Categorical(valores)
+            elif nombre in COLUMNAS_MONTOS:
+                datos[nombre] = np.asarray(valores, dtype="float64")
+            elif nombre == "Fecha":
+                datos[nombre] = pd.to_datetime(pd.Series(valores, dtype=object))
+            elif nombre == "Deducible":
+                datos[nombre] = np.asarray(valores, dtype="bool")
+            else:
+                datos[nombre] = valores
+        self._columnas = [[] for _ in COLUMNAS]
+        datos["Mes"] = meses_de_fechas(datos["Fecha"]).array
+        return pd.DataFrame(datos, columns=COLUMNAS)
+
+
+def meses_de_fechas(fechas):
+    """
+    Columna Mes ("%Y-%m", categórica) derivada de una serie datetime64
+
+    Se convierte cada mes distinto a texto una sola vez en lugar de aplicar
+    strftime fila por fila.
+    """
+    meses = fechas.dt.to_period("M").astype("category")
+    return meses.cat.rename_categories(lambda periodo: periodo.strftime("%Y-%m"))
+
+
+def aplicar_tipos(df):
+    """
+    Asegura los tipos de la tabla de conceptos en un DataFrame ya construido
+
+    Para tablas que vienen de fuera de TablaConceptos (por ejemplo un
+    Parquet escrito por otra versión); las columnas ya tipadas no se copian.
+    """
+    faltantes = [c for c in COLUMNAS if c not in df.columns]
+    if faltantes:
+        raise ValueError(f"No es una tabla de conceptos; faltan: {faltantes}")
+    tipos = {}
+    for nombre in COLUMNAS_CATEGORICAS:
+        if not isinstance(df[nombre].dtype, pd.CategoricalDtype):
+            tipos[nombre] = "category"
+    for nombre in COLUMNAS_MONTOS:
+        if df[nombre].dtype != "float64":
+            tipos[nombre] = "float64"
+    if df["Deducible"].dtype != "bool":
+        tipos["Deducible"] = "bool"
+    if tipos:
+        df = df.astype(tipos)
+    if not pd.api.types.is_datetime64_any_dtype(df["Fecha"]):
+        df = df.assign(Fecha=pd.to_datetime(df["Fecha"], errors="coerce"))
+    return df[COLUMNAS]
+
+
+def construir_dataframe(filas):
+    """Atajo: DataFrame tipado a partir de una lista de tuplas"""
+    tabla = TablaConceptos()
+    tabla.agregar(filas)
+    return tabla.construir()
+
+
+def formatear_fechas_excel(hoja, df, formato="DD/MM/YYYY"):
+    """
+    Aplica el formato de fecha a las columnas datetime de una hoja openpyxl
+
+    La tabla guarda Fecha como datetime64 y el formato sólo se aplica al
+    exportar. Se hace sobre la hoja ya escrita porque el escritor openpyxl de
+    pandas no respeta datetime_format en todas las versiones.
+    """
+    for indice, columna in enumerate(df.columns, start=1):
+        if pd.api.types.is_datetime64_any_dtype(df[columna]):
+            for (celda,) in hoja.iter_rows(min_row=2, min_col=indice, max_col=indice):
+                celda.number_format = formato
+
+
+def claves_unicas(df):
+    """Claves de productos/servicios únicas, ordenadas, para el checklist"""
+    claves = df["Clave_ProdServ"].dropna().unique()
+    return sorted(clave for clave in claves if clave)
+
+
+# Atributo UUID del TimbreFiscalDigital, con o sin prefijo de espacio de nombres
+_PATRON_UUID = re.compile(
+    rb"<(?:[\w.-]+:)?TimbreFiscalDigital\b[^>]*?"
+    rb"\sUUID\s*=\s*[\"']([0-9A-Fa-f-]{36})[\"']"
+)
+
+COLUMNAS_DUPLICADOS = ["Archivo", "UUID", "Duplicado_De"]
+
+
+def uuid_de_xml(xml_content):
+    """
+    UUID del timbre leído directamente de los bytes, sin parsear el XML
+
+    Regresa el UUID en mayúsculas, o "" si el XML no está timbrado o no se
+    pudo leer (por ejemplo, codificado en UTF-16).
+    """
+    coincidencia = _PATRON_UUID.search(xml_content)
+    return coincidencia.group(1).decode("ascii").upper() if coincidencia else ""
+
+
+def separar_duplicados(documentos, vistos=None):
+    """
+    Separa los (archivo, xml_bytes) cuyo UUID ya apareció antes
+
+    vistos es un dict {UUID en mayúsculas: origen} con lo ya cargado y se
+    actualiza con los UUIDs del lote, así que puede compartirse entre lotes.
+    Los XMLs sin UUID legible se conservan. Retorna (unicos, duplicados),
+    donde cada duplicado es (archivo, uuid, origen del primero).
+    """
+    vistos = {} if vistos is None else vistos
+    unicos, duplicados = [], []
+    for archivo, xml_content in documentos:
+        uuid = uuid_de_xml(xml_content)
+        if uuid in vistos:
+            duplicados.append((archivo, uuid, vistos[uuid]))
+            continue
+        if uuid:
+            vistos[uuid] = archivo
+        unicos.append((archivo, xml_content))
+    return unicos, duplicados
+
+
+def reporte_duplicados(duplicados):
+    """DataFrame Archivo / UUID / Duplicado_De a partir de separar_duplicados"""
+    return pd.DataFrame(duplicados, columns=COLUMNAS_DUPLICADOS)
+
+
+def uuids_cargados(df, origen="sesión"):
+    """dict {UUID: origen} con los UUIDs de una tabla de conceptos, para vistos"""
+    if df is None or df.empty:
+        return {}
+    uuids = df["UUID"].astype(str).str.upper().unique()
+    return {uuid: origen for uuid in uuids if uuid}
+
+
+def procesar_documento(archivo, xml_content, categoria):
+    """
+    Procesa un XML completo dentro de un worker
+
+    Nunca lanza excepciones: los errores se regresan como texto en el
+    ResultadoXML para que el llamador los reporte por archivo. El parseo y la
+    extracción se miden por separado en tiempos.
+    """
+    try:
+        with Cronometro() as parseo:
+            cfdi = CFDI.from_string(xml_content)
+        with Cronometro() as extraccion:
+            filas = extraer_conceptos(cfdi, archivo, categoria)
+    except Exception as e:
+        return ResultadoXML(archivo, [], str(e))
+
+    tiempos = {"parseo": parseo.medicion, "extraccion": extraccion.medicion}
+    return ResultadoXML(archivo, filas, None, tiempos=tiempos)
+
+
+def _procesar_documento_args(args):
+    return procesar_documento(*args)
+
+
+def workers_por_defecto():
+    """Número de procesos para la ingesta (variable CFDI_WORKERS o núcleos)"""
+    try:
+        return max(1, int(os.environ.get("CFDI_WORKERS", "")))
+    except ValueError:
+        return os.cpu_count() or 1
+
+
+def _ejecutar_tareas(tareas, workers, pool=None):
+    """Ejecuta las tareas en serie o en el pool, conservando el orden"""
+    if not tareas:
+        return
+    if pool is None and (workers == 1 or len(tareas) < 2):
+        for tarea in tareas:
+            yield _procesar_documento_args(tarea)
+        return
+
+    workers = min(workers, len(tareas))
+    chunksize = max(1, min(64, len(tareas) // (workers * 8)))
+    if pool is not None:
+        yield from pool.map(_procesar_documento_args, tareas, chunksize=chunksize)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(_procesar_documento_args, tareas, chunksize=chunksize)
+
+
+def procesar_lote(
+    documentos, categoria, workers=None, cache=None, pool=None, perfil=None
+):
+    """
+    Procesa una lista de (archivo, xml_bytes) y genera un ResultadoXML por archivo
+
+    Con workers > 1 los XMLs se envían a un ProcessPoolExecutor; con pool se
+    usa ese ejecutor (del llamador, que lo reutiliza entre lotes) en lugar de
+    crear uno. Con una cache (cfdi_cache.CacheCFDI) sólo se parsean los XMLs
+    cuyo hash no está guardado. Con perfil (cfdi_perfil.Perfil) se acumulan
+    los tiempos de parseo y extracción de cada worker. Los resultados se
+    entregan siempre en el orden de entrada.
+    """
+    resultados = _procesar_lote(documentos, categoria, workers, cache, pool)
+    if perfil is None:
+        yield from resultados
+        return
+    for resultado in resultados:
+        perfil.agregar(resultado.tiempos)
+        yield resultado
+
+
+def _procesar_lote(documentos, categoria, workers, cache, pool):
+    workers = workers or workers_por_defecto()
+    tareas = [(archivo, xml, categoria) for archivo, xml in documentos]
+
+    if cache is None:
+        yield from _ejecutar_tareas(tareas, workers, pool)
+        return
+
+    from cfdi_cache import hash_xml, reetiquetar
+
+    hashes = [hash_xml(xml) for _, xml, _ in tareas]
+    cacheados = cache.obtener_filas(hashes)
+    faltantes = _ejecutar_tareas(
+        [t for t, h in zip(tareas, hashes) if h not in cacheados], workers, pool
+    )
+
+    for (archivo, _, _), hash_ in zip(tareas, hashes):
+        if hash_ in cacheados:
+            filas = reetiquetar(cacheados[hash_], archivo, categoria)
+            yield ResultadoXML(archivo, filas, None, True)
+            continue
+        resultado = next(faltantes)
+        if not resultado.error:
+            cache.guardar_filas(hash_, resultado.filas)
+        yield resultado
@@ -0,0 +1,153 @@
+"""
+Índice de filtros de la tabla de conceptos
+
+Se construye una vez por tabla y evita recorrerla completa en cada rerun de
+Streamlit:
+
+- RFCs y tipo de comprobante como códigos de categoría, para que una
+  selección sea una búsqueda en una tabla booleana del tamaño del catálogo.
+- Fecha y Monto_Concepto ordenados, para que un rango sea un searchsorted
+  que regresa directamente las filas candidatas.
+
+Los filtros se componen sobre el rango más selectivo: sólo sus filas se
+revisan contra los demás criterios, y el resultado son posiciones en el
+orden original de la tabla.
+"""
+import numpy as np
+import pandas as pd
+
+COLUMNAS_SELECCION = ("Receptor_RFC", "Emisor_RFC", "Tipo_Comprobante")
+# Límites para rangos abiertos (el mínimo de int64 es NaT)
+_FECHA_MINIMA = np.datetime64(-(2**63) + 1, "ns")
+_FECHA_MAXIMA = np.datetime64(2**63 - 1, "ns")
+
+
+def _ordenar(valores, validos):
+    """(posiciones de las filas válidas ordenadas por valor, valores ordenados)"""
+    posiciones = np.flatnonzero(validos)
+    orden = posiciones[np.argsort(valores[posiciones], kind="stable")]
+    return orden, valores[orden]
+
+
+class IndiceFiltros:
+    """Códigos y arreglos ordenados para filtrar una tabla de conceptos"""
+
+    def __init__(self, df):
+        self.filas = len(df)
+        self._codigos = {}
+        self._categorias = {}
+        self.opciones = {}
+        for columna in COLUMNAS_SELECCION:
+            serie = df[columna]
+            if not isinstance(serie.dtype, pd.CategoricalDtype):
+                serie = serie.astype("category")
+            codigos = serie.cat.codes.to_numpy()
+            categorias = serie.cat.categories.astype(str)
+            presentes = np.unique(codigos[codigos >= 0])
+            self._codigos[columna] = codigos
+            self._categorias[columna] = {c: i for i, c in enumerate(categorias)}
+            self.opciones[columna] = sorted(
+                c for c in categorias[presentes].tolist() if c
+            )
+
+        self._fechas = df["Fecha"].to_numpy(dtype="datetime64[ns]")
+        self._orden_fecha, self._fechas_ordenadas = _ordenar(
+            self._fechas, ~np.isnat(self._fechas)
+        )
+        self._montos = df["Monto_Concepto"].to_numpy(dtype="float64")
+        self._orden_monto, self._montos_ordenados = _ordenar(
+            self._montos, ~np.isnan(self._montos)
+        )
+        self._deducible = df["Deducible"].to_numpy(dtype=bool)
+
+    def rango_fechas(self):
+        """(primera, última) Fecha como Timestamps, o (None, None)"""
+        if not len(self._fechas_ordenadas):
+            return None, None
+        return (
+            pd.Timestamp(self._fechas_ordenadas[0]),
+            pd.Timestamp(self._fechas_ordenadas[-1]),
+        )
+
+    def _seleccion(self, columna, valores):
+        """Tabla booleana por código: True para las categorías seleccionadas"""
+        tabla = np.zeros(len(self._categorias[columna]) + 1, dtype=bool)
+        for valor in valores:
+            codigo = self._categorias[columna].get(str(valor))
+            if codigo is not None:
+                tabla[codigo] = True
+        # El código -1 (faltante) cae en la última posición, siempre False
+        return tabla
+
+    def posiciones(
+        self,
+        receptores=(),
+        emisores=(),
+        tipos=(),
+        desde=None,
+        hasta=None,
+        monto_minimo=0,
+        deducible=None,
+    ):
+        """
+        Posiciones (ordenadas) de las filas que cumplen todos los filtros
+
+        desde y hasta son fechas inclusivas (hasta incluye el día completo).
+        deducible es True, False o None (todos). Retorna None si no hay
+        ningún filtro activo, para que el llamador use la tabla tal cual.
+        """
+        # Cada rango ordenado da sus filas candidatas; se parte del menor
+        rangos = []
+        inicio = fin = None
+        if desde is not None or hasta is not None:
+            inicio = _FECHA_MINIMA
+            if desde is not None:
+                inicio = np.datetime64(pd.Timestamp(desde), "ns")
+            fin = _FECHA_MAXIMA
+            if hasta is not None:
+                dia_siguiente = pd.Timestamp(hasta).normalize() + pd.Timedelta(days=1)
+                fin = np.datetime64(dia_siguiente, "ns")
+            a, b = np.searchsorted(self._fechas_ordenadas, [inicio, fin], "left")
+            rangos.append(self._orden_fecha[a:b])
+        if monto_minimo:
+            a = np.searchsorted(self._montos_ordenados, monto_minimo, "left")
+            rangos.append(self._orden_monto[a:])
+
+        elegidos = (receptores, emisores, tipos)
+        selecciones = [
+            (columna, valores)
+            for columna, valores in zip(COLUMNAS_SELECCION, elegidos)
+            if valores
+        ]
+        if not rangos and not selecciones and deducible is None:
+            return None
+
+        candidatos = np.sort(min(rangos, key=len)) if rangos else None
+
+        def en_candidatos(arreglo):
+            return arreglo if candidatos is None else arreglo[candidatos]
+
+        mascara = np.ones(
+            self.filas if candidatos is None else len(candidatos), dtype=bool
+        )
+        for columna, valores in selecciones:
+            tabla = self._seleccion(columna, valores)
+            mascara &= tabla[en_candidatos(self._codigos[columna])]
+        if inicio is not None:
+            fechas = en_candidatos(self._fechas)
+            mascara &= (fechas >= inicio) & (fechas < fin)
+        if monto_minimo:
+            mascara &= en_candidatos(self._montos) >= monto_minimo
+        if deducible is not None:
+            mascara &= en_candidatos(self._deducible) == deducible
+
+        if candidatos is None:
+            return np.flatnonzero(mascara)
+        return candidatos[mascara]
+
+    def filtrar(self, df, **filtros):
+        """Filas de df (la tabla con la que se construyó) que cumplen filtros"""
+        posiciones = self.posiciones(**filtros)
+        if posiciones is None:
+            return df
+        return df.take(posiciones)
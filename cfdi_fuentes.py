@@ -0,0 +1,101 @@
+"""
+Fuentes de XMLs de CFDI: archivos sueltos, directorios y archivos ZIP
+
+Las descargas masivas del SAT llegan como ZIP. Los miembros se leen uno por
+uno con zipfile, sin extraerlos a disco ni cargar el archivo completo en
+memoria. Todas las funciones generan tuplas (nombre, xml_bytes) listas para
+cfdi_extractor.procesar_lote.
+"""
+import os
+import zipfile
+
+
+def es_xml(nombre):
+    return nombre.lower().endswith(".xml")
+
+
+def es_zip(nombre):
+    return nombre.lower().endswith(".zip")
+
+
+def mensaje_error(error):
+    """
+    Texto de un error de lectura para reportarlo junto al archivo
+
+    Además de zipfile.BadZipFile y OSError, un ZIP puede fallar con
+    RuntimeError (miembro cifrado), NotImplementedError (compresión no
+    soportada), zlib.error o EOFError (datos truncados).
+    """
+    return str(error) or type(error).__name__
+
+
+def _es_miembro_xml(info):
+    """XML del ZIP en cualquier carpeta, salvo los metadatos de macOS"""
+    return (
+        not info.is_dir()
+        and not info.filename.startswith("__MACOSX/")
+        and es_xml(info.filename)
+    )
+
+
+def iterar_zip(origen):
+    """
+    Genera (nombre, xml_bytes) por cada XML de un ZIP
+
+    origen puede ser una ruta o un objeto tipo archivo con seek (por ejemplo
+    un UploadedFile de Streamlit). Se recorren también las carpetas anidadas
+    y el nombre es el del archivo sin la carpeta; se omiten los miembros que
+    no son XML. Un ZIP inválido lanza zipfile.BadZipFile.
+    """
+    with zipfile.ZipFile(origen) as archivo_zip:
+        for info in archivo_zip.infolist():
+            if not _es_miembro_xml(info):
+                continue
+            with archivo_zip.open(info) as miembro:
+                yield os.path.basename(info.filename), miembro.read()
+
+
+def iterar_directorio(directorio, errores=None):
+    """
+    Genera (nombre, xml_bytes) por cada XML y cada ZIP del directorio
+
+    Sólo se leen los archivos del primer nivel, en orden alfabético. Si se
+    pasa una lista errores, los ZIP ilegibles se registran en ella como
+    (nombre, mensaje) y se continúa con el siguiente archivo.
+    """
+    for nombre in sorted(os.listdir(directorio)):
+        ruta = os.path.join(directorio, nombre)
+        if not os.path.isfile(ruta):
+            continue
+        if es_xml(nombre):
+            with open(ruta, "rb") as f:
+                yield nombre, f.read()
+        elif es_zip(nombre):
+            try:
+                yield from iterar_zip(ruta)
+            except Exception as e:
+                if errores is None:
+                    raise
+                errores.append((nombre, mensaje_error(e)))
+
+
+def iterar_rutas(rutas, errores=None):
+    """
+    Genera (nombre, xml_bytes) a partir de una mezcla de directorios, ZIPs y XMLs
+
+    Con una lista errores, las rutas ilegibles se registran como
+    (ruta, mensaje) en lugar de interrumpir el recorrido.
+    """
+    for ruta in rutas:
+        try:
+            if os.path.isdir(ruta):
+                yield from iterar_directorio(ruta, errores)
+            elif es_zip(ruta):
+                yield from iterar_zip(ruta)
+            else:
+                with open(ruta, "rb") as f:
+                    yield os.path.basename(ruta), f.read()
+        except Exception as e:
+            if errores is None:
+                raise
+            errores.append((ruta, mensaje_error(e)))
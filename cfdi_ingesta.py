@@ -0,0 +1,275 @@
+"""
+Ingesta continua de CFDIs en segundo plano
+
+Los archivos se encolan en cuanto están disponibles (en la aplicación, cada
+vez que el navegador termina de subir uno) y dos hilos de fondo los procesan
+mientras llegan los demás:
+
+- el lector expande cada archivo (XML o ZIP) a documentos (nombre, bytes) y
+  los pasa a una cola acotada;
+- el extractor toma de esa cola lotes con lo que ya esté disponible, omite
+  los UUIDs duplicados y los parsea en un pool de procesos que vive toda la
+  ingesta.
+
+Así la extracción se traslapa con la subida y el tiempo total se acerca a
+max(subida, parseo) en lugar de su suma. Los hilos nunca tocan la sesión de
+Streamlit: dejan partes terminadas que la interfaz toma con recoger(). Los
+tiempos por etapa de toda la ingesta se acumulan en perfil (cfdi_perfil).
+
+Nada queda vivo sin dueño: el pool de procesos se crea con el primer lote y
+se cierra tras ESPERA_POOL segundos sin documentos, y la ingesta se cierra
+sola tras inactividad segundos sin archivos nuevos o en cuanto activa()
+(la sesión que la abrió sigue abierta) regresa False.
+"""
+import queue
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from cfdi_extractor import (
+    TablaConceptos,
+    procesar_lote,
+    separar_duplicados,
+    workers_por_defecto,
+)
+from cfdi_fuentes import es_zip, iterar_zip, mensaje_error
+from cfdi_perfil import Perfil
+
+# df es None si el lote no dejó conceptos; duplicados como en
+# separar_duplicados y errores como (archivo, mensaje)
+ParteIngesta = namedtuple("ParteIngesta", ["df", "xmls", "duplicados", "errores"])
+
+_FIN = object()
+# Cada cuánto revisan los hilos si la ingesta quedó ociosa o sin dueño
+_TICK = 1.0
+ESPERA_POOL = 10.0
+
+
+def _documentos(nombre, fuente):
+    """(nombre, xml_bytes) de un archivo encolado, uno por XML si es ZIP"""
+    if es_zip(nombre):
+        yield from iterar_zip(fuente)
+    else:
+        yield nombre, fuente if isinstance(fuente, bytes) else fuente.read()
+
+
+class IngestaContinua:
+    """Cola de archivos y extracción por lotes en hilos de fondo"""
+
+    def __init__(
+        self,
+        categoria,
+        workers=None,
+        cache=None,
+        vistos=None,
+        lote=200,
+        inactividad=60.0,
+        activa=None,
+    ):
+        self.categoria = categoria
+        self.workers = workers or workers_por_defecto()
+        self.cache = cache
+        self.lote = lote
+        self.inactividad = inactividad
+        self._activa = activa
+        self._cerrada = False
+        # UUIDs ya cargados o vistos en esta ingesta (como en separar_duplicados)
+        self._vistos = dict(vistos or {})
+        self._archivos = queue.Queue()
+        # Acotada: si el parseo va atrás, el lector espera en lugar de
+        # descomprimir todos los ZIPs a memoria
+        self._documentos = queue.Queue(maxsize=lote * 4)
+        self._lock = threading.Lock()
+        self._cancelada = threading.Event()
+        self._partes = []
+        self.perfil = Perfil(f"Ingesta continua {categoria}")
+        self.totales = {
+            "archivos": 0,
+            "documentos": 0,
+            "conceptos": 0,
+            "errores": 0,
+            "duplicados": 0,
+            "desde_cache": 0,
+        }
+        self._lector = threading.Thread(target=self._leer, daemon=True)
+        self._extractor = threading.Thread(target=self._extraer, daemon=True)
+        self._lector.start()
+        self._extractor.start()
+
+    def enviar(self, nombre, fuente):
+        """
+        Encola un archivo: bytes de un XML u objeto archivo (XML o ZIP)
+
+        Retorna False si la ingesta ya se cerró (también por inactividad) y
+        el archivo no se encoló.
+        """
+        with self._lock:
+            if self._cerrada:
+                return False
+            self.totales["archivos"] += 1
+            self._archivos.put((nombre, fuente))
+        return True
+
+    def cerrar(self):
+        """No habrá más archivos: los hilos terminan al vaciar las colas"""
+        with self._lock:
+            if self._cerrada:
+                return
+            self._cerrada = True
+        self._archivos.put(_FIN)
+
+    def cancelar(self):
+        """Detiene la ingesta; las partes ya terminadas se conservan"""
+        self._cancelada.set()
+        self.cerrar()
+
+    @property
+    def cerrada(self):
+        return self._cerrada
+
+    @property
+    def terminada(self):
+        return not self._extractor.is_alive()
+
+    def esperar(self, timeout=None):
+        self._extractor.join(timeout)
+        return self.terminada
+
+    def recoger(self):
+        """Partes terminadas desde la última llamada, en orden de llegada"""
+        with self._lock:
+            partes, self._partes = self._partes, []
+        return partes
+
+    def resumen(self):
+        with self._lock:
+            return dict(self.totales)
+
+    def _poner(self, documento):
+        """put en la cola de documentos que se rinde si se cancela la ingesta"""
+        while not self._cancelada.is_set():
+            try:
+                self._documentos.put(documento, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _cerrar_si_ociosa(self):
+        """Cierra la ingesta si no hay archivos encolados (atómico con enviar)"""
+        with self._lock:
+            if self._cerrada or not self._archivos.empty():
+                return False
+            self._cerrada = True
+        return True
+
+    def _siguiente_archivo(self):
+        """Siguiente archivo, o _FIN si la ingesta quedó ociosa o sin dueño"""
+        ocioso = 0.0
+        while True:
+            try:
+                return self._archivos.get(timeout=_TICK)
+            except queue.Empty:
+                ocioso += _TICK
+            if self._activa is not None and not self._activa():
+                # La sesión se cerró: nadie va a recoger las partes
+                self._cancelada.set()
+                return _FIN
+            if ocioso >= self.inactividad and self._cerrar_si_ociosa():
+                return _FIN
+
+    def _leer(self):
+        try:
+            while True:
+                elemento = self._siguiente_archivo()
+                if elemento is _FIN or self._cancelada.is_set():
+                    return
+                nombre, fuente = elemento
+                try:
+                    documentos = _documentos(nombre, fuente)
+                    while True:
+                        # Se mide la lectura, no la espera en la cola acotada
+                        with self.perfil.etapa("lectura"):
+                            documento = next(documentos, None)
+                        if documento is None or not self._poner(documento):
+                            break
+                except Exception as e:
+                    # ZIP dañado o cifrado, compresión no soportada...: el
+                    # archivo se reporta y la ingesta sigue con los demás
+                    parte = ParteIngesta(None, [], [], [(nombre, mensaje_error(e))])
+                    with self._lock:
+                        self.totales["errores"] += 1
+                        self._partes.append(parte)
+        finally:
+            # El extractor termina sólo al recibir _FIN: se envía siempre
+            if not self._poner(_FIN):
+                # Cancelada: sólo hace falta despertar al extractor si espera
+                try:
+                    self._documentos.put_nowait(_FIN)
+                except queue.Full:
+                    pass
+
+    def _extraer(self):
+        pool = None
+        ocioso = 0.0
+        try:
+            terminado = False
+            while not terminado and not self._cancelada.is_set():
+                # Espera el primer documento y toma lo demás que ya esté listo
+                try:
+                    bloque = [self._documentos.get(timeout=_TICK)]
+                except queue.Empty:
+                    ocioso += _TICK
+                    if pool is not None and ocioso >= ESPERA_POOL:
+                        # Sin documentos: los workers no esperan la subida
+                        pool.shutdown()
+                        pool = None
+                    continue
+                ocioso = 0.0
+                while len(bloque) < self.lote:
+                    try:
+                        bloque.append(self._documentos.get_nowait())
+                    except queue.Empty:
+                        break
+                terminado = any(documento is _FIN for documento in bloque)
+                bloque = [documento for documento in bloque if documento is not _FIN]
+                if bloque and not self._cancelada.is_set():
+                    if pool is None and self.workers > 1:
+                        pool = ProcessPoolExecutor(max_workers=self.workers)
+                    self._procesar(bloque, pool)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+    def _procesar(self, bloque, pool):
+        bloque, duplicados = separar_duplicados(bloque, self._vistos)
+        tabla = TablaConceptos()
+        xmls, errores = [], []
+        desde_cache = 0
+        resultados = procesar_lote(
+            bloque,
+            self.categoria,
+            workers=self.workers,
+            cache=self.cache,
+            pool=pool,
+            perfil=self.perfil,
+        )
+        for resultado, (_, xml_content) in zip(resultados, bloque):
+            if resultado.error:
+                errores.append((resultado.archivo, resultado.error))
+                continue
+            xmls.append({"filename": resultado.archivo, "content": xml_content})
+            tabla.agregar(resultado.filas)
+            desde_cache += resultado.desde_cache
+
+        df = None
+        if len(tabla):
+            with self.perfil.etapa("tabla"):
+                df = tabla.construir()
+        with self._lock:
+            self._partes.append(ParteIngesta(df, xmls, duplicados, errores))
+            self.totales["documentos"] += len(bloque) + len(duplicados)
+            self.totales["conceptos"] += 0 if df is None else len(df)
+            self.totales["errores"] += len(errores)
+            self.totales["duplicados"] += len(duplicados)
+            self.totales["desde_cache"] += desde_cache
@@ -0,0 +1,147 @@
+"""
+Caché en memoria compartida por todas las sesiones del proceso
+
+Cada sesión de Streamlit guarda sus tablas en st.session_state, así que dos
+contadores que suben la misma descarga del SAT la procesan dos veces. Aquí se
+guardan, una sola vez por proceso, resultados direccionados por contenido
+(el hash de los archivos subidos) y estructuras derivadas de una tabla (cubo,
+índice de filtros), para que la segunda sesión los tome sin recalcular.
+
+- Presupuesto global de bytes: al superarlo se desalojan las entradas usadas
+  hace más tiempo (LRU).
+- Los valores se comparten entre sesiones y no deben modificarse en sitio;
+  las tablas de pandas (Copy-on-Write) ya se tratan así en la aplicación.
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def tamano_de(valor, _vistos=None):
+    """Estimación de los bytes de valor: tablas, arreglos, bytes y contenedores"""
+    vistos = set() if _vistos is None else _vistos
+    if id(valor) in vistos:
+        return 0
+    vistos.add(id(valor))
+    if isinstance(valor, pd.DataFrame):
+        return int(valor.memory_usage(index=True, deep=True).sum())
+    if isinstance(valor, pd.Series):
+        return int(valor.memory_usage(index=True, deep=True))
+    if isinstance(valor, np.ndarray):
+        return valor.nbytes
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(
+            tamano_de(k, vistos) + tamano_de(v, vistos) for k, v in valor.items()
+        )
+    if isinstance(valor, (list, tuple, set, frozenset)):
+        return sys.getsizeof(valor) + sum(tamano_de(v, vistos) for v in valor)
+    if hasattr(valor, "__dict__") and not isinstance(valor, type):
+        return sys.getsizeof(valor) + tamano_de(vars(valor), vistos)
+    return sys.getsizeof(valor)
+
+
+class CacheMemoria:
+    """Valores en memoria con presupuesto de bytes y desalojo LRU"""
+
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self._total = 0
+        self.aciertos = 0
+        self.fallos = 0
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def __contains__(self, clave):
+        return clave in self._entradas
+
+    def obtener(self, clave, predeterminado=None):
+        """Valor guardado bajo clave (y lo marca como recién usado)"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return predeterminado
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[0]
+
+    def guardar(self, clave, valor, tamano=None):
+        """
+        Guarda valor bajo clave y desaloja lo menos usado si no cabe
+
+        tamano es el costo en bytes (por defecto tamano_de(valor)). Un valor
+        más grande que todo el presupuesto no se guarda; retorna si se guardó.
+        """
+        tamano = tamano_de(valor) if tamano is None else int(tamano)
+        if tamano > self.max_bytes:
+            return False
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self._total -= anterior[1]
+            self._entradas[clave] = (valor, tamano)
+            self._total += tamano
+            while self._total > self.max_bytes:
+                _, (_, liberado) = self._entradas.popitem(last=False)
+                self._total -= liberado
+        return True
+
+    def obtener_o_calcular(self, clave, calcular, tamano=None):
+        """
+        Valor guardado bajo clave, o calcular() guardado bajo clave
+
+        El cálculo corre fuera del candado: dos sesiones que piden la misma
+        clave a la vez pueden calcularla las dos, pero no se bloquean.
+        """
+        valor = self.obtener(clave)
+        if valor is None:
+            valor = calcular()
+            self.guardar(clave, valor, tamano(valor) if callable(tamano) else tamano)
+        return valor
+
+    def quitar(self, clave):
+        with self._lock:
+            entrada = self._entradas.pop(clave, None)
+            if entrada is not None:
+                self._total -= entrada[1]
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._total = 0
+
+    def resumen(self):
+        """Entradas, bytes usados, presupuesto y aciertos/fallos"""
+        with self._lock:
+            return {
+                "entradas": len(self._entradas),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+            }
+
+
+_memoria_global = None
+_memoria_lock = threading.Lock()
+
+
+def memoria_por_defecto():
+    """
+    Caché en memoria compartida del proceso
+
+    Su presupuesto es CFDI_MEMORIA_MAX_MB megabytes (por defecto 256).
+    """
+    global _memoria_global
+    with _memoria_lock:
+        if _memoria_global is None:
+            max_mb = int(os.environ.get("CFDI_MEMORIA_MAX_MB", "256"))
+            _memoria_global = CacheMemoria(max_bytes=max_mb * 2**20)
+    return _memoria_global
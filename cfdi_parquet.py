@@ -0,0 +1,103 @@
+"""
+Guardado y carga de la tabla de conceptos en Parquet y Arrow IPC
+
+Un periodo ya procesado se guarda con sus tipos (categóricas, float64,
+datetime64) y se vuelve a cargar en milisegundos, sin parsear otra vez los
+XMLs. Requiere pyarrow. El archivo lleva la versión de extracción con la
+que se generó: una tabla de otra versión no se carga, porque sus columnas
+pueden calcularse distinto y hay que volver a procesar los XMLs.
+"""
+import os
+
+from cfdi_extractor import VERSION_EXTRACCION, aplicar_tipos
+
+FORMATOS = ("parquet", "arrow")
+EXTENSIONES = {
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".ipc": "arrow",
+}
+
+_CLAVE_VERSION = b"cfdi_version_extraccion"
+
+
+def formato_de_nombre(nombre):
+    """Formato ("parquet" o "arrow") según la extensión del archivo"""
+    extension = os.path.splitext(nombre)[1].lower()
+    if extension not in EXTENSIONES:
+        raise ValueError(f"Extensión no soportada: {nombre}")
+    return EXTENSIONES[extension]
+
+
+def con_version(tabla):
+    """Agrega la versión de extracción a los metadatos de una tabla de Arrow"""
+    metadatos = dict(tabla.schema.metadata or {})
+    metadatos[_CLAVE_VERSION] = str(VERSION_EXTRACCION).encode()
+    return tabla.replace_schema_metadata(metadatos)
+
+
+def verificar_version(esquema):
+    """
+    Lanza ValueError si el esquema se escribió con otra versión de extracción
+
+    Los archivos sin la marca (escritos por otras herramientas) se aceptan; la
+    verificación de columnas de aplicar_tipos sigue aplicando.
+    """
+    version = (esquema.metadata or {}).get(_CLAVE_VERSION)
+    if version is not None and version != str(VERSION_EXTRACCION).encode():
+        raise ValueError(
+            f"Tabla generada con la versión de extracción {version.decode()} "
+            f"(la actual es {VERSION_EXTRACCION}); vuelve a procesar los XMLs"
+        )
+
+
+def guardar_tabla(df, destino, formato="parquet"):
+    """
+    Escribe la tabla de conceptos en destino (ruta o archivo binario)
+
+    Las categóricas se guardan como diccionarios de Arrow y se recuperan
+    como categóricas al cargar. Se comprime con zstd.
+    """
+    import pyarrow as pa
+
+    tabla = con_version(pa.Table.from_pandas(df, preserve_index=False))
+
+    if formato == "parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(tabla, destino, compression="zstd")
+    elif formato == "arrow":
+        opciones = pa.ipc.IpcWriteOptions(compression="zstd")
+        with pa.ipc.new_file(destino, tabla.schema, options=opciones) as escritor:
+            escritor.write_table(tabla)
+    else:
+        raise ValueError(f"Formato no soportado: {formato}")
+    return destino
+
+
+def cargar_tabla(origen, formato=None):
+    """
+    Lee una tabla de conceptos guardada con guardar_tabla (o por cfdi_batch)
+
+    origen puede ser una ruta o un archivo binario con seek. Sin formato se
+    deduce de la extensión (ruta o atributo name). Lanza ValueError si el
+    archivo no contiene las columnas de la tabla de conceptos o si se generó
+    con otra versión de extracción.
+    """
+    import pyarrow as pa
+
+    if formato is None:
+        formato = formato_de_nombre(getattr(origen, "name", origen))
+
+    if formato == "parquet":
+        import pyarrow.parquet as pq
+
+        tabla = pq.read_table(origen)
+    elif formato == "arrow":
+        tabla = pa.ipc.open_file(origen).read_all()
+    else:
+        raise ValueError(f"Formato no soportado: {formato}")
+
+    verificar_version(tabla.schema)
+    return aplicar_tipos(tabla.to_pandas())
@@ -0,0 +1,316 @@
+"""
+Generación de PDFs de CFDIs bajo demanda
+
+Los PDFs ya no se generan durante la ingesta: se construyen a partir del
+XML original sólo cuando el usuario pide un PDF individual o el consolidado.
+Los PDFs se escriben en un directorio temporal (spool) en lugar de quedarse
+en st.session_state como bytes.
+"""
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from satcfdi.cfdi import CFDI
+
+from cfdi_extractor import workers_por_defecto
+from cfdi_perfil import Cronometro
+
+
+def nombre_pdf(archivo):
+    """Nombre del PDF correspondiente a un archivo XML"""
+    return archivo.replace(".xml", ".pdf")
+
+
+def renderizar_pdf(xml_content):
+    """Parsea el XML y genera los bytes del PDF con satcfdi"""
+    # Importación diferida: render carga WeasyPrint, que es pesado
+    from satcfdi import render
+
+    return render.pdf_bytes(CFDI.from_string(xml_content))
+
+
+def directorio_spool():
+    """Crea el directorio temporal donde se escriben los PDFs generados"""
+    base = os.environ.get("CFDI_SPOOL_DIR")
+    return tempfile.mkdtemp(prefix="cfdi_pdfs_", dir=base)
+
+
+def renderizar_a_archivo(xml_content, ruta):
+    """
+    Genera el PDF y lo escribe en ruta dentro de un worker
+
+    Sólo regresa (ruta, error, tiempos) para no mover los bytes del PDF entre
+    procesos; tiempos mide por separado el parseo y el render (cfdi_perfil).
+    """
+    from satcfdi import render
+
+    try:
+        with Cronometro() as parseo:
+            cfdi = CFDI.from_string(xml_content)
+        with Cronometro() as render_pdf:
+            pdf = render.pdf_bytes(cfdi)
+            with open(ruta, "wb") as f:
+                f.write(pdf)
+        tiempos = {"parseo": parseo.medicion, "render_pdf": render_pdf.medicion}
+        return ruta, None, tiempos
+    except Exception as e:
+        return None, str(e), {}
+
+
+def renderizar_lote(
+    xml_list,
+    directorio,
+    prefijo="",
+    workers=None,
+    max_en_vuelo=None,
+    cache=None,
+    perfil=None,
+):
+    """
+    Genera los PDFs de una lista de {"filename", "content"} en un pool de procesos
+
+    Cada PDF se escribe en directorio y nunca se guarda en memoria. A lo más
+    max_en_vuelo documentos (por defecto 2 por worker) están enviados al pool
+    al mismo tiempo, lo que acota la memoria en lotes de miles de CFDIs.
+    Con una cache (cfdi_cache.CacheCFDI) los PDFs ya generados se copian
+    desde la caché y los nuevos se guardan en ella. Con perfil se acumulan
+    los tiempos de parseo y render de cada worker.
+    Genera (filename_pdf, ruta, error) en el orden de entrada.
+    """
+    workers = workers or workers_por_defecto()
+    max_en_vuelo = max(1, max_en_vuelo or workers * 2)
+
+    if cache is not None:
+        from cfdi_cache import hash_xml
+
+    def tareas():
+        for i, xml_info in enumerate(xml_list):
+            filename = nombre_pdf(xml_info["filename"])
+            ruta = os.path.join(directorio, f"{prefijo}{i:06d}_{filename}")
+            hash_ = hash_xml(xml_info["content"]) if cache is not None else None
+            pdf = cache.obtener_pdf(hash_) if cache is not None else None
+            if pdf is not None:
+                with open(ruta, "wb") as f:
+                    f.write(pdf)
+            yield filename, xml_info["content"], ruta, hash_, pdf is not None
+
+    def terminar(filename, ruta, error, tiempos, hash_):
+        if perfil is not None:
+            perfil.agregar(tiempos)
+        if cache is not None and not error:
+            with open(ruta, "rb") as f:
+                cache.guardar_pdf(hash_, f.read())
+        return filename, ruta, error
+
+    if workers == 1:
+        for filename, xml_content, ruta, hash_, en_cache in tareas():
+            if en_cache:
+                yield filename, ruta, None
+            else:
+                yield terminar(
+                    filename, *renderizar_a_archivo(xml_content, ruta), hash_
+                )
+        return
+
+    en_vuelo = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for filename, xml_content, ruta, hash_, en_cache in tareas():
+            if en_cache:
+                en_vuelo.append((filename, None, ruta, hash_))
+            else:
+                futuro = pool.submit(renderizar_a_archivo, xml_content, ruta)
+                en_vuelo.append((filename, futuro, ruta, hash_))
+            if len(en_vuelo) >= max_en_vuelo:
+                yield _resultado_en_vuelo(en_vuelo.popleft(), terminar)
+        while en_vuelo:
+            yield _resultado_en_vuelo(en_vuelo.popleft(), terminar)
+
+
+def _resultado_en_vuelo(pendiente, terminar):
+    filename, futuro, ruta, hash_ = pendiente
+    if futuro is None:
+        return filename, ruta, None
+    return terminar(filename, *futuro.result(), hash_)
+
+
+def liberar_pdfs(pdf_list):
+    """Borra del spool los archivos de una lista de PDFs generados"""
+    for pdf_info in pdf_list:
+        try:
+            os.remove(pdf_info["path"])
+        except (KeyError, OSError):
+            pass
+
+
+def pdfs_disponibles(pdf_list):
+    """
+    True si los directorios de una lista de PDFs generados siguen en disco
+
+    Los PDFs viven en el directorio de su trabajo, que purgar() borra
+    completo al vencer la retención aunque una sesión siga apuntando a ellos;
+    basta revisar un directorio por trabajo y no cada archivo.
+    """
+    directorios = {os.path.dirname(pdf_info["path"]) for pdf_info in pdf_list}
+    return all(os.path.isdir(directorio) for directorio in directorios)
+
+
+def fusionar_pdfs(rutas, destino, avance=None):
+    """
+    Fusiona los PDFs de rutas escribiendo el resultado de forma incremental
+
+    A diferencia de PdfMerger, los objetos de cada PDF fuente se copian al
+    archivo destino en cuanto se leen y la fuente se cierra antes de abrir la
+    siguiente. En memoria sólo quedan los offsets de la tabla xref y la lista
+    de páginas, así que el pico de memoria no crece con el número de PDFs.
+
+    Con avance, se llama avance(n) después de cada fuente, con n las fuentes
+    ya procesadas. Una fuente que falla no deja ninguna de sus páginas ni
+    objetos en el destino. Retorna (num_paginas, errores) con errores como
+    lista de (ruta, mensaje).
+    """
+    from PyPDF2 import PdfReader
+    from PyPDF2.generic import (
+        ArrayObject,
+        DictionaryObject,
+        IndirectObject,
+        NameObject,
+        NullObject,
+        NumberObject,
+        StreamObject,
+    )
+
+    # Objetos 1 y 2 reservados para el árbol de páginas y el catálogo
+    num_pages, num_catalogo = 1, 2
+    offsets = [None, None, None]
+    kids = []
+    errores = []
+
+    def nuevo_num():
+        offsets.append(None)
+        return len(offsets) - 1
+
+    def escribir(out, num, obj):
+        offsets[num] = out.tell()
+        out.write(b"%d 0 obj\n" % num)
+        obj.write_to_stream(out, None)
+        out.write(b"\nendobj\n")
+
+    with open(destino, "wb") as out:
+        out.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+        for n, ruta in enumerate(rutas, 1):
+            # Punto de regreso si la fuente falla a medio copiar
+            inicio, num_objetos, num_kids = out.tell(), len(offsets), len(kids)
+            try:
+                with open(ruta, "rb") as f:
+                    reader = PdfReader(f)
+                    if reader.is_encrypted:
+                        raise ValueError("PDF cifrado")
+
+                    mapa = {}
+                    pendientes = deque()
+
+                    def remapear(obj):
+                        """Copia obj cambiando sus referencias al nuevo archivo"""
+                        if isinstance(obj, IndirectObject):
+                            clave = (obj.idnum, obj.generation)
+                            if clave not in mapa:
+                                mapa[clave] = nuevo_num()
+                                pendientes.append((clave, obj))
+                            return IndirectObject(mapa[clave], 0, None)
+                        if isinstance(obj, DictionaryObject):
+                            if isinstance(obj, StreamObject):
+                                copia = StreamObject()
+                                copia._data = obj._data
+                            else:
+                                copia = DictionaryObject()
+                            for key, value in obj.items():
+                                if key != "/Length":
+                                    copia[key] = remapear(value)
+                            return copia
+                        if isinstance(obj, ArrayObject):
+                            return ArrayObject(remapear(value) for value in obj)
+                        return obj
+
+                    # Reservar primero las páginas para que los enlaces entre
+                    # ellas no dupliquen objetos
+                    paginas = list(reader.pages)
+                    for pagina in paginas:
+                        ref = pagina.indirect_reference
+                        if ref is not None:
+                            mapa[(ref.idnum, ref.generation)] = nuevo_num()
+
+                    for pagina in paginas:
+                        ref = pagina.indirect_reference
+                        if ref is not None:
+                            num_pagina = mapa[(ref.idnum, ref.generation)]
+                        else:
+                            num_pagina = nuevo_num()
+
+                        copia = DictionaryObject()
+                        for key, value in pagina.items():
+                            if key != "/Parent":
+                                copia[key] = remapear(value)
+                        copia[NameObject("/Parent")] = IndirectObject(
+                            num_pages, 0, None
+                        )
+                        escribir(out, num_pagina, copia)
+
+                        while pendientes:
+                            clave, ref_pendiente = pendientes.popleft()
+                            obj = ref_pendiente.get_object()
+                            if obj is None:
+                                obj = NullObject()
+                            escribir(out, mapa[clave], remapear(obj))
+
+                        kids.append(IndirectObject(num_pagina, 0, None))
+            except Exception as e:
+                # Se descarta lo ya copiado de esta fuente: sus objetos son los
+                # numerados desde num_objetos y se escribieron desde inicio
+                out.seek(inicio)
+                out.truncate()
+                del offsets[num_objetos:]
+                del kids[num_kids:]
+                errores.append((ruta, str(e)))
+            if avance is not None:
+                avance(n)
+
+        # Árbol de páginas y catálogo al final, cuando ya se conocen las páginas
+        escribir(
+            out,
+            num_pages,
+            DictionaryObject(
+                {
+                    NameObject("/Type"): NameObject("/Pages"),
+                    NameObject("/Kids"): ArrayObject(kids),
+                    NameObject("/Count"): NumberObject(len(kids)),
+                }
+            ),
+        )
+        escribir(
+            out,
+            num_catalogo,
+            DictionaryObject(
+                {
+                    NameObject("/Type"): NameObject("/Catalog"),
+                    NameObject("/Pages"): IndirectObject(num_pages, 0, None),
+                }
+            ),
+        )
+
+        # Tabla xref; los objetos reservados que no se escribieron quedan libres
+        inicio_xref = out.tell()
+        out.write(b"xref\n0 %d\n" % len(offsets))
+        out.write(b"0000000000 65535 f \n")
+        for offset in offsets[1:]:
+            if offset is None:
+                out.write(b"0000000000 65535 f \n")
+            else:
+                out.write(b"%010d 00000 n \n" % offset)
+        out.write(
+            b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (len(offsets), num_catalogo, inicio_xref)
+        )
+
+    return len(kids), errores
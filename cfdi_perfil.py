@@ -0,0 +1,183 @@
+"""
+Tiempos y memoria por etapa del procesamiento
+
+Cada lote (un trabajo de fondo, una corrida de cfdi_batch, una ingesta
+continua) lleva un Perfil que acumula por etapa el número de llamadas, el
+tiempo de pared, el tiempo de CPU y el crecimiento de memoria:
+
+- En el proceso que coordina, Perfil.etapa() mide con perf_counter y
+  thread_time (CPU del hilo que llama, para que dos trabajos simultáneos no
+  se mezclen).
+- En los procesos del pool (parseo, extracción y render de PDF) se mide con
+  un Cronometro y las mediciones viajan con cada resultado. Se suman las de
+  todos los workers, así que pueden superar el tiempo de pared del lote.
+- La memoria es cuánto creció el RSS del proceso durante una llamada (el
+  mayor crecimiento entre las llamadas de la etapa). No es el pico: lo que
+  se asigna y se libera dentro de la llamada no aparece. El RSS es de todo
+  el proceso, así que en el servidor dos trabajos simultáneos se suman; en
+  los workers cada proceso atiende una tarea a la vez.
+
+Las etapas no deben anidarse. a_dict() resume el perfil de forma
+serializable y escribir_jsonl() agrega una línea JSON por etapa a un archivo.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+ETAPAS = {
+    "lectura": "Lectura de archivos",
+    "parseo": "CFDI.from_string",
+    "extraccion": "Extracción de campos",
+    "render_pdf": "Render de PDF",
+    "tabla": "Construcción del DataFrame",
+    "excel": "Escritura de Excel",
+    "escritura": "Escritura de CSV/Parquet",
+    "fusion_pdf": "Fusión de PDFs",
+    "diot": "Generación de DIOT",
+}
+ARCHIVO_JSONL = "rendimiento.jsonl"
+
+
+_PAGINA = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_actual():
+    """RSS actual del proceso en bytes (0 donde no hay /proc, p. ej. macOS)"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGINA
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class Cronometro:
+    """Mide un bloque: medicion = (pared, cpu, crecimiento del RSS) al salir"""
+
+    def __enter__(self):
+        self._rss = rss_actual()
+        self._cpu = time.thread_time()
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        pared = time.perf_counter() - self._inicio
+        cpu = time.thread_time() - self._cpu
+        self.medicion = (pared, cpu, max(0, rss_actual() - self._rss))
+        return False
+
+
+class Perfil:
+    """Llamadas, pared, CPU y crecimiento del RSS acumulados por etapa de un lote"""
+
+    def __init__(self, nombre=""):
+        self.nombre = nombre
+        self.etapas = {}
+        self._lock = threading.Lock()
+        self._inicio = time.perf_counter()
+
+    def registrar(self, etapa, pared, cpu, memoria, llamadas=1):
+        with self._lock:
+            acumulado = self.etapas.setdefault(etapa, [0, 0.0, 0.0, 0])
+            acumulado[0] += llamadas
+            acumulado[1] += pared
+            acumulado[2] += cpu
+            acumulado[3] = max(acumulado[3], memoria)
+
+    def agregar(self, mediciones):
+        """Suma las mediciones {etapa: (pared, cpu, memoria)} de un worker"""
+        for etapa, medicion in (mediciones or {}).items():
+            self.registrar(etapa, *medicion)
+
+    @contextmanager
+    def etapa(self, nombre):
+        """Mide el bloque como una llamada de la etapa nombre"""
+        cronometro = Cronometro()
+        with cronometro:
+            yield
+        self.registrar(nombre, *cronometro.medicion)
+
+    def a_dict(self):
+        with self._lock:
+            etapas = {
+                etapa: {
+                    "llamadas": llamadas,
+                    "pared": round(pared, 6),
+                    "cpu": round(cpu, 6),
+                    "rss_crecimiento": memoria,
+                }
+                for etapa, (llamadas, pared, cpu, memoria) in self.etapas.items()
+            }
+        return {
+            "nombre": self.nombre,
+            "pared_total": round(time.perf_counter() - self._inicio, 6),
+            "etapas": etapas,
+        }
+
+    def escribir_jsonl(self, ruta, **contexto):
+        """Agrega al archivo una línea JSON por etapa con el contexto del lote"""
+        datos = self.a_dict()
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        marca = time.strftime("%Y-%m-%dT%H:%M:%S")
+        with open(ruta, "a", encoding="utf-8") as archivo:
+            for etapa, medicion in datos["etapas"].items():
+                linea = {
+                    "fecha": marca,
+                    "lote": datos["nombre"],
+                    "pared_total": datos["pared_total"],
+                    "etapa": etapa,
+                    **medicion,
+                    **contexto,
+                }
+                archivo.write(json.dumps(linea, ensure_ascii=False) + "\n")
+
+
+def tabla_rendimiento(datos):
+    """DataFrame por etapa de un Perfil.a_dict(), de la más lenta a la más rápida"""
+    import pandas as pd
+
+    filas = [
+        (
+            ETAPAS.get(etapa, etapa),
+            medicion["llamadas"],
+            medicion["pared"],
+            medicion["cpu"],
+            medicion["rss_crecimiento"] / 2**20,
+        )
+        for etapa, medicion in datos["etapas"].items()
+    ]
+    tabla = pd.DataFrame(
+        filas,
+        columns=["Etapa", "Llamadas", "Pared (s)", "CPU (s)", "Δ RSS máx. (MB)"],
+    )
+    total = tabla["Pared (s)"].sum()
+    tabla["% del tiempo"] = 100 * tabla["Pared (s)"] / total if total else 0.0
+    return tabla.sort_values("Pared (s)", ascending=False, ignore_index=True)
+
+
+def etapa_dominante(datos):
+    """Etapa con más tiempo de pared de un Perfil.a_dict(), o None"""
+    etapas = datos["etapas"]
+    if not etapas:
+        return None
+    return max(etapas, key=lambda etapa: etapas[etapa]["pared"])
+
+
+def resumen_texto(datos):
+    """Una línea con el tiempo de pared de cada etapa, para la consola"""
+    partes = [
+        f"{etapa} {medicion['pared']:.2f} s"
+        for etapa, medicion in sorted(
+            datos["etapas"].items(), key=lambda par: -par[1]["pared"]
+        )
+    ]
+    return f"Rendimiento ({datos['pared_total']:.2f} s): " + ", ".join(partes)
+
+
+def ruta_jsonl_por_defecto():
+    """rendimiento.jsonl en CFDI_STORE_DIR (por defecto ./output)"""
+    directorio = os.environ.get("CFDI_STORE_DIR", "output")
+    return os.path.join(directorio, ARCHIVO_JSONL)
@@ -1,14 +1,11 @@
 
 import streamlit as st
 import pandas as pd
-import json
 import glob
 import os
-from datetime import datetime
 import zipfile
 import tempfile
-from satcfdi.cfdi import CFDI
-from satcfdi import render
+from cfdi_extractor import construir_dataframe, formatear_fechas_excel, procesar_xml
 
 # Configuración de la página
 st.set_page_config(
@@ -34,92 +31,9 @@ def process_xml_files_streamlit(uploaded_files, file_type):
             # Leer el archivo XML
             xml_content = uploaded_file.read()
             
-            # Procesar con satcfdi
-            cfdi = CFDI.from_string(xml_content)
-            json_data = json.loads(render.json_str(cfdi))
-            
-            # Extraer información
-            fecha = json_data.get('Fecha', '')
-            if fecha:
-                fecha_obj = datetime.strptime(fecha, '%Y-%m-%d %H:%M:%S')
-                mes = fecha_obj.strftime('%Y-%m')
-            else:
-                mes = ''
-            
-            tipo_comprobante = json_data.get('TipoDeComprobante', '')
-            folio = json_data.get('Folio', '')
-            uuid = json_data.get('Complemento', {}).get('TimbreFiscalDigital', {}).get('UUID', '')
-            emisor_rfc = json_data.get('Emisor', {}).get('Rfc', '')
-            receptor_rfc = json_data.get('Receptor', {}).get('Rfc', '')
-            
-            # Procesar conceptos
-            conceptos = json_data.get('Conceptos', [])
-            
-            for concepto in conceptos:
-                row = {
-                    'Archivo_XML': uploaded_file.name,
-                    'UUID': uuid,
-                    'Folio': folio,
-                    'Mes': mes,
-                    'Tipo': tipo_comprobante,
-                    'Emisor_RFC': emisor_rfc,
-                    'Receptor_RFC': receptor_rfc,
-                    'Monto': float(concepto.get('Importe', 0)),
-                    'Concepto': concepto.get('Descripcion', ''),
-                    'Categoria': file_type  # Emitidos o Recibidos
-                }
-                
-                # Procesar impuestos
-                if tipo_comprobante.startswith('I'):  # Ingreso
-                    subtotal = float(concepto.get('Importe', 0))
-                    row['Ingresos_Subtotal'] = subtotal
-                    
-                    impuestos = concepto.get('Impuestos', {})
-                    
-                    # IVA trasladado
-                    traslados = impuestos.get('Traslados', {})
-                    iva_trasladado = 0
-                    for key, traslado in traslados.items():
-                        if '002' in key:
-                            iva_trasladado += float(traslado.get('Importe', 0))
-                    row['Ingresos_IVA'] = iva_trasladado
-                    
-                    # Retenciones
-                    retenciones = impuestos.get('Retenciones', {})
-                    retencion_iva = 0
-                    retencion_isr = 0
-                    
-                    for key, retencion in retenciones.items():
-                        if '002' in key:
-                            retencion_iva += float(retencion.get('Importe', 0))
-                        elif '001' in key:
-                            retencion_isr += float(retencion.get('Importe', 0))
-                    
-                    row['Ingresos_Retencion_IVA'] = retencion_iva
-                    row['Ingresos_Retencion_ISR'] = retencion_isr
-                    row['Egresos_Subtotal'] = 0
-                    row['Egresos_IVA'] = 0
-                    row['Egresos_Total'] = 0
-                
-                elif tipo_comprobante.startswith('E'):  # Egreso
-                    subtotal = float(concepto.get('Importe', 0))
-                    row['Egresos_Subtotal'] = subtotal
-                    
-                    impuestos = concepto.get('Impuestos', {})
-                    traslados = impuestos.get('Traslados', {})
-                    iva_trasladado = 0
-                    for key, traslado in traslados.items():
-                        if '002' in key:
-                            iva_trasladado += float(traslado.get('Importe', 0))
-                    row['Egresos_IVA'] = iva_trasladado
-                    row['Egresos_Total'] = subtotal + iva_trasladado
-                    
-                    row['Ingresos_Subtotal'] = 0
-                    row['Ingresos_IVA'] = 0
-                    row['Ingresos_Retencion_IVA'] = 0
-                    row['Ingresos_Retencion_ISR'] = 0
-                
-                all_data.append(row)
+            # Procesar con el motor compartido (sin conversión JSON)
+            _, filas = procesar_xml(xml_content, uploaded_file.name, file_type)
+            all_data.extend(filas)
                 
         except Exception as e:
             st.error(f"Error procesando {uploaded_file.name}: {e}")
@@ -127,7 +41,7 @@ def process_xml_files_streamlit(uploaded_files, file_type):
     status_text.text("✅ Procesamiento completado")
     progress_bar.empty()
     
-    return pd.DataFrame(all_data) if all_data else None
+    return construir_dataframe(all_data) if all_data else None
 
 # Interfaz principal
 def main():
@@ -190,6 +104,7 @@ def main():
             excel_buffer = io.BytesIO()
             with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
                 st.session_state.df_emitidos.to_excel(writer, sheet_name='CFDIs_Emitidos', index=False)
+                formatear_fechas_excel(writer.sheets['CFDIs_Emitidos'], st.session_state.df_emitidos)
             
             st.download_button(
                 label="📁 Descargar Excel - CFDIs Emitidos",
@@ -239,6 +154,7 @@ def main():
             excel_buffer = io.BytesIO()
             with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
                 st.session_state.df_recibidos.to_excel(writer, sheet_name='CFDIs_Recibidos', index=False)
+                formatear_fechas_excel(writer.sheets['CFDIs_Recibidos'], st.session_state.df_recibidos)
             
             st.download_button(
                 label="📁 Descargar Excel - CFDIs Recibidos",
@@ -290,12 +206,15 @@ def main():
                 excel_buffer = io.BytesIO()
                 with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
                     df_consolidado.to_excel(writer, sheet_name='Consolidado', index=False)
+                    formatear_fechas_excel(writer.sheets['Consolidado'], df_consolidado)
                     
                     if st.session_state.df_emitidos is not None:
                         st.session_state.df_emitidos.to_excel(writer, sheet_name='Emitidos', index=False)
+                        formatear_fechas_excel(writer.sheets['Emitidos'], st.session_state.df_emitidos)
                     
                     if st.session_state.df_recibidos is not None:
                         st.session_state.df_recibidos.to_excel(writer, sheet_name='Recibidos', index=False)
+                        formatear_fechas_excel(writer.sheets['Recibidos'], st.session_state.df_recibidos)
                 
                 st.download_button(
                     label="📁 Descargar Excel Consolidado",
@@ -9,6 +9,8 @@ Script súper fácil para convertir XMLs de CFDIs a Excel
 INSTRUCCIONES:
 1. Coloca este archivo en la carpeta donde están tus CFDIs
 2. Asegúrate de tener las carpetas "emitidas" y "recibidas" con los XMLs
+   (también sirven los ZIP de descarga masiva del SAT, dentro de las carpetas
+   o como "emitidas.zip" y "recibidas.zip")
 3. Ejecuta este archivo (doble clic o python cfdi_simple.py)
 4. Los archivos Excel se generarán automáticamente
 
@@ -19,14 +21,11 @@ FECHA: 2025
 import os
 import sys
 import pandas as pd
-import json
-import glob
-from datetime import datetime
 
 # Verificar que tenemos las librerías necesarias
 try:
-    from satcfdi.cfdi import CFDI
-    from satcfdi import render
+    from cfdi_extractor import construir_dataframe, formatear_fechas_excel, procesar_xml
+    from cfdi_fuentes import es_zip, iterar_directorio, iterar_zip, mensaje_error
     print("✅ Librerías de CFDI encontradas")
 except ImportError:
     print("❌ ERROR: Faltan librerías de CFDI")
@@ -34,115 +33,59 @@ except ImportError:
     input("Presiona Enter para cerrar...")
     sys.exit(1)
 
-def procesar_xmls_simple(directorio, nombre_salida):
-    """Función simple para procesar XMLs"""
+def procesar_xmls_simple(directorio, nombre_salida, categoria=''):
+    """Función simple para procesar XMLs de un directorio o de un ZIP"""
     print(f"🔍 Buscando archivos XML en: {directorio}")
     
     if not os.path.exists(directorio):
         print(f"❌ No se encontró el directorio: {directorio}")
         return None
     
-    # Buscar archivos XML
-    archivos_xml = glob.glob(os.path.join(directorio, "*.xml"))
-    
-    if not archivos_xml:
-        print(f"⚠️ No se encontraron archivos XML en: {directorio}")
-        return None
-    
-    print(f"📄 Encontrados {len(archivos_xml)} archivos XML")
+    # Los XMLs (sueltos o dentro de ZIPs) se leen uno por uno
+    errores_zip = []
+    if es_zip(directorio):
+        documentos = iterar_zip(directorio)
+    else:
+        documentos = iterar_directorio(directorio, errores_zip)
     
     datos = []
     errores = 0
+    i = 0
     
-    for i, archivo in enumerate(archivos_xml, 1):
-        try:
-            print(f"⏳ Procesando {i}/{len(archivos_xml)}: {os.path.basename(archivo)}")
-            
-            # Cargar CFDI
-            cfdi = CFDI.from_file(archivo)
-            json_data = json.loads(render.json_str(cfdi))
-            
-            # Extraer información básica
-            fecha = json_data.get('Fecha', '')
-            mes = ''
-            if fecha:
-                try:
-                    fecha_obj = datetime.strptime(fecha, '%Y-%m-%d %H:%M:%S')
-                    mes = fecha_obj.strftime('%Y-%m')
-                except:
-                    mes = fecha[:7] if len(fecha) >= 7 else ''
-            
-            tipo = json_data.get('TipoDeComprobante', '')
-            uuid = json_data.get('Complemento', {}).get('TimbreFiscalDigital', {}).get('UUID', '')
-            
-            # Procesar conceptos
-            conceptos = json_data.get('Conceptos', [])
-            
-            for concepto in conceptos:
-                fila = {
-                    'Archivo': os.path.basename(archivo),
-                    'UUID': uuid,
-                    'Mes': mes,
-                    'Tipo_Comprobante': tipo,
-                    'Monto': float(concepto.get('Importe', 0)),
-                    'Concepto': concepto.get('Descripcion', ''),
-                    'Ingresos_Subtotal': 0,
-                    'Ingresos_IVA': 0,
-                    'Ingresos_Retencion_ISR': 0,
-                    'Ingresos_Retencion_IVA': 0,
-                    'Egresos_Subtotal': 0,
-                    'Egresos_IVA': 0,
-                    'Egresos_Total': 0
-                }
-                
-                # Clasificar por tipo de comprobante
-                if tipo.startswith('I'):  # Ingreso
-                    fila['Ingresos_Subtotal'] = float(concepto.get('Importe', 0))
-                    
-                    # Calcular impuestos
-                    impuestos = concepto.get('Impuestos', {})
-                    traslados = impuestos.get('Traslados', {})
-                    retenciones = impuestos.get('Retenciones', {})
-                    
-                    # IVA trasladado
-                    for traslado in traslados.values():
-                        if '002' in str(traslado.get('Impuesto', '')):
-                            fila['Ingresos_IVA'] += float(traslado.get('Importe', 0))
-                    
-                    # Retenciones
-                    for retencion in retenciones.values():
-                        impuesto = str(retencion.get('Impuesto', ''))
-                        if '001' in impuesto:  # ISR
-                            fila['Ingresos_Retencion_ISR'] += float(retencion.get('Importe', 0))
-                        elif '002' in impuesto:  # IVA
-                            fila['Ingresos_Retencion_IVA'] += float(retencion.get('Importe', 0))
-                
-                elif tipo.startswith('E'):  # Egreso
-                    subtotal = float(concepto.get('Importe', 0))
-                    fila['Egresos_Subtotal'] = subtotal
-                    
-                    # IVA de egresos
-                    impuestos = concepto.get('Impuestos', {})
-                    traslados = impuestos.get('Traslados', {})
-                    for traslado in traslados.values():
-                        if '002' in str(traslado.get('Impuesto', '')):
-                            fila['Egresos_IVA'] += float(traslado.get('Importe', 0))
-                    
-                    fila['Egresos_Total'] = fila['Egresos_Subtotal'] + fila['Egresos_IVA']
+    try:
+        for i, (archivo, xml_content) in enumerate(documentos, 1):
+            try:
+                print(f"⏳ Procesando {i}: {archivo}")
                 
-                datos.append(fila)
-        
-        except Exception as e:
-            errores += 1
-            print(f"❌ Error en {os.path.basename(archivo)}: {e}")
+                # Cargar CFDI con el motor compartido (sin conversión JSON)
+                _, filas = procesar_xml(xml_content, archivo, categoria)
+                datos.extend(filas)
+            
+            except Exception as e:
+                errores += 1
+                print(f"❌ Error en {archivo}: {e}")
+    except Exception as e:
+        # ZIP dañado, cifrado o con compresión no soportada
+        errores_zip.append((os.path.basename(directorio), mensaje_error(e)))
+    
+    for archivo, mensaje in errores_zip:
+        errores += 1
+        print(f"❌ ZIP inválido {archivo}: {mensaje}")
+    
+    if i == 0:
+        print(f"⚠️ No se encontraron archivos XML en: {directorio}")
+        return None
+    
+    print(f"📄 Encontrados {i} archivos XML")
     
     if datos:
         # Crear Excel
-        df = pd.DataFrame(datos)
+        df = construir_dataframe(datos)
         
         try:
             with pd.ExcelWriter(nombre_salida, engine='openpyxl') as writer:
                 df.to_excel(writer, sheet_name='CFDIs', index=False)
+                formatear_fechas_excel(writer.sheets['CFDIs'], df)
                 
                 # Crear hoja de resumen
                 resumen = {
@@ -177,19 +120,23 @@ def main():
     print("Convierte archivos XML de CFDIs a formato Excel")
     print()
     
-    # Verificar directorios
+    # Verificar directorios (o sus ZIP si no hay carpeta)
     dir_emitidas = "emitidas"
     dir_recibidas = "recibidas"
+    if not os.path.exists(dir_emitidas) and os.path.exists("emitidas.zip"):
+        dir_emitidas = "emitidas.zip"
+    if not os.path.exists(dir_recibidas) and os.path.exists("recibidas.zip"):
+        dir_recibidas = "recibidas.zip"
     
     # Procesar emitidas
     print("📤 PROCESANDO CFDIs EMITIDOS")
     print("-" * 40)
-    df_emitidos = procesar_xmls_simple(dir_emitidas, "CFDIs_Emitidos.xlsx")
+    df_emitidos = procesar_xmls_simple(dir_emitidas, "CFDIs_Emitidos.xlsx", "Emitidos")
     
     print()
     print("📥 PROCESANDO CFDIs RECIBIDOS")
     print("-" * 40)
-    df_recibidos = procesar_xmls_simple(dir_recibidas, "CFDIs_Recibidos.xlsx")
+    df_recibidos = procesar_xmls_simple(dir_recibidas, "CFDIs_Recibidos.xlsx", "Recibidos")
     
     print()
     print("="*60)
@@ -0,0 +1,274 @@
+"""
+Almacén local persistente de conceptos de CFDI
+
+Guarda las filas de la tabla de conceptos en un archivo SQLite dentro del
+volumen ./output, para que el histórico de un cliente sobreviva a la sesión
+del navegador. Cada concepto se identifica por (UUID, Categoria, número de
+concepto) y hay índices por Emisor_RFC, Receptor_RFC y Fecha, así que las
+vistas consultan sólo el rango que necesitan en lugar de cargar todo.
+
+- Upsert por CFDI: volver a ingerir un UUID reemplaza todos sus conceptos.
+- Un cambio de reglas de deducibilidad sólo reescribe la columna Deducible.
+- Fecha se guarda como texto ISO ("YYYY-MM-DDTHH:MM:SS"), que ordena y
+  compara igual que la fecha.
+"""
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+from cfdi_extractor import COLUMNAS, COLUMNAS_MONTOS, aplicar_tipos
+
+_COLUMNAS_SQL = COLUMNAS + ["Num_Concepto"]
+_INDICES = ("Emisor_RFC", "Receptor_RFC", "Fecha")
+
+
+def _tipo_sql(columna):
+    if columna in COLUMNAS_MONTOS:
+        return "REAL"
+    if columna in ("Deducible", "Num_Concepto"):
+        return "INTEGER"
+    return "TEXT"
+
+
+def _fechas_iso(fechas):
+    """Serie datetime64 -> lista de textos ISO (None para NaT), en numpy"""
+    valores = fechas.to_numpy(dtype="datetime64[s]")
+    textos = np.datetime_as_string(valores, unit="s").astype(object)
+    textos[np.isnat(valores)] = None
+    return textos.tolist()
+
+
+def _columna_a_lista(serie):
+    """Valores de una columna como objetos Python, con None en los faltantes"""
+    valores = serie.to_numpy(dtype=object)
+    faltantes = serie.isna().to_numpy()
+    if faltantes.any():
+        valores[faltantes] = None
+    return valores.tolist()
+
+
+def _num_concepto(df):
+    """Número de cada concepto dentro de su (UUID, Categoria), en orden de df"""
+    return df.groupby(["UUID", "Categoria"], observed=True).cumcount()
+
+
+class AlmacenCFDI:
+    """Tabla de conceptos en SQLite con upsert por UUID y consultas por rango"""
+
+    def __init__(self, ruta):
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, timeout=30)
+        columnas = ",\n".join(f'"{c}" {_tipo_sql(c)}' for c in _COLUMNAS_SQL)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS conceptos (
+                    {columnas},
+                    PRIMARY KEY (UUID, Categoria, Num_Concepto)
+                )
+                """
+            )
+            for columna in _INDICES:
+                self._conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_conceptos_{columna.lower()} "
+                    f'ON conceptos ("{columna}")'
+                )
+
+    def upsert(self, df):
+        """
+        Inserta o reemplaza los CFDIs de df
+
+        Los conceptos existentes de cada (UUID, Categoria) se borran antes de
+        insertar los nuevos. Las filas sin UUID no se pueden identificar y se
+        omiten. Retorna el número de conceptos guardados.
+        """
+        if df is None or df.empty:
+            return 0
+        df = df[df["UUID"].astype(str) != ""]
+        if df.empty:
+            return 0
+
+        numero = _num_concepto(df)
+        columnas = []
+        for nombre in _COLUMNAS_SQL:
+            if nombre == "Num_Concepto":
+                columnas.append(numero.tolist())
+            elif nombre == "Fecha":
+                columnas.append(_fechas_iso(df["Fecha"]))
+            elif nombre == "Deducible":
+                columnas.append(df["Deducible"].astype(int).tolist())
+            else:
+                columnas.append(_columna_a_lista(df[nombre]))
+        claves = list(
+            dict.fromkeys(zip(df["UUID"].astype(str), df["Categoria"].astype(str)))
+        )
+
+        marcas = ",".join("?" * len(_COLUMNAS_SQL))
+        nombres = ",".join(f'"{c}"' for c in _COLUMNAS_SQL)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM conceptos WHERE UUID = ? AND Categoria = ?", claves
+            )
+            self._conn.executemany(
+                f"INSERT INTO conceptos ({nombres}) VALUES ({marcas})",
+                zip(*columnas),
+            )
+        return len(df)
+
+    def actualizar_deducible(self, df):
+        """
+        Reescribe sólo la columna Deducible de los conceptos de df
+
+        Para cambios de reglas de deducibilidad: el resto de las columnas no
+        cambia y no hace falta borrar e insertar cada CFDI. Los conceptos que
+        no están en el almacén se ignoran. Retorna el número de filas
+        actualizadas.
+        """
+        if df is None or df.empty:
+            return 0
+        df = df[df["UUID"].astype(str) != ""]
+        if df.empty:
+            return 0
+        filas = zip(
+            df["Deducible"].astype(int).tolist(),
+            df["UUID"].astype(str).tolist(),
+            df["Categoria"].astype(str).tolist(),
+            _num_concepto(df).tolist(),
+        )
+        with self._lock, self._conn:
+            cursor = self._conn.executemany(
+                "UPDATE conceptos SET Deducible = ? "
+                "WHERE UUID = ? AND Categoria = ? AND Num_Concepto = ?",
+                filas,
+            )
+        return cursor.rowcount
+
+    def consultar(
+        self,
+        categoria=None,
+        emisores=None,
+        receptores=None,
+        desde=None,
+        hasta=None,
+        uuids=None,
+    ):
+        """
+        Tabla de conceptos tipada que cumple todos los filtros dados
+
+        desde y hasta son fechas inclusivas (hasta incluye el día completo).
+        Sin filtros regresa todo el almacén; las vistas deben acotar por RFC
+        o rango de fechas para aprovechar los índices.
+        """
+        condiciones, parametros = [], []
+        if categoria:
+            condiciones.append("Categoria = ?")
+            parametros.append(categoria)
+        filtros_rfc = (("Emisor_RFC", emisores), ("Receptor_RFC", receptores))
+        for columna, valores in filtros_rfc:
+            if valores:
+                condiciones.append(f"{columna} IN ({','.join('?' * len(valores))})")
+                parametros.extend(valores)
+        if desde is not None:
+            condiciones.append("Fecha >= ?")
+            parametros.append(pd.Timestamp(desde).strftime("%Y-%m-%dT%H:%M:%S"))
+        if hasta is not None:
+            condiciones.append("Fecha < ?")
+            fin = pd.Timestamp(hasta).normalize() + pd.Timedelta(days=1)
+            parametros.append(fin.strftime("%Y-%m-%dT%H:%M:%S"))
+        if uuids:
+            condiciones.append(f"UUID IN ({','.join('?' * len(uuids))})")
+            parametros.extend(uuids)
+
+        sql = f"SELECT {','.join(COLUMNAS)} FROM conceptos"
+        if condiciones:
+            sql += " WHERE " + " AND ".join(condiciones)
+        sql += " ORDER BY rowid"
+
+        with self._lock:
+            df = pd.read_sql_query(sql, self._conn, params=parametros)
+        df["Fecha"] = pd.to_datetime(df["Fecha"], format="ISO8601")
+        df["Deducible"] = df["Deducible"].astype(bool)
+        return aplicar_tipos(df)
+
+    def valores(self, columna, categoria=None):
+        """Valores distintos de una columna indexada (por ejemplo los RFCs)"""
+        if columna not in _INDICES:
+            raise ValueError(f"{columna} no está indexada")
+        sql = f'SELECT DISTINCT "{columna}" FROM conceptos'
+        parametros = []
+        if categoria:
+            sql += " WHERE Categoria = ?"
+            parametros.append(categoria)
+        with self._lock:
+            filas = self._conn.execute(sql, parametros).fetchall()
+        return sorted(valor for (valor,) in filas if valor)
+
+    def rango_fechas(self, categoria=None):
+        """(primera, última) Fecha del almacén como Timestamps, o (None, None)"""
+        sql = "SELECT MIN(Fecha), MAX(Fecha) FROM conceptos"
+        parametros = []
+        if categoria:
+            sql += " WHERE Categoria = ?"
+            parametros.append(categoria)
+        with self._lock:
+            minimo, maximo = self._conn.execute(sql, parametros).fetchone()
+        if minimo is None:
+            return None, None
+        return pd.Timestamp(minimo), pd.Timestamp(maximo)
+
+    def uuids_existentes(self, uuids, categoria=None):
+        """Subconjunto de uuids que ya están en el almacén"""
+        uuids = list(dict.fromkeys(uuids))
+        existentes = set()
+        with self._lock:
+            for inicio in range(0, len(uuids), 500):
+                bloque = uuids[inicio : inicio + 500]
+                sql = (
+                    "SELECT DISTINCT UUID FROM conceptos "
+                    f"WHERE UUID IN ({','.join('?' * len(bloque))})"
+                )
+                parametros = list(bloque)
+                if categoria:
+                    sql += " AND Categoria = ?"
+                    parametros.append(categoria)
+                existentes.update(u for (u,) in self._conn.execute(sql, parametros))
+        return existentes
+
+    def contar(self, categoria=None):
+        """Número de conceptos guardados"""
+        sql = "SELECT COUNT(*) FROM conceptos"
+        parametros = []
+        if categoria:
+            sql += " WHERE Categoria = ?"
+            parametros.append(categoria)
+        with self._lock:
+            return self._conn.execute(sql, parametros).fetchone()[0]
+
+
+_almacen_global = None
+_almacen_lock = threading.Lock()
+
+
+def almacen_por_defecto():
+    """
+    Almacén compartido del proceso
+
+    Se guarda en CFDI_STORE_DIR (por defecto ./output, el volumen montado en
+    docker-compose) como cfdi_almacen.sqlite.
+    """
+    global _almacen_global
+    with _almacen_lock:
+        if _almacen_global is None:
+            directorio = os.environ.get("CFDI_STORE_DIR", "output")
+            _almacen_global = AlmacenCFDI(
+                os.path.join(directorio, "cfdi_almacen.sqlite")
+            )
+    return _almacen_global
@@ -0,0 +1,596 @@
+"""
+Trabajos en segundo plano con su estado en disco
+
+La ingesta, la generación y fusión de PDFs y las DIOTs en lote corren en un
+pool de hilos del proceso (el trabajo pesado sigue en los pools de procesos
+de cada etapa) en lugar de en el hilo del script de Streamlit. Cada trabajo
+tiene un directorio propio con:
+
+- estado.json: tipo, parámetros, estado, avance, resultado o error;
+- sus entradas (archivos subidos, XMLs o la tabla de conceptos), escritas
+  antes de encolarlo;
+- sus resultados (tabla Parquet, PDFs, ZIP), que se pueden recoger desde
+  cualquier sesión, también después de recargar el navegador.
+
+Los trabajos que quedaron a medias cuando se detuvo el proceso se marcan como
+interrumpidos al abrir la tabla y pueden reintentarse con las mismas
+entradas; con la caché de XMLs, lo ya parseado o renderizado no se repite.
+
+listar() responde de un resumen en memoria (sin las listas de resultados
+ni de parámetros), así que no lee estado.json en cada rerun; los trabajos
+terminados hace más de la retención se borran con sus archivos.
+
+Cada trabajo terminado guarda en resultado["rendimiento"] los tiempos y la
+memoria de sus etapas (cfdi_perfil); con params["perfil_jsonl"] también se
+agregan a ese archivo JSONL.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from cfdi_perfil import Perfil
+
+PENDIENTE = "pendiente"
+CORRIENDO = "corriendo"
+TERMINADO = "terminado"
+ERROR = "error"
+CANCELADO = "cancelado"
+INTERRUMPIDO = "interrumpido"
+FINALES = (TERMINADO, ERROR, CANCELADO, INTERRUMPIDO)
+
+ARCHIVO_ESTADO = "estado.json"
+DIRECTORIO_ENTRADA = "entrada"
+
+
+class TrabajoCancelado(Exception):
+    """Se lanza desde Contexto.avance cuando se pidió cancelar el trabajo"""
+
+
+class Contexto:
+    """
+    Lo que recibe la función de un trabajo: directorio, avance y cancelación
+
+    perfil acumula los tiempos por etapa del trabajo (cfdi_perfil.Perfil).
+    """
+
+    def __init__(self, tabla, id_trabajo, cancelado, titulo=""):
+        self.tabla = tabla
+        self.id = id_trabajo
+        self.directorio = tabla.directorio_de(id_trabajo)
+        self.perfil = Perfil(titulo or id_trabajo)
+        self._cancelado = cancelado
+        self._ultimo = 0.0
+
+    @property
+    def cancelado(self):
+        return self._cancelado.is_set()
+
+    def ruta(self, *partes):
+        return os.path.join(self.directorio, *partes)
+
+    def avance(self, hechos, total, mensaje=""):
+        """
+        Reporta el avance; lanza TrabajoCancelado si se pidió cancelar
+
+        A disco se escribe a lo más dos veces por segundo (y siempre al
+        completar el total).
+        """
+        if self.cancelado:
+            raise TrabajoCancelado()
+        ahora = time.monotonic()
+        if ahora - self._ultimo < 0.5 and hechos < total:
+            return
+        self._ultimo = ahora
+        self.tabla._actualizar(
+            self.id, avance={"hechos": hechos, "total": total, "mensaje": mensaje}
+        )
+
+
+class TablaTrabajos:
+    """Trabajos con estado en disco, ejecutados en un pool de hilos"""
+
+    def __init__(self, directorio, workers=2, retencion=None):
+        self.directorio = directorio
+        # Segundos que se conservan los trabajos terminados (None: siempre)
+        self.retencion = retencion
+        os.makedirs(directorio, exist_ok=True)
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="cfdi_trabajo"
+        )
+        self._lock = threading.Lock()
+        self._estados = {}
+        self._cancelados = {}
+        # (tipo, huella) -> id del último trabajo con esas entradas
+        self._huellas = {}
+        # id -> resumen del estado, lo que usa listar()
+        self._resumenes = {}
+        try:
+            ids = os.listdir(directorio)
+        except OSError:
+            ids = []
+        estados = [self.estado(id_trabajo) for id_trabajo in ids]
+        estados = [estado for estado in estados if estado is not None]
+        # Lo que quedó pendiente o corriendo es de un proceso anterior
+        for estado in sorted(estados, key=lambda estado: estado["creado"]):
+            if estado["estado"] not in FINALES:
+                self._actualizar(estado["id"], estado=INTERRUMPIDO)
+            else:
+                self._resumir(estado)
+            self._indexar(estado)
+        self.purgar()
+
+    def directorio_de(self, id_trabajo):
+        return os.path.join(self.directorio, id_trabajo)
+
+    def ruta(self, id_trabajo, *partes):
+        return os.path.join(self.directorio_de(id_trabajo), *partes)
+
+    def enviar(self, tipo, params=None, titulo="", preparar=None, dueno=None):
+        """
+        Registra y encola un trabajo de TIPOS; retorna su id
+
+        preparar(directorio) se llama antes de encolarlo para escribir sus
+        entradas en disco, así el trabajo puede reintentarse sin la sesión.
+        dueno identifica a quien lo envió, para listar(dueno=...).
+        """
+        if tipo not in TIPOS:
+            raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+        id_trabajo = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        directorio = self.directorio_de(id_trabajo)
+        os.makedirs(os.path.join(directorio, DIRECTORIO_ENTRADA))
+        if preparar is not None:
+            preparar(directorio)
+        estado = {
+            "id": id_trabajo,
+            "tipo": tipo,
+            "titulo": titulo or tipo,
+            "params": params or {},
+            "dueno": dueno,
+            "estado": PENDIENTE,
+            "avance": {"hechos": 0, "total": 0, "mensaje": ""},
+            "resultado": None,
+            "error": None,
+            "creado": time.time(),
+            "actualizado": time.time(),
+        }
+        with self._lock:
+            self._estados[id_trabajo] = estado
+        self._escribir(estado)
+        self._resumir(estado)
+        self._indexar(estado)
+        self._encolar(id_trabajo)
+        self.purgar()
+        return id_trabajo
+
+    def buscar(self, tipo, huella):
+        """
+        Trabajo de tipo con params["huella"] == huella, terminado o en curso
+
+        Permite que una sesión reutilice lo que otra ya hizo (o está haciendo)
+        con las mismas entradas. Retorna su estado, o None.
+        """
+        with self._lock:
+            id_trabajo = self._huellas.get((tipo, huella))
+        if id_trabajo is None:
+            return None
+        estado = self.estado(id_trabajo)
+        if estado is None or estado["estado"] not in (PENDIENTE, CORRIENDO, TERMINADO):
+            return None
+        return estado
+
+    def reintentar(self, id_trabajo):
+        """Vuelve a encolar un trabajo terminado sin éxito, con sus entradas"""
+        estado = self.estado(id_trabajo)
+        if estado is None or estado["estado"] not in (ERROR, CANCELADO, INTERRUMPIDO):
+            return False
+        self._actualizar(
+            id_trabajo,
+            estado=PENDIENTE,
+            error=None,
+            avance={"hechos": 0, "total": 0, "mensaje": ""},
+        )
+        self._encolar(id_trabajo)
+        return True
+
+    def cancelar(self, id_trabajo):
+        """Pide cancelar el trabajo; se detiene en su siguiente avance"""
+        with self._lock:
+            evento = self._cancelados.get(id_trabajo)
+        if evento is not None:
+            evento.set()
+
+    def borrar(self, id_trabajo):
+        """Cancela el trabajo y borra su directorio con entradas y resultados"""
+        self.cancelar(id_trabajo)
+        with self._lock:
+            self._estados.pop(id_trabajo, None)
+            self._resumenes.pop(id_trabajo, None)
+            for clave, id_huella in list(self._huellas.items()):
+                if id_huella == id_trabajo:
+                    del self._huellas[clave]
+        shutil.rmtree(self.directorio_de(id_trabajo), ignore_errors=True)
+
+    def estado(self, id_trabajo):
+        """Copia del estado del trabajo, o None si no existe"""
+        with self._lock:
+            estado = self._estados.get(id_trabajo)
+            if estado is not None:
+                return json.loads(json.dumps(estado))
+        try:
+            with open(self.ruta(id_trabajo, ARCHIVO_ESTADO), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def listar(self, limite=None, dueno=None):
+        """
+        Resúmenes de los trabajos, del más reciente al más antiguo
+
+        Un resumen es el estado sin los valores de lista de params y de
+        resultado (rutas, PDFs, errores, duplicados); para ésos, estado().
+        Con dueno, sólo los trabajos que ese dueño envió.
+        """
+        with self._lock:
+            resumenes = sorted(
+                (
+                    resumen
+                    for resumen in self._resumenes.values()
+                    if dueno is None or resumen.get("dueno") == dueno
+                ),
+                key=lambda resumen: resumen["creado"],
+                reverse=True,
+            )[:limite]
+            return json.loads(json.dumps(resumenes))
+
+    def purgar(self, ahora=None):
+        """Borra los trabajos terminados hace más de retencion segundos"""
+        if self.retencion is None:
+            return []
+        limite = (ahora or time.time()) - self.retencion
+        with self._lock:
+            viejos = [
+                resumen["id"]
+                for resumen in self._resumenes.values()
+                if resumen["estado"] in FINALES and resumen["actualizado"] < limite
+            ]
+        for id_trabajo in viejos:
+            self.borrar(id_trabajo)
+        return viejos
+
+    def _resumir(self, estado):
+        resumen = dict(
+            estado,
+            params=_sin_listas(estado["params"]),
+            resultado=_sin_listas(estado["resultado"]),
+        )
+        with self._lock:
+            self._resumenes[estado["id"]] = resumen
+
+    def _indexar(self, estado):
+        huella = estado["params"].get("huella")
+        if huella is not None:
+            with self._lock:
+                self._huellas[(estado["tipo"], huella)] = estado["id"]
+
+    def _encolar(self, id_trabajo):
+        with self._lock:
+            self._cancelados[id_trabajo] = threading.Event()
+        self._pool.submit(self._ejecutar, id_trabajo)
+
+    def _ejecutar(self, id_trabajo):
+        with self._lock:
+            cancelado = self._cancelados[id_trabajo]
+        estado = self.estado(id_trabajo)
+        if estado is None:
+            return
+        if cancelado.is_set():
+            self._actualizar(id_trabajo, estado=CANCELADO)
+            return
+        self._actualizar(id_trabajo, estado=CORRIENDO)
+        contexto = Contexto(self, id_trabajo, cancelado, estado["titulo"])
+        try:
+            resultado = TIPOS[estado["tipo"]](contexto, **estado["params"])
+        except TrabajoCancelado:
+            self._actualizar(id_trabajo, estado=CANCELADO)
+        except Exception as e:
+            self._actualizar(id_trabajo, estado=ERROR, error=f"{type(e).__name__}: {e}")
+        else:
+            resultado["rendimiento"] = contexto.perfil.a_dict()
+            self._registrar_rendimiento(estado, contexto.perfil)
+            self._actualizar(id_trabajo, estado=TERMINADO, resultado=resultado)
+        finally:
+            with self._lock:
+                self._cancelados.pop(id_trabajo, None)
+
+    def _registrar_rendimiento(self, estado, perfil):
+        ruta = estado["params"].get("perfil_jsonl")
+        if not ruta:
+            return
+        try:
+            perfil.escribir_jsonl(ruta, trabajo=estado["id"], tipo=estado["tipo"])
+        except OSError:
+            # El registro es opcional: no debe tumbar un trabajo terminado
+            pass
+
+    def _actualizar(self, id_trabajo, **cambios):
+        with self._lock:
+            estado = self._estados.get(id_trabajo)
+        if estado is None:
+            estado = self.estado(id_trabajo)
+            if estado is None:
+                return
+        with self._lock:
+            estado.update(cambios, actualizado=time.time())
+            if estado["estado"] in FINALES:
+                # Los terminados se leen de disco; en memoria sólo los activos
+                self._estados.pop(id_trabajo, None)
+            else:
+                self._estados[id_trabajo] = estado
+            copia = json.loads(json.dumps(estado))
+        self._escribir(copia)
+        self._resumir(copia)
+
+    def _escribir(self, estado):
+        # Temporal y reemplazo, para no dejar un estado.json a medias
+        ruta = self.ruta(estado["id"], ARCHIVO_ESTADO)
+        if not os.path.isdir(os.path.dirname(ruta)):
+            return
+        temporal = f"{ruta}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(estado, f, ensure_ascii=False)
+        os.replace(temporal, ruta)
+
+
+def _sin_listas(valores):
+    """Copia de un dict sin sus valores de lista (para los resúmenes)"""
+    if not valores:
+        return valores
+    return {
+        clave: valor for clave, valor in valores.items() if not isinstance(valor, list)
+    }
+
+
+def _cache(usar_cache):
+    if not usar_cache:
+        return None
+    from cfdi_cache import cache_por_defecto
+
+    return cache_por_defecto()
+
+
+def _sin_prefijo(nombre):
+    """Nombre original de un archivo guardado como NNNNNN_nombre"""
+    return nombre.split("_", 1)[-1]
+
+
+def escribir_xmls(xml_list, destino):
+    """
+    Guarda una lista de {"filename", "content"} en un ZIP
+
+    Cada miembro lleva un prefijo numérico, porque dos ZIP del SAT pueden
+    traer archivos con el mismo nombre; leer_xmls lo quita.
+    """
+    with zipfile.ZipFile(destino, "w", compression=zipfile.ZIP_DEFLATED) as salida:
+        for i, xml_info in enumerate(xml_list):
+            salida.writestr(f"{i:06d}_{xml_info['filename']}", xml_info["content"])
+    return destino
+
+
+def leer_xmls(origen):
+    """Lista de {"filename", "content"} de un ZIP escrito con escribir_xmls"""
+    from cfdi_fuentes import iterar_zip
+
+    return [
+        {"filename": _sin_prefijo(nombre), "content": contenido}
+        for nombre, contenido in iterar_zip(origen)
+    ]
+
+
+def leer_entradas(directorio):
+    """
+    (documentos, errores) de los archivos XML y ZIP de directorio
+
+    documentos es una lista de (nombre, xml_bytes) y errores de (archivo,
+    mensaje) para los ZIP que no se pudieron leer.
+    """
+    from cfdi_fuentes import es_zip, iterar_zip, mensaje_error
+
+    documentos, errores = [], []
+    for nombre in sorted(os.listdir(directorio)):
+        ruta = os.path.join(directorio, nombre)
+        # Los archivos subidos se guardan con prefijo numérico, como los XMLs
+        original = _sin_prefijo(nombre)
+        try:
+            if es_zip(original):
+                with open(ruta, "rb") as f:
+                    documentos.extend(iterar_zip(f))
+            else:
+                with open(ruta, "rb") as f:
+                    documentos.append((original, f.read()))
+        except Exception as e:
+            errores.append((original, mensaje_error(e)))
+    return documentos, errores
+
+
+def trabajo_ingesta(contexto, categoria, workers=None, usar_cache=True, lote=500, **_):
+    """
+    Parsea los XML/ZIP de la entrada a conceptos.parquet y xmls.zip
+
+    Si la entrada trae vistos.json (UUIDs ya cargados en la sesión), esos
+    CFDIs se omiten como duplicados igual que en la ingesta directa.
+    """
+    from cfdi_extractor import (
+        TablaConceptos,
+        procesar_lote,
+        separar_duplicados,
+        workers_por_defecto,
+    )
+    from cfdi_parquet import guardar_tabla
+
+    entrada = contexto.ruta(DIRECTORIO_ENTRADA)
+    with contexto.perfil.etapa("lectura"):
+        documentos, errores = leer_entradas(entrada)
+    vistos = {}
+    if os.path.exists(contexto.ruta("vistos.json")):
+        with open(contexto.ruta("vistos.json"), encoding="utf-8") as f:
+            vistos = dict.fromkeys(json.load(f), "sesión")
+    documentos, duplicados = separar_duplicados(documentos, vistos)
+
+    workers = workers or workers_por_defecto()
+    cache = _cache(usar_cache)
+    tabla = TablaConceptos()
+    conceptos = desde_cache = xmls = 0
+    contexto.avance(0, len(documentos), "Procesando XMLs")
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        with zipfile.ZipFile(
+            contexto.ruta("xmls.zip"), "w", compression=zipfile.ZIP_DEFLATED
+        ) as salida:
+            for inicio in range(0, len(documentos), lote):
+                bloque = documentos[inicio : inicio + lote]
+                resultados = procesar_lote(
+                    bloque,
+                    categoria,
+                    workers=workers,
+                    cache=cache,
+                    pool=pool,
+                    perfil=contexto.perfil,
+                )
+                for resultado, (_, xml_content) in zip(resultados, bloque):
+                    if resultado.error:
+                        errores.append((resultado.archivo, resultado.error))
+                        continue
+                    # Mismo formato que escribir_xmls
+                    salida.writestr(f"{xmls:06d}_{resultado.archivo}", xml_content)
+                    xmls += 1
+                    conceptos += len(resultado.filas)
+                    tabla.agregar(resultado.filas)
+                    desde_cache += resultado.desde_cache
+                contexto.avance(
+                    inicio + len(bloque), len(documentos), f"{conceptos} conceptos"
+                )
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    if conceptos:
+        with contexto.perfil.etapa("tabla"):
+            df = tabla.construir()
+        guardar_tabla(df, contexto.ruta("conceptos.parquet"))
+    # Con el resultado en disco, las entradas ya no hacen falta
+    shutil.rmtree(entrada, ignore_errors=True)
+    return {
+        "tabla": "conceptos.parquet" if conceptos else None,
+        "xmls": xmls,
+        "conceptos": conceptos,
+        "desde_cache": desde_cache,
+        "duplicados": duplicados,
+        "errores": errores,
+    }
+
+
+def trabajo_pdfs(contexto, workers=None, usar_cache=True, prefijo="", **_):
+    """Renderiza los XMLs de entrada/xmls.zip a PDFs en el directorio pdfs"""
+    from cfdi_pdf import renderizar_lote
+
+    with contexto.perfil.etapa("lectura"):
+        xml_list = leer_xmls(contexto.ruta(DIRECTORIO_ENTRADA, "xmls.zip"))
+    destino = contexto.ruta("pdfs")
+    os.makedirs(destino, exist_ok=True)
+
+    pdfs, errores = [], []
+    contexto.avance(0, len(xml_list), "Generando PDFs")
+    resultados = renderizar_lote(
+        xml_list,
+        destino,
+        prefijo=prefijo,
+        workers=workers,
+        cache=_cache(usar_cache),
+        perfil=contexto.perfil,
+    )
+    for i, (filename, ruta, error) in enumerate(resultados):
+        if error:
+            errores.append((filename, error))
+        else:
+            pdfs.append({"filename": filename, "path": os.path.abspath(ruta)})
+        contexto.avance(i + 1, len(xml_list), filename)
+    return {"pdfs": pdfs, "errores": errores}
+
+
+def trabajo_fusion(contexto, rutas, nombre, **_):
+    """Fusiona los PDFs de rutas en un solo archivo nombre"""
+    from cfdi_pdf import fusionar_pdfs
+
+    destino = contexto.ruta(nombre)
+    with contexto.perfil.etapa("fusion_pdf"):
+        paginas, errores = fusionar_pdfs(
+            rutas,
+            destino,
+            avance=lambda hechos: contexto.avance(
+                hechos, len(rutas), "Fusionando PDFs"
+            ),
+        )
+    return {
+        "archivo": nombre if paginas else None,
+        "paginas": paginas,
+        "errores": errores,
+    }
+
+
+def trabajo_diot_lote(contexto, frecuencia="M", rfcs=None, workers=None, **_):
+    """DIOTs por RFC y periodo de entrada/conceptos.parquet en DIOTs.zip"""
+    from cfdi_diot import generar_diots
+    from cfdi_parquet import cargar_tabla
+
+    contexto.avance(0, 1, "Agregando proveedores")
+    with contexto.perfil.etapa("lectura"):
+        df = cargar_tabla(contexto.ruta(DIRECTORIO_ENTRADA, "conceptos.parquet"))
+    with contexto.perfil.etapa("diot"):
+        resumen = generar_diots(
+            df, contexto.ruta("DIOTs.zip"), frecuencia, rfcs, workers
+        )
+    contexto.avance(1, 1, f"{len(resumen)} DIOTs")
+    return {
+        "archivo": "DIOTs.zip" if len(resumen) else None,
+        "resumen": resumen.to_dict("records"),
+    }
+
+
+# Funciones de cada tipo: reciben el Contexto y los params del trabajo y
+# regresan un resultado serializable a JSON
+TIPOS = {
+    "ingesta": trabajo_ingesta,
+    "pdfs": trabajo_pdfs,
+    "fusion": trabajo_fusion,
+    "diot_lote": trabajo_diot_lote,
+}
+
+_tabla_global = None
+_tabla_lock = threading.Lock()
+
+
+def trabajos_por_defecto():
+    """
+    Tabla de trabajos compartida del proceso
+
+    Se guarda en CFDI_STORE_DIR/trabajos (por defecto ./output/trabajos),
+    ejecuta a lo más CFDI_JOBS trabajos a la vez (por defecto 2) y borra los
+    terminados hace más de CFDI_JOBS_RETENCION_HORAS horas (por defecto 72).
+    """
+    global _tabla_global
+    with _tabla_lock:
+        if _tabla_global is None:
+            directorio = os.environ.get("CFDI_STORE_DIR", "output")
+            workers = int(os.environ.get("CFDI_JOBS", "2"))
+            horas = float(os.environ.get("CFDI_JOBS_RETENCION_HORAS", "72"))
+            _tabla_global = TablaTrabajos(
+                os.path.join(directorio, "trabajos"),
+                workers=max(1, workers),
+                retencion=horas * 3600,
+            )
+    return _tabla_global
@@ -1,8 +1,11 @@
 """
 Modelos básicos para DIOT (Declaración Informativa de Operaciones con Terceros)
 """
+import io
 from enum import Enum
 
+from cfdi_diot import escribir_txt_diot, tabla_de_proveedores
+
 class Periodo(Enum):
     ENERO = "01"
     FEBRERO = "02"
@@ -51,6 +54,11 @@ class DatosIdentificacion:
         self.periodo = periodo
 
 class ProveedorTercero:
+    # Sin __dict__ por instancia: una DIOT corporativa tiene decenas de miles
+    __slots__ = ("tipo_tercero", "tipo_operacion", "rfc", "id_fiscal", "nombre",
+                 "pais", "nacionalidad", "iva16", "iva16_na", "iva0", "iva_exento",
+                 "iva_rfn", "iva_import16")
+
     def __init__(self, tipo_tercero, tipo_operacion, rfc=None, id_fiscal=None, 
                  nombre=None, pais=None, nacionalidad=None, 
                  iva16=0, iva16_na=0, iva0=0, iva_exento=0, iva_rfn=0, iva_import16=0):
@@ -81,22 +89,12 @@ class DIOT:
     
     def generar_txt(self):
         """Genera el contenido del archivo TXT para DIOT"""
-        lineas = []
-        
-        # Header con datos de identificación
         header = f"DIOT|{self.datos_identificacion.rfc}|{self.datos_identificacion.razon_social}|{self.datos_identificacion.ejercicio}|{self.datos_identificacion.periodo.value}"
-        lineas.append(header)
-        
-        # Líneas de proveedores
-        for proveedor in self.proveedores:
-            linea = f"{proveedor.tipo_tercero.value}|{proveedor.tipo_operacion.value}|"
-            
-            if proveedor.rfc:
-                linea += f"{proveedor.rfc}||||||"
-            else:
-                linea += f"|{proveedor.id_fiscal or ''}|{proveedor.nombre or ''}|{proveedor.pais.value if proveedor.pais else ''}|{proveedor.nacionalidad or ''}||"
-            
-            linea += f"{proveedor.iva16:.2f}|{proveedor.iva16_na:.2f}|{proveedor.iva0:.2f}|{proveedor.iva_exento:.2f}|{proveedor.iva_rfn:.2f}|{proveedor.iva_import16:.2f}"
-            lineas.append(linea)
-        
-        return "\n".join(lineas)
+
+        # Líneas de proveedores, escritas en bloque desde una tabla columnar
+        salida = io.StringIO()
+        escribir_txt_diot(tabla_de_proveedores(self.proveedores), salida,
+                          encabezado=[header], tipos=(TipoTercero, TipoOperacion),
+                          montos=["iva16", "iva16_na", "iva0", "iva_exento",
+                                  "iva_rfn", "iva_import16"])
+        return salida.getvalue().rstrip("\n")
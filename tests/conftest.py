@@ -0,0 +1,23 @@
+"""Los módulos del proyecto están en la raíz del repositorio"""
+
+import io
+import os
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def zip_cifrado(miembros):
+    """Bytes de un ZIP cuyos miembros {nombre: bytes} están marcados como cifrados"""
+    salida = io.BytesIO()
+    with zipfile.ZipFile(salida, "w") as archivo_zip:
+        for nombre, contenido in miembros.items():
+            archivo_zip.writestr(nombre, contenido)
+    datos = bytearray(salida.getvalue())
+    # Bit 0 de las banderas de cada entrada del directorio central
+    inicio = datos.find(b"PK\x01\x02")
+    while inicio >= 0:
+        datos[inicio + 8] |= 0x1
+        inicio = datos.find(b"PK\x01\x02", inicio + 4)
+    return bytes(datos)
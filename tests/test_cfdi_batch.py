@@ -0,0 +1,67 @@
+"""Corrida completa del comando por lotes sobre un directorio pequeño"""
+
+import json
+import zipfile
+
+import pandas as pd
+
+import cfdi_batch
+
+UUID_A = "11111111-1111-1111-1111-111111111111"
+UUID_B = "22222222-2222-2222-2222-222222222222"
+
+
+def cfdi(uuid, importes):
+    conceptos = "".join(
+        f'<cfdi:Concepto ClaveProdServ="80111600" Cantidad="1" ClaveUnidad="E48" '
+        f'Descripcion="Servicio" ValorUnitario="{importe}" Importe="{importe}" '
+        f'ObjetoImp="01"/>'
+        for importe in importes
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<cfdi:Comprobante xmlns:cfdi="http://www.sat.gob.mx/cfd/4" '
+        'xmlns:tfd="http://www.sat.gob.mx/TimbreFiscalDigital" Version="4.0" '
+        f'Fecha="2025-03-10T10:00:00" SubTotal="{sum(importes)}" Moneda="MXN" '
+        f'Total="{sum(importes)}" TipoDeComprobante="I" Exportacion="01" '
+        'LugarExpedicion="01000" Sello="x" NoCertificado="30001000000400002434" '
+        'Certificado="x">'
+        '<cfdi:Emisor Rfc="AAA010101AAA" Nombre="EMISOR" RegimenFiscal="601"/>'
+        '<cfdi:Receptor Rfc="BBB010101BBB" Nombre="RECEPTOR" UsoCFDI="G03" '
+        'DomicilioFiscalReceptor="01000" RegimenFiscalReceptor="601"/>'
+        f"<cfdi:Conceptos>{conceptos}</cfdi:Conceptos>"
+        "<cfdi:Complemento>"
+        f'<tfd:TimbreFiscalDigital Version="1.1" UUID="{uuid}" '
+        'FechaTimbrado="2025-03-10T10:00:01" RfcProvCertif="SAT970701NN3" '
+        'SelloCFD="x" NoCertificadoSAT="30001000000400002495" SelloSAT="x"/>'
+        "</cfdi:Complemento></cfdi:Comprobante>"
+    ).encode()
+
+
+def test_corrida_a_csv(tmp_path, capsys):
+    entrada = tmp_path / "entrada"
+    entrada.mkdir()
+    with zipfile.ZipFile(entrada / "descarga.zip", "w") as archivo_zip:
+        archivo_zip.writestr("a.xml", cfdi(UUID_A, [100, 50]))
+        archivo_zip.writestr("b.xml", cfdi(UUID_B, [30]))
+    # El mismo CFDI suelto y dentro de la descarga, y un XML roto
+    (entrada / "c.xml").write_bytes(cfdi(UUID_A, [100, 50]))
+    (entrada / "d.xml").write_bytes(b"<roto")
+    salida = tmp_path / "conceptos.csv"
+
+    codigo = cfdi_batch.main(
+        [str(entrada), "-o", str(salida), "--workers", "1", "--lote", "2"]
+        + ["--categoria", "Recibidos", "--progreso", "json"]
+    )
+
+    eventos = [json.loads(linea) for linea in capsys.readouterr().out.splitlines()]
+    fin = eventos[-1]
+    assert codigo == 1
+    assert fin["evento"] == "fin"
+    assert (fin["archivos"], fin["conceptos"], fin["errores"]) == (3, 3, 1)
+    assert [e["archivo"] for e in eventos if e["evento"] == "duplicado"] == ["a.xml"]
+    assert [e["archivo"] for e in eventos if e["evento"] == "error"] == ["d.xml"]
+    df = pd.read_csv(salida, encoding="utf-8-sig")
+    assert sorted(df["UUID"]) == [UUID_A, UUID_A, UUID_B]
+    assert set(df["Categoria"]) == {"Recibidos"}
+    assert df["Monto_Concepto"].sum() == 180
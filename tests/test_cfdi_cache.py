@@ -0,0 +1,81 @@
+"""Caché de filas extraídas: aciertos, versión y desalojo LRU"""
+
+import itertools
+import threading
+
+import pytest
+
+import cfdi_cache
+from cfdi_cache import CacheCFDI, hash_xml, reetiquetar
+
+FILA = ("a.xml", "uuid-1", "F1", "Recibidos")
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    """time.time() que avanza un segundo en cada llamada"""
+    tiempos = itertools.count(1_000_000)
+    monkeypatch.setattr(cfdi_cache.time, "time", lambda: float(next(tiempos)))
+
+
+def test_guardar_y_obtener_filas(tmp_path):
+    cache = CacheCFDI(str(tmp_path / "c.sqlite"))
+    cache.guardar_filas("h1", [FILA])
+
+    assert cache.obtener_filas(["h1", "h2", "h1"]) == {"h1": [FILA]}
+    assert cache.obtener_pdf("h1") is None
+    cache.guardar_pdf("h1", b"%PDF")
+    assert cache.obtener_pdf("h1") == b"%PDF"
+    assert cache.obtener_filas(["h1"]) == {"h1": [FILA]}
+
+
+def test_otra_version_descarta_las_entradas(tmp_path):
+    ruta = str(tmp_path / "c.sqlite")
+    CacheCFDI(ruta, version="1").guardar_filas("h1", [FILA])
+
+    assert CacheCFDI(ruta, version="1").obtener_filas(["h1"]) == {"h1": [FILA]}
+    nueva = CacheCFDI(ruta, version="2")
+    assert nueva.obtener_filas(["h1"]) == {}
+    assert nueva.tamano_total() == 0
+
+
+def test_desalojo_borra_las_menos_usadas(tmp_path, reloj):
+    filas = [FILA * 20]
+    tamano = len(cfdi_cache.pickle.dumps(filas, cfdi_cache.pickle.HIGHEST_PROTOCOL))
+    cache = CacheCFDI(str(tmp_path / "c.sqlite"), max_bytes=tamano * 3)
+    for hash_ in ("h1", "h2", "h3"):
+        cache.guardar_filas(hash_, filas)
+    # h1 se vuelve la más reciente; h2 es ahora la menos usada
+    cache.obtener_filas(["h1"])
+
+    cache.guardar_filas("h4", filas)
+
+    # Se libera hasta el 90% del límite: salen h2 y h3, las menos usadas
+    assert set(cache.obtener_filas(["h1", "h2", "h3", "h4"])) == {"h1", "h4"}
+    assert cache.tamano_total() <= cache.max_bytes
+
+
+def test_reetiquetar_cambia_archivo_y_categoria():
+    (fila,) = reetiquetar(
+        [tuple(range(len(cfdi_cache.COLUMNAS)))], "otro.xml", "Emitidos"
+    )
+
+    assert fila[cfdi_cache._IDX_ARCHIVO] == "otro.xml"
+    assert fila[cfdi_cache._IDX_CATEGORIA] == "Emitidos"
+    assert hash_xml("<a/>") == hash_xml(b"<a/>")
+
+
+def test_cache_por_defecto_es_unica_entre_hilos(tmp_path, monkeypatch):
+    monkeypatch.setenv("CFDI_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(cfdi_cache, "_cache_global", None)
+    caches = []
+    hilos = [
+        threading.Thread(target=lambda: caches.append(cfdi_cache.cache_por_defecto()))
+        for _ in range(8)
+    ]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert len({id(cache) for cache in caches}) == 1
@@ -0,0 +1,95 @@
+"""Cubo pre-agregado: sumas por celda y adición incremental"""
+
+import pandas as pd
+import pytest
+
+from cfdi_cubo import CLAVES_CUBO, CuboConceptos
+
+
+def conceptos(*filas):
+    """Conceptos a partir de filas (UUID, Emisor_RFC, Fecha, Deducible, Monto)"""
+    df = pd.DataFrame(
+        filas, columns=["UUID", "Emisor_RFC", "Fecha", "Deducible", "Monto"]
+    )
+    df = df.assign(
+        Fecha=pd.to_datetime(df["Fecha"]),
+        Emisor_Nombre="Emisor " + df["Emisor_RFC"],
+        Receptor_RFC="REC010101AAA",
+        Receptor_Nombre="Receptor",
+        Categoria="Recibidos",
+        Tipo_Comprobante="I",
+        SubTotal_CFDI=df["Monto"],
+        Total_CFDI=df["Monto"] * 1.16,
+        Monto_Concepto=df["Monto"],
+        Ingresos_Subtotal=df["Monto"],
+        Ingresos_IVA=df["Monto"] * 0.16,
+        Egresos_Subtotal=0.0,
+        Egresos_IVA=0.0,
+    )
+    return df.drop(columns="Monto")
+
+
+# Dos conceptos de u1 el mismo día; u4 no tiene fecha
+TABLA = conceptos(
+    ("u1", "A", "2025-01-05 10:00", True, 100.0),
+    ("u1", "A", "2025-01-05 10:00", True, 50.0),
+    ("u2", "B", "2025-01-20 08:00", False, 200.0),
+    ("u3", "A", "2025-02-03 12:00", False, 400.0),
+    ("u4", "B", None, True, 1000.0),
+)
+
+
+def celdas_ordenadas(cubo):
+    celdas = cubo.celdas.astype({c: str for c in CLAVES_CUBO if c != "Dia"})
+    return celdas.sort_values(CLAVES_CUBO).reset_index(drop=True)
+
+
+def test_totales():
+    cubo = CuboConceptos(TABLA)
+
+    assert len(cubo.celdas) == 4
+    totales = cubo.totales()
+    assert (totales["Conceptos"], totales["CFDIs"]) == (5, 4)
+    assert totales["Monto_Concepto"] == 1750.0
+    assert totales["Total_CFDI"] == pytest.approx(2030.0)
+
+
+def test_filtros():
+    cubo = CuboConceptos(TABLA)
+
+    # hasta incluye el día completo; con fechas se omiten las celdas sin Dia
+    totales = cubo.totales(emisores=["A"], desde="2025-01-05", hasta="2025-01-05")
+    assert (totales["Conceptos"], totales["Monto_Concepto"]) == (2, 150.0)
+    totales = cubo.totales(deducible=True)
+    assert (totales["CFDIs"], totales["Monto_Concepto"]) == (2, 1150.0)
+    assert cubo.totales(hasta="2025-12-31")["Monto_Concepto"] == 750.0
+
+
+def test_agregar_equivale_a_reconstruir():
+    cubo = CuboConceptos(TABLA.iloc[:3])
+    cubo = cubo.agregar(TABLA.iloc[3:])
+    completo = CuboConceptos(TABLA)
+
+    pd.testing.assert_frame_equal(
+        celdas_ordenadas(cubo), celdas_ordenadas(completo), check_dtype=False
+    )
+    assert cubo.etiquetas == completo.etiquetas
+    assert cubo.etiquetas["Emisor_RFC"] == {"A - Emisor A", "B - Emisor B"}
+
+
+def test_agregar_no_modifica_el_cubo_original():
+    cubo = CuboConceptos(TABLA.iloc[:3])
+    antes = cubo.celdas.copy()
+
+    nuevo = cubo.agregar(TABLA.iloc[3:])
+
+    assert nuevo is not cubo
+    pd.testing.assert_frame_equal(cubo.celdas, antes)
+    assert cubo.agregar(TABLA.iloc[:0]) is cubo
+
+
+def test_serie_mensual():
+    serie = CuboConceptos(TABLA).serie("Monto_Concepto", "M", por="Categoria")
+
+    assert serie["Periodo"].tolist() == ["2025-01", "2025-02"]
+    assert serie["Monto_Concepto"].tolist() == [350.0, 400.0]
@@ -0,0 +1,54 @@
+"""Reglas de deducibilidad por RFC"""
+
+import pandas as pd
+
+from cfdi_deducibilidad import ReglasDeducibilidad, ReglasPorRFC, etiquetar
+
+RECEPTOR = "REC010101AAA"
+
+
+def conceptos():
+    return pd.DataFrame(
+        {
+            "Categoria": ["Recibidos", "Recibidos", "Recibidos", "Emitidos"],
+            "Emisor_RFC": ["AAA010101AAA", "BBB010101BBB", "AAA010101AAA", RECEPTOR],
+            "Receptor_RFC": [RECEPTOR, RECEPTOR, "OTRO010101AAA", "CLI010101AAA"],
+            "Clave_ProdServ": ["43211500", "80131500", "43211500", "80131500"],
+            "Deducible": [False, False, True, False],
+        }
+    ).astype({"Emisor_RFC": "category", "Clave_ProdServ": "category"})
+
+
+def test_claves_prefijos_y_excepciones():
+    reglas = ReglasDeducibilidad(
+        claves=["43211500"], prefijos=["8013"], emisores={"BBB010101BBB": False}
+    )
+
+    df = etiquetar(conceptos(), {RECEPTOR: reglas})
+
+    # La fila 2 es de otro receptor y la 3 la emitió el contribuyente
+    assert df["Deducible"].tolist() == [True, False, True, True]
+
+
+def test_reglas_vacias_quitan_la_deducibilidad():
+    df = etiquetar(conceptos(), {RECEPTOR: ReglasDeducibilidad(claves=["43211500"])})
+
+    limpia = etiquetar(df, {RECEPTOR: ReglasDeducibilidad()})
+
+    assert df["Deducible"].tolist() == [True, False, True, False]
+    assert limpia["Deducible"].tolist() == [False, False, True, False]
+    assert etiquetar(df, {}) is df
+
+
+def test_reglas_por_rfc_en_json(tmp_path):
+    ruta = str(tmp_path / "reglas.json")
+    reglas = ReglasDeducibilidad(["43211500"], ["8013 ", ""], {"BBB010101BBB": True})
+    ReglasPorRFC(ruta).guardar(RECEPTOR, reglas)
+
+    assert ReglasPorRFC(ruta).obtener(RECEPTOR).a_dict() == {
+        "claves": ["43211500"],
+        "prefijos": ["8013"],
+        "emisores": {"BBB010101BBB": True},
+    }
+    ReglasPorRFC(ruta).guardar(RECEPTOR, ReglasDeducibilidad())
+    assert ReglasPorRFC(ruta).reglas == {}
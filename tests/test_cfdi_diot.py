@@ -0,0 +1,181 @@
+"""Agregación de proveedores y TXT de la DIOT"""
+
+import io
+
+import pandas as pd
+import pytest
+
+from cfdi_diot import (
+    RFC_EXTRANJERO,
+    agregar_proveedores,
+    escribir_txt_diot,
+    generar_diot,
+    tabla_de_proveedores,
+)
+
+RECEPTOR = "REC010101AAA"
+
+
+def concepto(uuid, emisor, tipo="I", base=0.0, iva=0.0, **otros):
+    fila = {
+        "UUID": uuid,
+        "Fecha": pd.Timestamp("2025-03-15"),
+        "Tipo_Comprobante": tipo,
+        "Emisor_RFC": emisor,
+        "Emisor_Nombre": f"Proveedor {emisor}",
+        "Receptor_RFC": RECEPTOR,
+        "Receptor_Nombre": "Receptor",
+        "Clave_ProdServ": "43211500",
+        "Ingresos_Subtotal": base,
+        "Ingresos_IVA": iva,
+        "Ingresos_Retencion_IVA": 0.0,
+        "Ingresos_Retencion_ISR": 0.0,
+        "Egresos_IVA": 0.0,
+    }
+    fila.update(otros)
+    return fila
+
+
+@pytest.fixture
+def conceptos():
+    return pd.DataFrame(
+        [
+            concepto("u1", "AAA010101AAA", base=100.0, iva=16.0),
+            concepto("u1", "AAA010101AAA", base=50.0, iva=8.0),
+            concepto("u2", "BBB010101BBB", base=200.0, iva=16.0),
+            concepto("u3", "CCC010101CCC", base=300.0),
+            concepto("u4", "DDD010101DDD", base=1000.0, iva=160.0),
+            concepto(
+                "u4",
+                "DDD010101DDD",
+                base=500.0,
+                Clave_ProdServ="80131500",
+                Ingresos_Retencion_IVA=53.33,
+            ),
+            concepto("u5", "AAA010101AAA", tipo="E", Egresos_IVA=4.0),
+            concepto("u6", RFC_EXTRANJERO, base=400.0, iva=64.0),
+            concepto("u7", "EEE010101EEE", iva=16.0),
+        ]
+    )
+
+
+def por_rfc(tabla):
+    return {fila.rfc: fila for fila in tabla.itertuples()}
+
+
+def test_agregar_proveedores_asigna_las_tasas(conceptos):
+    tabla = por_rfc(agregar_proveedores(conceptos))
+
+    assert tabla["AAA010101AAA"].iva16 == 150.0
+    assert tabla["AAA010101AAA"].num_cfdis == 2
+    assert tabla["BBB010101BBB"].iva_rfn == 200.0
+    assert tabla["BBB010101BBB"].iva16 == 0.0
+    assert tabla["CCC010101CCC"].iva0 == 300.0
+
+
+def test_agregar_proveedores_separa_operaciones_y_devoluciones(conceptos):
+    tabla = agregar_proveedores(conceptos)
+    ddd = tabla[tabla["rfc"] == "DDD010101DDD"].set_index("tipo_operacion")
+
+    assert ddd.loc["OTROS", "iva16"] == 1000.0
+    assert ddd.loc["ARRENDAMIENTO_DE_INMUEBLES", "iva0"] == 500.0
+    assert ddd.loc["ARRENDAMIENTO_DE_INMUEBLES", "retenido"] == 53.33
+    egreso = tabla[(tabla["rfc"] == "AAA010101AAA") & (tabla["devoluciones"] > 0)]
+    assert egreso["devoluciones"].tolist() == [4.0]
+
+
+def test_iva_sin_base_se_reporta_sin_clasificar(conceptos):
+    tabla = por_rfc(agregar_proveedores(conceptos))
+
+    fila = tabla["EEE010101EEE"]
+    assert fila.iva_sin_clasificar == 16.0
+    assert fila.iva16 == fila.iva_rfn == fila.iva0 == 0.0
+    assert tabla["AAA010101AAA"].iva_sin_clasificar == 0.0
+
+
+def test_agregar_proveedores_filtra_rfc_y_periodo(conceptos):
+    assert agregar_proveedores(conceptos, rfc="OTRO010101AAA").empty
+    assert agregar_proveedores(conceptos, periodo="2025-04").empty
+    assert len(agregar_proveedores(conceptos, RECEPTOR, "2025-Q1")) == len(
+        agregar_proveedores(conceptos)
+    )
+
+
+def test_extranjero_va_sin_rfc_y_con_identificacion():
+    tabla = tabla_de_proveedores(
+        [
+            {
+                "tipo_tercero_enum": "PROVEEDOR_EXTRANJERO",
+                "tipo_operacion_enum": "OTROS",
+                "rfc": RFC_EXTRANJERO,
+                "id_fiscal": "TAX123",
+                "nombre_extranjero": "Foreign Inc",
+                "pais_enum": "US",
+                "nacionalidad": "Estadounidense",
+                "iva16": 400.0,
+            },
+            {
+                "tipo_tercero_enum": "PROVEEDOR_NACIONAL",
+                "tipo_operacion_enum": "OTROS",
+                "rfc": "AAA010101AAA",
+                "id_fiscal": "no debe salir",
+                "iva16": 100.0,
+            },
+        ]
+    )
+
+    extranjero, nacional = tabla.to_dict("records")
+    assert extranjero["rfc"] == ""
+    assert extranjero["id_fiscal"] == "TAX123"
+    assert extranjero["nombre_extranjero"] == "Foreign Inc"
+    assert extranjero["nacionalidad"] == "Estadounidense"
+    assert nacional["rfc"] == "AAA010101AAA"
+    assert nacional["id_fiscal"] == ""
+
+
+def test_escribir_txt_diot():
+    tabla = tabla_de_proveedores(
+        [
+            {
+                "tipo_tercero_enum": "PROVEEDOR_NACIONAL",
+                "tipo_operacion_enum": "OTROS",
+                "rfc": "AAA010101AAA",
+                "iva16": 1234.5,
+                "retenido": 10,
+            },
+            {
+                "tipo_tercero_enum": "PROVEEDOR_EXTRANJERO",
+                "tipo_operacion_enum": "OTROS",
+                "id_fiscal": "TAX|123",
+                "nombre_extranjero": "Foreign\nInc",
+                "iva0": 5,
+            },
+        ]
+    )
+    salida = io.StringIO()
+
+    escritos = escribir_txt_diot(tabla, salida, encabezado=["DIOT|X"])
+
+    assert escritos == 2
+    assert salida.getvalue().splitlines() == [
+        "DIOT|X",
+        "PROVEEDOR_NACIONAL|OTROS|AAA010101AAA|||||"
+        "|1234.50|0.00|0.00|0.00|0.00|10.00|0.00",
+        "PROVEEDOR_EXTRANJERO|OTROS||TAX 123|Foreign Inc|||"
+        "|0.00|0.00|5.00|0.00|0.00|0.00|0.00",
+    ]
+
+
+def test_generar_diot_declara_extranjeros_sin_rfc_generico(conceptos):
+    tabla = agregar_proveedores(conceptos)
+
+    _, texto, proveedores = generar_diot(
+        RECEPTOR, pd.Period("2025-03"), "Receptor", tabla
+    )
+
+    assert proveedores == len(tabla)
+    lineas = [linea.split("|") for linea in texto.splitlines()[2:]]
+    assert RFC_EXTRANJERO not in [campos[2] for campos in lineas]
+    extranjeros = [campos for campos in lineas if campos[2] == ""]
+    assert len(extranjeros) == 1
+    assert extranjeros[0][4] == f"Proveedor {RFC_EXTRANJERO}"
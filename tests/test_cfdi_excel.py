@@ -0,0 +1,51 @@
+"""Excel de la app escrito en flujo con xlsxwriter y leído de vuelta"""
+
+import pandas as pd
+
+import cfdi_excel
+from cfdi_excel import escribir_excel, hojas_resumen
+
+MONTOS = [
+    "Monto_Concepto",
+    "Ingresos_Subtotal",
+    "Ingresos_IVA",
+    "Ingresos_Retencion_IVA",
+    "Ingresos_Retencion_ISR",
+    "Egresos_Subtotal",
+    "Egresos_IVA",
+    "Egresos_Total",
+]
+
+
+def test_hojas_se_leen_de_vuelta(tmp_path, monkeypatch):
+    # Bloques de 2 filas: el detalle cruza varios bloques
+    monkeypatch.setattr(cfdi_excel, "FILAS_POR_BLOQUE", 2)
+    df = pd.DataFrame(
+        {
+            "UUID": ["A", "A", "B", "C", "D"],
+            "Fecha": pd.to_datetime(
+                ["2025-01-05", "2025-01-05", "2025-02-10", None, "2025-02-11"]
+            ),
+            "Mes": pd.Categorical(["2025-01", "2025-01", "2025-02", None, "2025-02"]),
+            "Descripcion": ["uno", None, "=1+1", "tres", "cuatro"],
+            **{monto: [1.5, 2.0, 3.0, 4.0, 5.0] for monto in MONTOS},
+        }
+    )
+    ruta = tmp_path / "cfdis.xlsx"
+
+    escribir_excel(hojas_resumen(df, "Recibidos"), ruta)
+
+    hojas = pd.read_excel(ruta, sheet_name=None)
+    assert list(hojas) == ["Detalle_Recibidos", "Resumen_Mensual", "Totales_Generales"]
+    detalle = hojas["Detalle_Recibidos"]
+    assert list(detalle.columns) == list(df.columns)
+    assert len(detalle) == 5
+    assert detalle["Fecha"].isna().tolist() == [False, False, False, True, False]
+    assert detalle["Descripcion"].iloc[2] == "=1+1"
+    mensual = hojas["Resumen_Mensual"]
+    assert list(mensual.columns) == ["Mes"] + MONTOS + ["Num_CFDIs"]
+    assert mensual["Num_CFDIs"].tolist() == [2, 2]
+    totales = hojas["Totales_Generales"]
+    assert len(totales) == 1
+    assert totales["Num_CFDIs_Unicos"].iloc[0] == 4
+    assert totales["Monto_Total"].iloc[0] == 15.5
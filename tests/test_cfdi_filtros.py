@@ -0,0 +1,67 @@
+"""Índice de filtros: selecciones, rangos y su combinación"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cfdi_filtros import IndiceFiltros
+
+TABLA = pd.DataFrame(
+    {
+        "Receptor_RFC": ["R1", "R2", "R1", "R1", "R2"],
+        "Emisor_RFC": ["A", "B", "B", "A", "C"],
+        "Tipo_Comprobante": ["I", "E", "I", "I", "I"],
+        # Fechas y montos faltantes nunca cumplen un rango
+        "Fecha": pd.to_datetime(
+            [
+                "2025-01-05 10:00",
+                "2025-02-28 23:59",
+                None,
+                "2025-03-01 00:00",
+                "2025-02-01 00:00",
+            ]
+        ),
+        "Monto_Concepto": [100.0, 500.0, 50.0, np.nan, 1000.0],
+        "Deducible": [True, False, True, False, True],
+    }
+).astype({"Receptor_RFC": "category", "Emisor_RFC": "category"})
+
+
+@pytest.mark.parametrize(
+    "filtros, esperado",
+    [
+        ({"receptores": ["R1"]}, [0, 2, 3]),
+        ({"emisores": ["A", "B"], "tipos": ["I"]}, [0, 2, 3]),
+        # hasta incluye el día completo
+        ({"desde": "2025-02-01", "hasta": "2025-02-28"}, [1, 4]),
+        ({"desde": "2025-02-01"}, [1, 3, 4]),
+        ({"monto_minimo": 100}, [0, 1, 4]),
+        ({"monto_minimo": 100, "hasta": "2025-02-28", "deducible": True}, [0, 4]),
+        ({"deducible": False}, [1, 3]),
+        ({"emisores": ["ZZZ"]}, []),
+    ],
+)
+def test_posiciones_y_filtrar(filtros, esperado):
+    indice = IndiceFiltros(TABLA)
+
+    assert indice.posiciones(**filtros).tolist() == esperado
+    pd.testing.assert_frame_equal(
+        indice.filtrar(TABLA, **filtros), TABLA.iloc[esperado]
+    )
+
+
+def test_sin_filtros_regresa_la_tabla():
+    indice = IndiceFiltros(TABLA)
+
+    assert indice.posiciones() is None
+    assert indice.filtrar(TABLA) is TABLA
+
+
+def test_opciones_y_rango():
+    indice = IndiceFiltros(TABLA)
+
+    assert indice.opciones["Emisor_RFC"] == ["A", "B", "C"]
+    assert indice.rango_fechas() == (
+        pd.Timestamp("2025-01-05 10:00"),
+        pd.Timestamp("2025-03-01"),
+    )
@@ -0,0 +1,31 @@
+"""Lectura de XMLs sueltos, directorios y ZIPs"""
+
+import zipfile
+
+from cfdi_fuentes import iterar_rutas, iterar_zip
+from conftest import zip_cifrado
+
+
+def test_zip_con_carpetas_anidadas(tmp_path):
+    ruta = tmp_path / "sat.zip"
+    with zipfile.ZipFile(ruta, "w") as archivo_zip:
+        archivo_zip.writestr("a.xml", b"<a/>")
+        archivo_zip.writestr("2024/01/b.XML", b"<b/>")
+        archivo_zip.writestr("2024/leeme.txt", b"")
+        archivo_zip.writestr("__MACOSX/2024/01/._b.XML", b"")
+
+    assert list(iterar_zip(str(ruta))) == [("a.xml", b"<a/>"), ("b.XML", b"<b/>")]
+
+
+def test_zip_ilegible_se_registra_y_se_sigue(tmp_path):
+    (tmp_path / "a.xml").write_bytes(b"<a/>")
+    (tmp_path / "b_cifrado.zip").write_bytes(zip_cifrado({"x.xml": b"<x/>"}))
+    (tmp_path / "c.xml").write_bytes(b"<c/>")
+    errores = []
+
+    documentos = list(iterar_rutas([str(tmp_path)], errores))
+
+    assert documentos == [("a.xml", b"<a/>"), ("c.xml", b"<c/>")]
+    assert [(nombre, "encrypted" in mensaje) for nombre, mensaje in errores] == [
+        ("b_cifrado.zip", True)
+    ]
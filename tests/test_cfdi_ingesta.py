@@ -0,0 +1,24 @@
+"""Ingesta continua: un archivo ilegible no detiene la ingesta"""
+
+import io
+
+from cfdi_ingesta import IngestaContinua
+from conftest import zip_cifrado
+
+
+def test_zip_cifrado_se_reporta_y_la_ingesta_termina():
+    ingesta = IngestaContinua("Recibidos", workers=1)
+    ingesta.enviar("cifrado.zip", io.BytesIO(zip_cifrado({"a.xml": b"<a/>"})))
+    ingesta.enviar("no_es_zip.zip", io.BytesIO(b"basura"))
+    ingesta.enviar("b.xml", b"<no es un cfdi/>")
+    ingesta.cerrar()
+
+    assert ingesta.esperar(timeout=10)
+    errores = [e for parte in ingesta.recoger() for e in parte.errores]
+    assert [archivo for archivo, _ in errores] == [
+        "cifrado.zip",
+        "no_es_zip.zip",
+        "b.xml",
+    ]
+    assert "encrypted" in errores[0][1]
+    assert ingesta.resumen()["errores"] == 3
@@ -0,0 +1,38 @@
+"""Caché en memoria compartida: presupuesto de bytes y desalojo LRU"""
+
+from cfdi_memoria import CacheMemoria
+
+
+def test_desaloja_lo_usado_hace_mas_tiempo():
+    cache = CacheMemoria(max_bytes=100)
+    for clave in "abc":
+        cache.guardar(clave, clave.upper(), tamano=30)
+    # Usar "a" la vuelve la más reciente: el orden LRU queda b, c, a
+    assert cache.obtener("a") == "A"
+
+    cache.guardar("d", "D", tamano=30)
+    presentes = [clave for clave in "abcd" if clave in cache]
+    assert presentes == ["a", "c", "d"]
+
+    cache.guardar("e", "E", tamano=40)
+    presentes = [clave for clave in "abcde" if clave in cache]
+    assert presentes == ["a", "d", "e"]
+    assert cache.resumen()["bytes"] == 100
+
+
+def test_reemplazo_y_valor_mas_grande_que_el_presupuesto():
+    cache = CacheMemoria(max_bytes=100)
+    cache.guardar("a", "A", tamano=60)
+
+    assert cache.guardar("a", "A2", tamano=30)
+    assert not cache.guardar("b", "B", tamano=101)
+
+    assert cache.obtener("a") == "A2"
+    assert cache.obtener("b") is None
+    assert cache.resumen() == {
+        "entradas": 1,
+        "bytes": 30,
+        "max_bytes": 100,
+        "aciertos": 1,
+        "fallos": 1,
+    }
@@ -0,0 +1,61 @@
+"""Guardado y carga de la tabla de conceptos"""
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from cfdi_extractor import COLUMNAS, COLUMNAS_MONTOS, aplicar_tipos
+from cfdi_parquet import _CLAVE_VERSION, cargar_tabla, con_version, guardar_tabla
+
+
+def conceptos():
+    """Dos conceptos tipados, el segundo sin fecha"""
+    df = pd.DataFrame(
+        {c: [0.0, 0.0] if c in COLUMNAS_MONTOS else ["", ""] for c in COLUMNAS}
+    )
+    return aplicar_tipos(
+        df.assign(
+            UUID=["u1", "u2"],
+            Fecha=pd.to_datetime(["2025-03-01 10:30", None]),
+            Mes=["2025-03", None],
+            Emisor_RFC=["AAA010101AAA", "BBB010101BBB"],
+            Monto_Concepto=[100.5, 20.0],
+            Deducible=[True, False],
+        )
+    )
+
+
+@pytest.mark.parametrize("formato", ["parquet", "arrow"])
+def test_guardar_y_cargar_conserva_la_tabla(tmp_path, formato):
+    df = conceptos()
+    ruta = guardar_tabla(df, tmp_path / f"conceptos.{formato}", formato)
+
+    cargada = cargar_tabla(ruta, formato)
+
+    pd.testing.assert_frame_equal(cargada, df)
+
+
+def test_cargar_rechaza_otra_version(tmp_path):
+    ruta = guardar_tabla(conceptos(), tmp_path / "conceptos.parquet")
+    tabla = pq.read_table(ruta)
+    metadatos = {**tabla.schema.metadata, _CLAVE_VERSION: b"0"}
+    pq.write_table(tabla.replace_schema_metadata(metadatos), ruta)
+
+    with pytest.raises(ValueError, match="versión de extracción 0"):
+        cargar_tabla(ruta)
+
+
+def test_cargar_acepta_archivos_sin_version(tmp_path):
+    ruta = tmp_path / "externo.parquet"
+    conceptos().to_parquet(ruta, index=False)
+
+    assert len(cargar_tabla(ruta)) == 2
+
+
+def test_cargar_rechaza_otra_tabla(tmp_path):
+    ruta = tmp_path / "otra.parquet"
+    pq.write_table(con_version(pa.table({"a": [1]})), ruta)
+
+    with pytest.raises(ValueError, match="No es una tabla de conceptos"):
+        cargar_tabla(ruta)
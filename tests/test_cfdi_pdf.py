@@ -0,0 +1,71 @@
+"""Fusión incremental de PDFs"""
+
+from PyPDF2 import PdfReader
+
+from cfdi_pdf import fusionar_pdfs
+
+
+def pdf_minimo(tmp_path, nombre, lados, contenido=None):
+    """PDF escrito a mano, una página por lado; contenido va en la última"""
+    objetos = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = b" ".join(b"%d 0 R" % (3 + i) for i in range(len(lados)))
+    objetos.append(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(lados)))
+    for lado in lados:
+        objetos.append(b"<< /Type /Page /MediaBox [0 0 %d %d] >>" % (lado, lado))
+    if contenido is not None:
+        ultima = objetos[-1][:-2] + b"/Contents %d 0 R >>" % (len(objetos) + 1)
+        objetos[-1] = ultima
+        objetos.append(contenido)
+
+    datos = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for num, cuerpo in enumerate(objetos, 1):
+        offsets.append(len(datos))
+        datos += b"%d 0 obj\n%s\nendobj\n" % (num, cuerpo)
+    inicio_xref = len(datos)
+    datos += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objetos) + 1)
+    datos += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    datos += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objetos) + 1,
+        inicio_xref,
+    )
+    ruta = tmp_path / nombre
+    ruta.write_bytes(bytes(datos))
+    return str(ruta)
+
+
+def lados(ruta):
+    return [int(pagina.mediabox.width) for pagina in PdfReader(ruta, strict=True).pages]
+
+
+def test_fusiona_en_orden(tmp_path):
+    rutas = [
+        pdf_minimo(tmp_path, "a.pdf", [10]),
+        pdf_minimo(tmp_path, "b.pdf", [20, 30]),
+        pdf_minimo(tmp_path, "c.pdf", [40]),
+    ]
+    avances = []
+
+    resultado = fusionar_pdfs(rutas, tmp_path / "todo.pdf", avances.append)
+
+    assert resultado == (4, [])
+    assert avances == [1, 2, 3]
+    assert lados(tmp_path / "todo.pdf") == [10, 20, 30, 40]
+
+
+def test_fuente_que_falla_a_medias_no_deja_nada(tmp_path):
+    # La segunda página apunta a un objeto ilegible: la primera ya se copió
+    rota = pdf_minimo(tmp_path, "rota.pdf", [20, 30], contenido=b"<ZZ>")
+    rutas = [
+        pdf_minimo(tmp_path, "a.pdf", [10]),
+        rota,
+        pdf_minimo(tmp_path, "c.pdf", [40]),
+    ]
+
+    num_paginas, errores = fusionar_pdfs(rutas, tmp_path / "todo.pdf")
+
+    assert num_paginas == 2
+    assert [ruta for ruta, _ in errores] == [rota]
+    assert lados(tmp_path / "todo.pdf") == [10, 40]
+    # Sin objetos huérfanos: la tabla xref sólo tiene lo referenciado
+    assert PdfReader(tmp_path / "todo.pdf").trailer["/Size"] == 5
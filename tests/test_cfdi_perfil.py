@@ -0,0 +1,87 @@
+"""Perfil por etapa: acumulación, memoria y salida JSONL"""
+
+import json
+import sys
+
+import pytest
+
+from cfdi_perfil import (
+    Cronometro,
+    Perfil,
+    etapa_dominante,
+    resumen_texto,
+    rss_actual,
+    tabla_rendimiento,
+)
+
+
+def test_registrar_acumula_y_conserva_el_mayor_crecimiento():
+    perfil = Perfil("lote")
+    perfil.registrar("parseo", 1.0, 0.5, 100)
+    perfil.agregar({"parseo": (2.0, 1.5, 50), "tabla": (0.5, 0.5, 10)})
+    perfil.agregar(None)
+
+    etapas = perfil.a_dict()["etapas"]
+
+    assert etapas["parseo"] == {
+        "llamadas": 2,
+        "pared": 3.0,
+        "cpu": 2.0,
+        "rss_crecimiento": 100,
+    }
+    assert etapas["tabla"]["llamadas"] == 1
+
+
+def test_etapa_mide_el_bloque():
+    perfil = Perfil()
+
+    with perfil.etapa("lectura"):
+        sum(range(10000))
+
+    llamadas, pared, cpu, memoria = perfil.etapas["lectura"]
+    assert llamadas == 1 and pared > 0 and cpu >= 0 and memoria >= 0
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="usa /proc")
+def test_cronometro_mide_el_crecimiento_del_rss():
+    with Cronometro() as cronometro:
+        bloque = b"x" * (64 * 2**20)
+
+    assert rss_actual() > 0
+    assert cronometro.medicion[2] >= 32 * 2**20
+    del bloque
+
+
+def test_tabla_y_resumen():
+    perfil = Perfil("lote")
+    perfil.registrar("parseo", 3.0, 3.0, 2**20)
+    perfil.registrar("tabla", 1.0, 1.0, 0)
+    datos = perfil.a_dict()
+
+    tabla = tabla_rendimiento(datos)
+
+    assert tabla["Etapa"].tolist() == ["CFDI.from_string", "Construcción del DataFrame"]
+    assert tabla["% del tiempo"].tolist() == [75.0, 25.0]
+    assert tabla["Δ RSS máx. (MB)"].tolist() == [1.0, 0.0]
+    assert etapa_dominante(datos) == "parseo"
+    assert etapa_dominante(Perfil().a_dict()) is None
+    assert "parseo 3.00 s, tabla 1.00 s" in resumen_texto(datos)
+
+
+def test_escribir_jsonl(tmp_path):
+    perfil = Perfil("lote")
+    perfil.registrar("parseo", 1.0, 1.0, 0)
+    perfil.registrar("tabla", 1.0, 1.0, 0)
+    ruta = tmp_path / "perfiles" / "rendimiento.jsonl"
+
+    perfil.escribir_jsonl(str(ruta), trabajo="t1")
+    perfil.escribir_jsonl(str(ruta), trabajo="t2")
+
+    lineas = [json.loads(linea) for linea in ruta.read_text().splitlines()]
+    assert [(d["trabajo"], d["etapa"]) for d in lineas] == [
+        ("t1", "parseo"),
+        ("t1", "tabla"),
+        ("t2", "parseo"),
+        ("t2", "tabla"),
+    ]
+    assert lineas[0]["lote"] == "lote"
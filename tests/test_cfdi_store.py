@@ -0,0 +1,91 @@
+"""Almacén SQLite: upsert por CFDI, consultas por RFC y fechas y Deducible"""
+
+import threading
+
+import pandas as pd
+
+import cfdi_store
+from cfdi_extractor import COLUMNAS, COLUMNAS_MONTOS, aplicar_tipos
+from cfdi_store import AlmacenCFDI
+
+A, B = "AAA010101AAA", "BBB010101BBB"
+
+
+def conceptos(*filas):
+    """Tabla tipada con (UUID, Emisor_RFC, Fecha, Monto_Concepto) por fila"""
+    df = pd.DataFrame(filas, columns=["UUID", "Emisor_RFC", "Fecha", "Monto_Concepto"])
+    for columna in COLUMNAS:
+        if columna not in df:
+            df[columna] = 0.0 if columna in COLUMNAS_MONTOS else ""
+    return aplicar_tipos(df.assign(Categoria="Recibidos", Deducible=True))
+
+
+TABLA = conceptos(
+    ("u1", A, "2025-01-10 09:00", 100.0),
+    ("u1", A, "2025-01-10 09:00", 50.0),
+    ("u2", B, "2025-02-28 23:00", 200.0),
+    ("u3", A, "2025-03-01 08:00", 300.0),
+)
+
+
+def test_upsert_y_consultar(tmp_path):
+    almacen = AlmacenCFDI(str(tmp_path / "a.sqlite"))
+
+    assert almacen.upsert(TABLA) == 4
+
+    pd.testing.assert_frame_equal(almacen.consultar(), TABLA)
+    assert almacen.valores("Emisor_RFC") == [A, B]
+    assert almacen.uuids_existentes(["u2", "u9"]) == {"u2"}
+
+
+def test_upsert_reemplaza_los_conceptos_del_cfdi(tmp_path):
+    almacen = AlmacenCFDI(str(tmp_path / "a.sqlite"))
+    almacen.upsert(TABLA)
+
+    almacen.upsert(conceptos(("u1", A, "2025-01-10 09:00", 150.0)))
+
+    assert almacen.contar() == 3
+    assert almacen.consultar(uuids=["u1"])["Monto_Concepto"].tolist() == [150.0]
+
+
+def test_consultar_por_rfc_y_fechas(tmp_path):
+    almacen = AlmacenCFDI(str(tmp_path / "a.sqlite"))
+    almacen.upsert(TABLA)
+
+    # hasta incluye el día completo
+    febrero = almacen.consultar(desde="2025-02-01", hasta="2025-02-28")
+    de_a = almacen.consultar(emisores=[A], desde="2025-01-10")
+
+    assert febrero["UUID"].tolist() == ["u2"]
+    assert de_a["UUID"].tolist() == ["u1", "u1", "u3"]
+
+
+def test_actualizar_deducible_solo_cambia_esa_columna(tmp_path):
+    almacen = AlmacenCFDI(str(tmp_path / "a.sqlite"))
+    almacen.upsert(TABLA)
+    # El segundo concepto de u1 deja de ser deducible; u9 no está guardado
+    cambios = pd.concat([TABLA.head(2), conceptos(("u9", A, "2025-01-01", 1.0))])
+    cambios["Deducible"] = [True, False, False]
+
+    assert almacen.actualizar_deducible(cambios) == 2
+
+    esperado = TABLA.assign(Deducible=[True, False, True, True])
+    pd.testing.assert_frame_equal(almacen.consultar(), esperado)
+
+
+def test_almacen_por_defecto_es_unico_entre_hilos(tmp_path, monkeypatch):
+    monkeypatch.setenv("CFDI_STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(cfdi_store, "_almacen_global", None)
+    almacenes = []
+    hilos = [
+        threading.Thread(
+            target=lambda: almacenes.append(cfdi_store.almacen_por_defecto())
+        )
+        for _ in range(8)
+    ]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert len({id(almacen) for almacen in almacenes}) == 1
@@ -0,0 +1,170 @@
+"""Tabla de trabajos: ejecución, cancelación, reapertura y retención"""
+
+import json
+import threading
+import time
+
+import pytest
+
+import cfdi_trabajos
+from cfdi_pdf import pdfs_disponibles
+from cfdi_trabajos import (
+    CANCELADO,
+    ERROR,
+    FINALES,
+    INTERRUMPIDO,
+    TERMINADO,
+    TablaTrabajos,
+    escribir_xmls,
+    leer_xmls,
+)
+
+
+def esperar(tabla, id_trabajo, limite=10.0):
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        estado = tabla.estado(id_trabajo)
+        if estado["estado"] in FINALES:
+            return estado
+        time.sleep(0.01)
+    raise AssertionError(f"{id_trabajo} no terminó")
+
+
+def trabajo_suma(contexto, numeros, **_):
+    with open(contexto.ruta("entrada", "extra.txt"), encoding="utf-8") as f:
+        extra = int(f.read())
+    contexto.avance(len(numeros), len(numeros), "listo")
+    return {"total": sum(numeros) + extra, "partes": numeros}
+
+
+def trabajo_falla(contexto, **_):
+    raise RuntimeError("sin datos")
+
+
+liberar = threading.Event()
+
+
+def trabajo_espera(contexto, **_):
+    while not liberar.wait(0.01):
+        contexto.avance(0, 1)
+    return {}
+
+
+@pytest.fixture
+def tipos(monkeypatch):
+    liberar.clear()
+    monkeypatch.setitem(cfdi_trabajos.TIPOS, "suma", trabajo_suma)
+    monkeypatch.setitem(cfdi_trabajos.TIPOS, "falla", trabajo_falla)
+    monkeypatch.setitem(cfdi_trabajos.TIPOS, "espera", trabajo_espera)
+    yield
+    liberar.set()
+
+
+def preparar_extra(directorio):
+    with open(f"{directorio}/entrada/extra.txt", "w", encoding="utf-8") as f:
+        f.write("10")
+
+
+def test_trabajo_terminado_con_resultado(tmp_path, tipos):
+    tabla = TablaTrabajos(str(tmp_path))
+
+    id_trabajo = tabla.enviar(
+        "suma", {"numeros": [1, 2, 3], "huella": "h"}, preparar=preparar_extra
+    )
+
+    estado = esperar(tabla, id_trabajo)
+    assert estado["estado"] == TERMINADO
+    assert estado["resultado"]["total"] == 16
+    assert "rendimiento" in estado["resultado"]
+    assert tabla.buscar("suma", "h")["id"] == id_trabajo
+    # El resumen no lleva las listas de params ni del resultado
+    (resumen,) = tabla.listar()
+    assert "numeros" not in resumen["params"]
+    assert "partes" not in resumen["resultado"]
+    assert resumen["resultado"]["total"] == 16
+
+
+def test_error_y_reintento(tmp_path, tipos):
+    tabla = TablaTrabajos(str(tmp_path))
+    id_trabajo = tabla.enviar("falla")
+
+    estado = esperar(tabla, id_trabajo)
+
+    assert estado["estado"] == ERROR
+    assert "RuntimeError: sin datos" in estado["error"]
+    assert tabla.buscar("falla", None) is None
+    assert tabla.reintentar(id_trabajo)
+    assert esperar(tabla, id_trabajo)["estado"] == ERROR
+
+
+def test_cancelar(tmp_path, tipos):
+    tabla = TablaTrabajos(str(tmp_path))
+    id_trabajo = tabla.enviar("espera")
+
+    tabla.cancelar(id_trabajo)
+
+    assert esperar(tabla, id_trabajo)["estado"] == CANCELADO
+
+
+def test_tipo_desconocido(tmp_path):
+    with pytest.raises(ValueError):
+        TablaTrabajos(str(tmp_path)).enviar("otro")
+
+
+def test_listar_por_dueno(tmp_path, tipos):
+    tabla = TablaTrabajos(str(tmp_path))
+    mio = tabla.enviar("falla", dueno="a")
+    ajeno = tabla.enviar("falla", dueno="b")
+    esperar(tabla, mio)
+    esperar(tabla, ajeno)
+
+    assert [r["id"] for r in tabla.listar(dueno="a")] == [mio]
+    # El dueño se guarda con el estado y sobrevive a reabrir la tabla
+    reabierta = TablaTrabajos(str(tmp_path))
+    assert [r["id"] for r in reabierta.listar(dueno="b")] == [ajeno]
+    assert len(reabierta.listar()) == 2
+
+
+def test_reabrir_marca_interrumpidos(tmp_path, tipos):
+    tabla = TablaTrabajos(str(tmp_path), workers=1)
+    en_curso = tabla.enviar("espera")
+    terminado = tabla.enviar("suma", {"numeros": [1]}, preparar=preparar_extra)
+    liberar.set()
+    esperar(tabla, terminado)
+    esperar(tabla, en_curso)
+    # Un estado en curso en disco es de un proceso que se detuvo
+    ruta = tabla.ruta(en_curso, cfdi_trabajos.ARCHIVO_ESTADO)
+    with open(ruta, encoding="utf-8") as f:
+        estado = json.load(f)
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(dict(estado, estado="corriendo"), f)
+
+    reabierta = TablaTrabajos(str(tmp_path))
+
+    estados = {r["id"]: r["estado"] for r in reabierta.listar()}
+    assert estados == {en_curso: INTERRUMPIDO, terminado: TERMINADO}
+    assert [r["id"] for r in reabierta.listar(limite=1)] == [terminado]
+
+
+def test_retencion_borra_los_terminados(tmp_path, tipos):
+    tabla = TablaTrabajos(str(tmp_path), retencion=60)
+    id_trabajo = tabla.enviar("suma", {"numeros": [1]}, preparar=preparar_extra)
+    esperar(tabla, id_trabajo)
+
+    assert tabla.purgar() == []
+    assert tabla.purgar(ahora=time.time() + 120) == [id_trabajo]
+    assert tabla.listar() == []
+    assert tabla.estado(id_trabajo) is None
+    assert not (tmp_path / id_trabajo).exists()
+    # Una sesión que aún apunta a archivos del trabajo lo detecta
+    ruta = str(tmp_path / id_trabajo / "pdfs" / "a.pdf")
+    assert not pdfs_disponibles([{"filename": "a.pdf", "path": ruta}])
+
+
+def test_escribir_y_leer_xmls(tmp_path):
+    xmls = [
+        {"filename": "a.xml", "content": b"<a/>"},
+        {"filename": "a.xml", "content": b"<b/>"},
+    ]
+
+    assert leer_xmls(escribir_xmls(xmls, str(tmp_path / "x.zip"))) == xmls